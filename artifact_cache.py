@@ -0,0 +1,163 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import asdict
+from typing import Callable, List, Optional
+
+import numpy as np
+import torch
+
+from lib.faster_whisper import decode_audio
+from lib.faster_whisper.vad import VadOptions, get_speech_timestamps, get_speech_timestamps_batch
+
+
+class ArtifactCache:
+    """Content-addressed cache of the artifacts computed from a downloaded input file.
+
+    Artifacts are stored next to the input, in ``tmp/<md5 of url>/artifacts/``, and every
+    file name carries the md5 of the input content plus the parameters it was computed
+    with, so reprocessing an episode with other decode parameters reuses the decoded PCM
+    (memory-mapped from a ``.npy``) and the VAD speech chunks (JSON) and goes straight to
+    the encoder. The least recently used artifacts are evicted once the artifacts of all
+    inputs under ``root`` take more than ``max_bytes``.
+    """
+
+    def __init__(self, root: str = 'tmp', max_bytes: int = 20 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def load_audio(self, audio_file: str, sampling_rate: int) -> torch.Tensor:
+        path = self._artifact_path(audio_file, 'pcm', {'sampling_rate': sampling_rate}, '.npy')
+        if self._hit(path):
+            logging.info(f"[ArtifactCache] load decoded audio from {path}")
+            # copy-on-write pages: nothing is read before it is sliced and the file is never written back
+            return torch.from_numpy(np.load(path, mmap_mode='c'))
+
+        audio = decode_audio(audio_file, sampling_rate=sampling_rate)
+        self._store(path, lambda f: np.save(f, audio.numpy()))
+        return audio
+
+    def load_speech_chunks(self, audio_file: str, audio: torch.Tensor, vad_options: VadOptions, sampling_rate: int,
+                           start_sample: int = 0) -> List[dict]:
+        """Returns the VAD speech chunks of ``audio``, the slice of ``audio_file`` starting at ``start_sample``."""
+        path = self._speech_chunks_path(audio_file, audio, vad_options, sampling_rate, start_sample)
+        if self._hit(path):
+            with open(path) as f:
+                return json.load(f)
+
+        speech_chunks = get_speech_timestamps(audio, vad_options, sampling_rate=sampling_rate)
+        self._store(path, lambda f: f.write(json.dumps(speech_chunks).encode()))
+        return speech_chunks
+
+    def load_speech_chunks_batch(self, audio_file: str, audios: List[torch.Tensor], start_samples: List[int],
+                                 vad_options: VadOptions, sampling_rate: int) -> List[List[dict]]:
+        """Like ``load_speech_chunks`` for many slices of ``audio_file``, the misses run through the VAD as one batch."""
+        paths = [self._speech_chunks_path(audio_file, audio, vad_options, sampling_rate, start_sample)
+                 for audio, start_sample in zip(audios, start_samples)]
+        results: List[Optional[List[dict]]] = [None] * len(audios)
+        misses = []
+        for i, path in enumerate(paths):
+            if self._hit(path):
+                with open(path) as f:
+                    results[i] = json.load(f)
+            else:
+                misses.append(i)
+
+        if misses:
+            logging.info(f"[ArtifactCache] run the VAD of {len(misses)} of {len(audios)} slices as one batch")
+            batch = get_speech_timestamps_batch([audios[i] for i in misses], vad_options, sampling_rate=sampling_rate)
+            for i, speech_chunks in zip(misses, batch):
+                self._store(paths[i], lambda f, speech_chunks=speech_chunks: f.write(json.dumps(speech_chunks).encode()))
+                results[i] = speech_chunks
+        return results
+
+    def file_hash(self, audio_file: str) -> str:
+        # hashing a long episode takes a while, remember it until the file changes
+        stat = os.stat(audio_file)
+        hash_file = os.path.join(os.path.dirname(audio_file), 'artifacts', 'source.json')
+        try:
+            with open(hash_file) as f:
+                source = json.load(f)
+            if source['size'] == stat.st_size and source['mtime_ns'] == stat.st_mtime_ns:
+                return source['md5']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        md5 = hashlib.md5()
+        with open(audio_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                md5.update(block)
+        source = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'md5': md5.hexdigest()}
+        self._store(hash_file, lambda f: f.write(json.dumps(source).encode()), evict=False)
+        return source['md5']
+
+    def evict(self):
+        files = []
+        for path in glob.glob(os.path.join(self.root, '*', 'artifacts', '*')):
+            if os.path.basename(path) == 'source.json' or '.tmp' in path:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_bytes <= self.max_bytes:
+                break
+            logging.info(f"[ArtifactCache] evict {path} ({size / 1024 / 1024:.0f}MB)")
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+
+    def _speech_chunks_path(self, audio_file: str, audio: torch.Tensor, vad_options: VadOptions, sampling_rate: int,
+                            start_sample: int) -> str:
+        params = {
+            'vad_options': asdict(vad_options),
+            'sampling_rate': sampling_rate,
+            'start_sample': start_sample,
+            'num_samples': audio.shape[0],
+        }
+        return self._artifact_path(audio_file, 'vad', params, '.json')
+
+    def _artifact_path(self, audio_file: str, kind: str, params: dict, suffix: str) -> str:
+        key = json.dumps({'file': self.file_hash(audio_file), **params}, sort_keys=True)
+        name = f"{kind}-{hashlib.md5(key.encode()).hexdigest()}{suffix}"
+        return os.path.join(os.path.dirname(audio_file), 'artifacts', name)
+
+    @staticmethod
+    def _hit(path: str) -> bool:
+        try:
+            # the mtime doubles as the last use of the artifact for the LRU eviction
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def _store(self, path: str, write: Callable, evict: bool = True):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        # readers never see a partially written artifact
+        os.replace(tmp_path, path)
+        if evict:
+            with self.lock:
+                self.evict()
+
+
+_artifact_cache: Optional[ArtifactCache] = None
+
+
+def get_artifact_cache() -> ArtifactCache:
+    global _artifact_cache
+    if _artifact_cache is None:
+        _artifact_cache = ArtifactCache(max_bytes=int(float(os.environ.get('ASR_CACHE_BUDGET_GB', 20)) * 1024 ** 3))
+    return _artifact_cache
@@ -0,0 +1,148 @@
+import datetime
+import logging
+import queue
+import threading
+import time
+import uuid
+from dataclasses import dataclass, asdict
+from typing import Optional, List, Dict, Iterator
+
+from service import stream_asr_task
+from transcriber import Transcriber, get_transcriber, format_segment
+
+
+class JobStatus:
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+
+@dataclass
+class AsrJob:
+    id: str
+    audio_url: str
+    segment_duration: int
+    status: str = JobStatus.PENDING
+    result: Optional[List[str]] = None
+    error: Optional[str] = None
+    created_at: Optional[str] = None
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
+    def to_json(self):
+        return asdict(self)
+
+
+class AsrJobQueue:
+    """In-process job queue worked through by a fixed pool of worker threads.
+
+    The workers share the process-wide transcriber of ``model_size`` which is loaded and
+    warmed up once in ``start``, so concurrent HTTP requests share a warm model instead of
+    loading one per request. Result lines are appended to the job in timeline order while
+    it runs, ``iter_lines`` follows them as they arrive.
+
+    Finished jobs are kept for ``finished_job_ttl`` seconds and at most ``max_finished_jobs``
+    of them, the oldest ones are evicted first. ``batching`` is passed to ``get_transcriber``.
+    """
+
+    def __init__(self, pool_size: int = 2, num_workers: int = 6, model_size: str = 'large-v3-turbo',
+                 finished_job_ttl: float = 3600, max_finished_jobs: int = 1000, batching: Optional[bool] = None):
+        self.pool_size = pool_size
+        self.num_workers = num_workers
+        self.model_size = model_size
+        self.batching = batching
+        self.finished_job_ttl = finished_job_ttl
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: Dict[str, AsrJob] = {}
+        # ids of the finished jobs in the order they finished, with their monotonic finish time
+        self.finished: Dict[str, float] = {}
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        # notified on every new result line and when a job finishes
+        self.updated = threading.Condition(self.lock)
+        self.start_lock = threading.Lock()
+        self.workers = []
+
+    def start(self):
+        with self.start_lock:
+            if self.workers:
+                return
+            transcriber = get_transcriber(self.model_size, self.num_workers, batching=self.batching)
+            for i in range(self.pool_size):
+                worker = threading.Thread(target=self._work, args=(transcriber,), name=f'asr-worker-{i}', daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def submit(self, audio_url: str, segment_duration: int) -> AsrJob:
+        job = AsrJob(
+            id=uuid.uuid4().hex,
+            audio_url=audio_url,
+            segment_duration=segment_duration,
+            created_at=datetime.datetime.now().isoformat(),
+        )
+        with self.lock:
+            self._evict_finished()
+            self.jobs[job.id] = job
+        self.queue.put(job.id)
+        logging.info(f"[AsrJobQueue] submit job {job.id}, pending jobs: {self.queue.qsize()}")
+        return job
+
+    def get(self, job_id: str) -> Optional[AsrJob]:
+        with self.lock:
+            self._evict_finished()
+            return self.jobs.get(job_id)
+
+    def iter_lines(self, job: AsrJob) -> Iterator[str]:
+        """Yields the result lines of a job, blocking for new lines until the job is finished.
+
+        Takes the job returned by ``get`` so it is followed even if it is evicted meanwhile.
+        """
+        sent = 0
+        while True:
+            with self.updated:
+                self.updated.wait_for(lambda: len(job.result or []) > sent or job.finished_at is not None)
+                lines = (job.result or [])[sent:]
+                finished = job.finished_at is not None
+            yield from lines
+            sent += len(lines)
+            if finished:
+                return
+
+    def _work(self, transcriber: Transcriber):
+        while True:
+            job_id = self.queue.get()
+            job = self.get(job_id)
+            with self.updated:
+                job.status = JobStatus.RUNNING
+                job.started_at = datetime.datetime.now().isoformat()
+                job.result = []
+            try:
+                for segment in stream_asr_task(job.audio_url, self.num_workers, job.segment_duration, transcriber):
+                    with self.updated:
+                        job.result.append(format_segment(segment))
+                        self.updated.notify_all()
+                with self.updated:
+                    job.status = JobStatus.SUCCEEDED
+            except Exception as e:
+                logging.exception(f"[AsrJobQueue] job {job.id} failed")
+                with self.updated:
+                    job.error = str(e)
+                    job.status = JobStatus.FAILED
+            finally:
+                with self.updated:
+                    job.finished_at = datetime.datetime.now().isoformat()
+                    self.finished[job.id] = time.monotonic()
+                    self._evict_finished()
+                    self.updated.notify_all()
+                self.queue.task_done()
+
+    def _evict_finished(self):
+        """Drops the finished jobs past their ttl or past the count limit, the caller holds the lock."""
+        expired_before = time.monotonic() - self.finished_job_ttl
+        while self.finished:
+            job_id, finished_at = next(iter(self.finished.items()))
+            if len(self.finished) <= self.max_finished_jobs and finished_at > expired_before:
+                break
+            del self.finished[job_id]
+            del self.jobs[job_id]
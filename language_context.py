@@ -0,0 +1,91 @@
+import bisect
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+import torch
+
+from lib.faster_whisper import WhisperModel
+from split_audio_files import AudioSegment
+
+
+@dataclass
+class LanguageContext:
+    """The language of a job, detected once from probes across all of its audio segments.
+
+    `language` is a language code, or 'multi' when the confident probes disagree.
+    """
+    language: str
+    probability: float
+    # the languages of the confident probes of every audio segment, by segment index
+    segment_languages: List[List[str]]
+
+    def language_for(self, index: int, recheck: bool = True) -> Optional[str]:
+        """The language to transcribe the audio segment `index` with.
+
+        In a 'multi' job, a segment whose own probes agree is transcribed in their language.
+        A segment whose probes disagree is left to its own language detection when `recheck`
+        is set (None), otherwise transcribed as 'multi'.
+        """
+        if self.language != 'multi':
+            return self.language
+        languages = set(self.segment_languages[index])
+        if len(languages) == 1:
+            return languages.pop()
+        return None if recheck else 'multi'
+
+
+def probe_starts(segment: AudioSegment, probes: int, probe_samples: int) -> List[int]:
+    """Start samples of `probes` probes in the segment, spread evenly over its speech."""
+    length = segment.audio.shape[0]
+    chunks = segment.speech_chunks or [{'start': 0, 'end': length}]
+    speech_ends = []
+    speech = 0
+    for chunk in chunks:
+        speech += chunk['end'] - chunk['start']
+        speech_ends.append(speech)
+
+    starts = []
+    for k in range(probes):
+        # the middle of the k-th of `probes` equal shares of the speech
+        target_speech = speech * (2 * k + 1) / (2 * probes)
+        i = min(bisect.bisect_left(speech_ends, target_speech), len(chunks) - 1)
+        center = int(chunks[i]['end'] - (speech_ends[i] - target_speech))
+        starts.append(max(0, min(center - probe_samples // 2, length - probe_samples)))
+    return starts
+
+
+def detect_job_language(model: WhisperModel, audio_segments: List[AudioSegment], probes_per_segment: int = 2,
+                        threshold: float = 0.85) -> Optional[LanguageContext]:
+    """Detects the language of all in-memory audio segments with one batched encoder pass.
+
+    Like the per-segment detection of `WhisperModel.transcribe`, the job gets a language
+    when all probes with a probability of at least `threshold` agree, 'multi' otherwise.
+    Returns None when the segments are files, which detect their language themselves.
+    """
+    if not audio_segments or not all(isinstance(segment.audio, torch.Tensor) for segment in audio_segments):
+        return None
+
+    probe_samples = model.feature_extractor.n_samples
+    probes = []
+    probe_segments = []
+    for segment in audio_segments:
+        for start in probe_starts(segment, probes_per_segment, probe_samples):
+            probes.append(segment.audio[start:start + probe_samples])
+            probe_segments.append(segment.index)
+
+    segment_languages = [[] for _ in audio_segments]
+    probabilities = {}
+    for index, language_probs in zip(probe_segments, model.detect_language_probes(probes)):
+        language, probability = language_probs[0]
+        if probability >= threshold:
+            segment_languages[index].append(language)
+            probabilities[language] = max(probability, probabilities.get(language, 0))
+
+    if len(probabilities) == 1:
+        language, probability = probabilities.popitem()
+    else:
+        language, probability = 'multi', 1
+    logging.info(f"[detect_job_language] {len(probes)} probes of {len(audio_segments)} segments: {language}, "
+                 f"segment languages: {segment_languages}")
+    return LanguageContext(language, probability, segment_languages)
@@ -1,4 +1,4 @@
-from lib.faster_whisper.audio import decode_audio
+from lib.faster_whisper.audio import decode_audio, stream_audio
 from lib.faster_whisper.transcribe import BatchedInferencePipeline, WhisperModel
 from lib.faster_whisper.utils import available_models, download_model, format_timestamp
 from lib.faster_whisper.version import __version__
@@ -6,6 +6,7 @@ from lib.faster_whisper.version import __version__
 __all__ = [
     "available_models",
     "decode_audio",
+    "stream_audio",
     "WhisperModel",
     "BatchedInferencePipeline",
     "download_model",
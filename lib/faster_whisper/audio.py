@@ -7,10 +7,9 @@ However, the API is quite low-level so we need to manipulate audio frames direct
 """
 
 import gc
-import io
 import itertools
 
-from typing import BinaryIO, Union
+from typing import BinaryIO, Iterator, Optional, Union
 
 import av
 import numpy as np
@@ -24,6 +23,9 @@ def decode_audio(
 ):
     """Decodes the audio.
 
+    The samples are converted to float32 straight into a buffer preallocated from the
+    container duration, so the whole waveform is only held once in memory.
+
     Args:
       input_file: Path to the input file or a file-like object.
       sampling_rate: Resample the audio to this sample rate.
@@ -35,25 +37,25 @@ def decode_audio(
       If `split_stereo` is enabled, the function returns a 2-tuple with the
       separated left and right channels.
     """
-    resampler = av.audio.resampler.AudioResampler(
-        format="s16",
-        layout="mono" if not split_stereo else "stereo",
-        rate=sampling_rate,
-    )
-
-    raw_buffer = io.BytesIO()
-    dtype = None
+    resampler = _create_resampler(sampling_rate, split_stereo)
+    num_channels = 2 if split_stereo else 1
 
     with av.open(input_file, mode="r", metadata_errors="ignore") as container:
-        frames = container.decode(audio=0)
-        frames = _ignore_invalid_frames(frames)
-        frames = _group_frames(frames, 500000)
-        frames = _resample_frames(frames, resampler)
-
-        for frame in frames:
-            array = frame.to_ndarray()
-            dtype = array.dtype
-            raw_buffer.write(array)
+        estimated_samples = _estimate_num_samples(container, sampling_rate)
+        capacity = (estimated_samples or 30 * sampling_rate) * num_channels
+        audio = np.empty(capacity, dtype=np.float32)
+        num_samples = 0
+
+        for array in _decode_frames(container, resampler):
+            array = array.reshape(-1)
+            end = num_samples + array.shape[0]
+            if end > audio.shape[0]:
+                grown = np.empty(max(end, 2 * audio.shape[0]), dtype=np.float32)
+                grown[:num_samples] = audio[:num_samples]
+                audio = grown
+            # Convert s16 to f32 while copying.
+            np.divide(array, 32768.0, out=audio[num_samples:end], dtype=np.float32)
+            num_samples = end
 
     # It appears that some objects related to the resampler are not freed
     # unless the garbage collector is manually run.
@@ -64,11 +66,99 @@ def decode_audio(
     del resampler
     gc.collect()
 
-    audio = np.frombuffer(raw_buffer.getbuffer(), dtype=dtype)
+    if num_samples < 0.9 * audio.shape[0]:
+        # the estimate was way off, don't keep the unused tail alive
+        audio = audio[:num_samples].copy()
+    else:
+        audio = audio[:num_samples]
+
+    return _to_tensor(audio, split_stereo)
+
+
+def stream_audio(
+    input_file: Union[str, BinaryIO],
+    block_seconds: float = 30,
+    sampling_rate: int = 16000,
+    split_stereo: bool = False,
+) -> Iterator:
+    """Decodes the audio block by block.
+
+    Peak memory scales with `block_seconds` instead of the length of the input.
+
+    Args:
+      input_file: Path to the input file or a file-like object.
+      block_seconds: Duration of each yielded block, the last block may be shorter.
+      sampling_rate: Resample the audio to this sample rate.
+      split_stereo: Yield separate left and right channels.
+
+    Yields:
+      float32 tensors of `block_seconds * sampling_rate` samples.
+
+      If `split_stereo` is enabled, 2-tuples with the separated left and right channels.
+    """
+    resampler = _create_resampler(sampling_rate, split_stereo)
+    num_channels = 2 if split_stereo else 1
+    block_size = int(block_seconds * sampling_rate) * num_channels
+    if block_size <= 0:
+        raise ValueError("block_seconds is too small, got %s" % block_seconds)
+
+    try:
+        with av.open(input_file, mode="r", metadata_errors="ignore") as container:
+            block = np.empty(block_size, dtype=np.float32)
+            filled = 0
+
+            for array in _decode_frames(container, resampler):
+                array = array.reshape(-1)
+                while array.shape[0] > 0:
+                    count = min(block_size - filled, array.shape[0])
+                    np.divide(array[:count], 32768.0, out=block[filled : filled + count], dtype=np.float32)
+                    filled += count
+                    array = array[count:]
+
+                    if filled == block_size:
+                        yield _to_tensor(block, split_stereo)
+                        block = np.empty(block_size, dtype=np.float32)
+                        filled = 0
+
+            if filled > 0:
+                yield _to_tensor(block[:filled], split_stereo)
+    finally:
+        # See decode_audio.
+        del resampler
+        gc.collect()
+
+
+def _create_resampler(sampling_rate: int, split_stereo: bool):
+    return av.audio.resampler.AudioResampler(
+        format="s16",
+        layout="mono" if not split_stereo else "stereo",
+        rate=sampling_rate,
+    )
+
+
+def _decode_frames(container, resampler):
+    frames = container.decode(audio=0)
+    frames = _ignore_invalid_frames(frames)
+    frames = _group_frames(frames, 500000)
+    frames = _resample_frames(frames, resampler)
+
+    for frame in frames:
+        yield frame.to_ndarray()
+
+
+def _estimate_num_samples(container, sampling_rate: int) -> Optional[int]:
+    # Slightly overestimate so that the buffer does not have to grow at the very end.
+    if container.duration is not None:
+        return int((container.duration / av.time_base + 1) * sampling_rate)
+
+    stream = container.streams.audio[0]
+    if stream.duration is not None and stream.time_base is not None:
+        return int((float(stream.duration * stream.time_base) + 1) * sampling_rate)
+
+    return None
 
-    # Convert s16 back to f32.
-    audio = audio.astype(np.float32) / 32768.0
 
+def _to_tensor(audio: np.ndarray, split_stereo: bool):
     if split_stereo:
         left_channel = audio[0::2]
         right_channel = audio[1::2]
@@ -0,0 +1,258 @@
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, List, Union
+
+import ctranslate2
+import numpy as np
+import torch
+
+
+def split_storage_view(storage: ctranslate2.StorageView, batch_size: int) -> List[ctranslate2.StorageView]:
+    """Splits a batched StorageView along its first dimension into views of batch size 1."""
+    if batch_size == 1:
+        return [storage]
+    if storage.device == "cuda":
+        array = torch.as_tensor(storage, device="cuda")
+        return [ctranslate2.StorageView.from_array(array[i : i + 1].contiguous()) for i in range(batch_size)]
+    array = np.asarray(storage)
+    return [ctranslate2.StorageView.from_array(np.ascontiguousarray(array[i : i + 1])) for i in range(batch_size)]
+
+
+def concat_storage_views(storages: List[ctranslate2.StorageView]) -> ctranslate2.StorageView:
+    """Concatenates StorageViews along their first dimension."""
+    if len(storages) == 1:
+        return storages[0]
+    if storages[0].device == "cuda":
+        return ctranslate2.StorageView.from_array(
+            torch.cat([torch.as_tensor(storage, device="cuda") for storage in storages])
+        )
+    return ctranslate2.StorageView.from_array(np.concatenate([np.asarray(storage) for storage in storages]))
+
+
+class _Request:
+    def __init__(self, key: Hashable, payload: Any):
+        self.key = key
+        self.payload = payload
+        self.arrival = time.monotonic()
+        self.future = Future()
+
+
+class RequestBatcher:
+    """Runs the requests of concurrent callers in batches of requests with the same key.
+
+    `num_threads` dispatcher threads form and run the batches. A dispatcher takes the first
+    key with `max_batch_size` pending requests, or else the key of the oldest pending
+    request once `max_wait_ms` passed since its arrival, and runs up to `max_batch_size` of
+    its requests with one call of `run_batch`. Requests with other keys stay pending for
+    the next batches. With several dispatchers, one batch can fill up while others run,
+    e.g. on the other replicas of a model with `inter_threads` > 1.
+    """
+
+    def __init__(self, max_batch_size: int = 8, max_wait_ms: float = 10, name: str = "batcher", num_threads: int = 1):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.num_batches = 0
+        self.num_requests = 0
+        self._lock = threading.Lock()
+        # notified on every new request
+        self._submitted = threading.Condition(self._lock)
+        # key -> pending requests of that key, in arrival order
+        self._pending = OrderedDict()
+        self._threads = [
+            threading.Thread(target=self._run, name="%s-%d" % (name, i), daemon=True) for i in range(num_threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def run_batch(self, key: Hashable, payloads: List[Any]) -> List[Any]:
+        raise NotImplementedError
+
+    def submit(self, key: Hashable, payload: Any) -> Any:
+        """Blocks until the batch of the request ran, returns the result of the request."""
+        request = _Request(key, payload)
+        with self._submitted:
+            self._pending.setdefault(key, []).append(request)
+            self._submitted.notify_all()
+        return request.future.result()
+
+    def _next_batch(self) -> List[_Request]:
+        with self._submitted:
+            while True:
+                batch = self._take_ready_batch()
+                if batch:
+                    return batch
+                if self._pending:
+                    oldest = min(requests[0].arrival for requests in self._pending.values())
+                    self._submitted.wait(oldest + self.max_wait - time.monotonic())
+                else:
+                    self._submitted.wait()
+
+    def _take_ready_batch(self) -> List[_Request]:
+        """Removes and returns the next batch to run, empty while every pending batch may still grow."""
+        ready = [key for key, requests in self._pending.items() if len(requests) >= self.max_batch_size]
+        if not ready and self._pending:
+            key = min(self._pending, key=lambda key: self._pending[key][0].arrival)
+            if time.monotonic() >= self._pending[key][0].arrival + self.max_wait:
+                ready = [key]
+        if not ready:
+            return []
+
+        requests = self._pending[ready[0]]
+        batch = requests[: self.max_batch_size]
+        del requests[: self.max_batch_size]
+        if not requests:
+            del self._pending[ready[0]]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self.run_batch(batch[0].key, [request.payload for request in batch])
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            with self._lock:
+                self.num_batches += 1
+                self.num_requests += len(batch)
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+
+
+class EncoderBatcher(RequestBatcher):
+    """Runs the encoder on the windows of concurrent transcriptions as one batch.
+
+    Every caller of `encode` blocks until its window went through the encoder.
+
+    Args:
+      encode_batch: Encodes mel windows of shape (batch_size, n_mels, frames).
+      max_batch_size: Maximum number of windows per encoder call.
+      max_wait_ms: Maximum time the first window of a batch waits for others.
+      num_threads: Number of encoder calls that may run at the same time.
+    """
+
+    def __init__(
+        self,
+        encode_batch: Callable[[torch.Tensor], ctranslate2.StorageView],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10,
+        num_threads: int = 1,
+    ):
+        self.encode_batch = encode_batch
+        super().__init__(max_batch_size, max_wait_ms, name="encoder-batcher", num_threads=num_threads)
+
+    @property
+    def num_windows(self) -> int:
+        return self.num_requests
+
+    def encode(self, features: torch.Tensor) -> ctranslate2.StorageView:
+        """Encodes one mel window of shape (n_mels, frames), returns an output of batch size 1."""
+        return self.submit(None, features)
+
+    def run_batch(self, key: Hashable, payloads: List[torch.Tensor]) -> List[ctranslate2.StorageView]:
+        return split_storage_view(self.encode_batch(torch.stack(payloads)), len(payloads))
+
+
+class DecodeBatcher(RequestBatcher):
+    """Runs the generate calls of concurrent transcriptions with the same options as one batch.
+
+    Only calls with equal keyword arguments (beam size, temperature, suppressed tokens, ...)
+    and prompts of the same length share a batch, so every prompt is decoded as it would be
+    on its own, and a temperature fallback joins the other fallbacks at its temperature
+    instead of holding back the first attempts of other windows.
+
+    Args:
+      generate: The batched ctranslate2 generate function.
+      max_batch_size: Maximum number of prompts per generate call.
+      max_wait_ms: Maximum time the first prompt of a batch waits for others.
+      num_threads: Number of generate calls that may run at the same time.
+    """
+
+    def __init__(
+        self,
+        generate: Callable[..., List[ctranslate2.models.WhisperGenerationResult]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10,
+        num_threads: int = 1,
+    ):
+        self.generate_batch = generate
+        super().__init__(max_batch_size, max_wait_ms, name="decode-batcher", num_threads=num_threads)
+
+    def generate(
+        self, encoder_output: ctranslate2.StorageView, prompt: List[int], **kwargs
+    ) -> ctranslate2.models.WhisperGenerationResult:
+        """Generates from an encoder output of batch size 1 and one prompt, returns its result."""
+        options = tuple(
+            sorted((name, tuple(value) if isinstance(value, list) else value) for name, value in kwargs.items())
+        )
+        return self.submit((len(prompt), options), (encoder_output, prompt))
+
+    def run_batch(self, key: Hashable, payloads: List[tuple]) -> List[ctranslate2.models.WhisperGenerationResult]:
+        _, options = key
+        encoder_output = concat_storage_views([encoder_output for encoder_output, _ in payloads])
+        prompts = [prompt for _, prompt in payloads]
+        kwargs = {name: list(value) if isinstance(value, tuple) else value for name, value in options}
+        return self.generate_batch(encoder_output, prompts, **kwargs)
+
+
+class AlignBatcher(RequestBatcher):
+    """Runs the word alignments of concurrent transcriptions as one batched align call.
+
+    Only calls with the same start sequence and median filter width share a batch. Every
+    caller may align several items, each with its own encoder output and frame count.
+
+    Args:
+      align: The batched ctranslate2 align function.
+      max_batch_size: Maximum number of align calls per batch.
+      max_wait_ms: Maximum time the first call of a batch waits for others.
+      num_threads: Number of align calls that may run at the same time.
+    """
+
+    def __init__(
+        self,
+        align: Callable[..., List[ctranslate2._ext.WhisperAlignmentResult]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10,
+        num_threads: int = 1,
+    ):
+        self.align_batch = align
+        super().__init__(max_batch_size, max_wait_ms, name="align-batcher", num_threads=num_threads)
+
+    def align(
+        self,
+        encoder_output: ctranslate2.StorageView,
+        start_sequence: List[int],
+        text_tokens: List[List[int]],
+        num_frames: Union[int, List[int]],
+        median_filter_width: int = 7,
+    ) -> List[ctranslate2._ext.WhisperAlignmentResult]:
+        """Aligns `text_tokens` against an encoder output with one batch item per text."""
+        if isinstance(num_frames, int):
+            num_frames = [num_frames] * len(text_tokens)
+        return self.submit((tuple(start_sequence), median_filter_width), (encoder_output, text_tokens, num_frames))
+
+    def run_batch(self, key: Hashable, payloads: List[tuple]) -> List[List[ctranslate2._ext.WhisperAlignmentResult]]:
+        start_sequence, median_filter_width = key
+        encoder_output = concat_storage_views([encoder_output for encoder_output, _, _ in payloads])
+        text_tokens = [tokens for _, payload_tokens, _ in payloads for tokens in payload_tokens]
+        num_frames = [frames for _, _, payload_frames in payloads for frames in payload_frames]
+        results = self.align_batch(
+            encoder_output,
+            list(start_sequence),
+            text_tokens,
+            num_frames,
+            median_filter_width=median_filter_width,
+        )
+
+        # give every caller the results of its own items
+        outputs = []
+        start = 0
+        for _, payload_tokens, _ in payloads:
+            outputs.append(results[start : start + len(payload_tokens)])
+            start += len(payload_tokens)
+        return outputs
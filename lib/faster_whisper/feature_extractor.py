@@ -1,3 +1,7 @@
+import threading
+
+from typing import Dict, List, Tuple, Union
+
 import torch
 
 
@@ -26,6 +30,33 @@ class FeatureExtractor:
         self.mel_filters = self.get_mel_filters(
             sampling_rate, n_fft, n_mels=feature_size
         )
+        # device -> (hann window, mel filters) on that device, shared by all threads
+        self._device_constants: Dict[str, Tuple[torch.Tensor, torch.Tensor]] = {}
+        self._device_constants_lock = threading.Lock()
+
+    def chunk_size(self, chunk_length=None) -> Tuple[int, int]:
+        """Returns the samples and frames of a chunk of `chunk_length` seconds.
+
+        The default chunk length is used when `chunk_length` is None.
+        """
+        if chunk_length is None:
+            return self.n_samples, self.nb_max_frames
+        n_samples = chunk_length * self.sampling_rate
+        return n_samples, n_samples // self.hop_length
+
+    def _constants(self, device: torch.device) -> Tuple[torch.Tensor, torch.Tensor]:
+        key = str(device)
+        constants = self._device_constants.get(key)
+        if constants is None:
+            with self._device_constants_lock:
+                constants = self._device_constants.get(key)
+                if constants is None:
+                    constants = (
+                        torch.hann_window(self.n_fft).to(device),
+                        self.mel_filters.to(device),
+                    )
+                    self._device_constants[key] = constants
+        return constants
 
     @staticmethod
     def get_mel_filters(sr, n_fft, n_mels=128):
@@ -75,14 +106,33 @@ class FeatureExtractor:
 
         return weights
 
-    def __call__(self, waveform, padding=True, chunk_length=None, to_cpu=False):
+    def __call__(
+        self,
+        waveform: Union[torch.Tensor, List[torch.Tensor]],
+        padding=True,
+        chunk_length=None,
+        to_cpu=False,
+    ):
         """
         Compute the log-Mel spectrogram of the provided audio.
-        """
 
-        if chunk_length is not None:
-            self.n_samples = chunk_length * self.sampling_rate
-            self.nb_max_frames = self.n_samples // self.hop_length
+        A list of waveforms is computed with one STFT over the batch of the waveforms
+        padded to the longest one, and returns features of shape
+        (batch, n_mels, frames). Every item is normalized by its own maximum, so its
+        first frames equal the features of its waveform alone.
+        """
+        n_samples, _ = self.chunk_size(chunk_length)
+
+        if isinstance(waveform, (list, tuple)):
+            longest = max(item.shape[0] for item in waveform)
+            waveform = torch.stack(
+                [
+                    torch.nn.functional.pad(
+                        item.to(torch.float32), (0, longest - item.shape[0])
+                    )
+                    for item in waveform
+                ]
+            )
 
         if waveform.dtype is not torch.float32:
             waveform = waveform.to(torch.float32)
@@ -94,19 +144,20 @@ class FeatureExtractor:
         )
 
         if padding:
-            waveform = torch.nn.functional.pad(waveform, (0, self.n_samples))
+            waveform = torch.nn.functional.pad(waveform, (0, n_samples))
 
-        window = torch.hann_window(self.n_fft).to(waveform.device)
+        window, mel_filters = self._constants(waveform.device)
 
         stft = torch.stft(
             waveform, self.n_fft, self.hop_length, window=window, return_complex=True
         )
         magnitudes = stft[..., :-1].abs() ** 2
 
-        mel_spec = self.mel_filters.to(waveform.device) @ magnitudes
+        mel_spec = mel_filters @ magnitudes
 
         log_spec = torch.clamp(mel_spec, min=1e-10).log10()
-        log_spec = torch.maximum(log_spec, log_spec.max() - 8.0)
+        log_spec_max = log_spec.amax(dim=(-2, -1), keepdim=True)
+        log_spec = torch.maximum(log_spec, log_spec_max - 8.0)
         log_spec = (log_spec + 4.0) / 4.0
 
         # When the model is running on multiple GPUs, the output should be moved
@@ -1,9 +1,11 @@
+import bisect
 import string
 
 from functools import cached_property
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from functools import lru_cache
 
+import numpy as np
 import tokenizers
 
 
@@ -19,9 +21,10 @@ class Tokenizer:
         info_language: Optional[str] = None
     ):
         self.tokenizer = tokenizer
-        self.unicode_lang = set(_UNICODE_RANGE.keys())
+        self.unicode_lang = _UNICODE_LANGS
         self.info_language = info_language
-
+        # text -> its tokens, for the prompts encoded again in every window
+        self._prompt_tokens = {}
 
         if multilingual:
             if task not in _TASKS:
@@ -91,6 +94,15 @@ class Tokenizer:
     def encode(self, text: str) -> List[int]:
         return self.tokenizer.encode(text, add_special_tokens=False).ids
 
+    def encode_prompt(self, text: str) -> Tuple[int, ...]:
+        """Same as `encode`, memoized for the prompt texts every transcription repeats."""
+        tokens = self._prompt_tokens.get(text)
+        if tokens is None:
+            tokens = tuple(self.encode(text))
+            if len(self._prompt_tokens) < 1024:
+                self._prompt_tokens[text] = tokens
+        return tokens
+
     def decode(self, tokens: List[int]) -> str:
         text_tokens = [token for token in tokens if token < self.eot]
         return self.tokenizer.decode(text_tokens)
@@ -158,35 +170,107 @@ class Tokenizer:
             return self.split_tokens_on_multi(tokens)
         return self.split_tokens_on_spaces(tokens)
 
+    @cached_property
+    def token_bytes(self) -> Tuple[bytes, ...]:
+        return token_bytes_table(self.tokenizer)
+
+    def _decode_bytes_with_timestamps(self, tokens: List[int]) -> str:
+        """Same as `decode_with_timestamps`, using the raw bytes of every token."""
+        token_bytes = self.token_bytes
+        timestamp_begin = self.timestamp_begin
+        outputs = []
+        text_bytes = []
+
+        for token in tokens:
+            if token >= timestamp_begin:
+                outputs.append(b"".join(text_bytes).decode("utf-8", errors="replace"))
+                outputs.append(f"<|{(token - timestamp_begin) * 0.02:.2f}|>")
+                text_bytes = []
+            else:
+                text_bytes.append(token_bytes[token] if token < len(token_bytes) else b"")
+        outputs.append(b"".join(text_bytes).decode("utf-8", errors="replace"))
+
+        return "".join(outputs)
+
     def split_tokens_on_unicode(
         self, tokens: List[int]
     ) -> Tuple[List[str], List[List[int]]]:
-        decoded_full = self.decode_with_timestamps(tokens)
+        """Splits the tokens into words wherever the bytes so far decode to whole characters.
+
+        The UTF-8 sequences are followed byte by byte over the token byte table. A word ends
+        at the first token that completes its last character. A word with a broken or
+        unfinished character ends where that character is also replaced by U+FFFD in the
+        decoding of all the tokens, so the words are the same as when decoding every prefix
+        of a word.
+        """
+        decoded_full = self._decode_bytes_with_timestamps(tokens)
         replacement_char = "\ufffd"
+        token_bytes = self.token_bytes
+        timestamp_begin = self.timestamp_begin
 
         words = []
         word_tokens = []
         current_tokens = []
         unicode_offset = 0
+        # characters of the current word before its first U+FFFD, if it has one
+        num_chars = 0
+        replacement_char_index = None
+        # continuation bytes still missing in the current UTF-8 sequence, and the range of the next one
+        pending = 0
+        low, high = 0x80, 0xBF
+        code_point = 0
 
         for token in tokens:
             current_tokens.append(token)
-            decoded = self.decode_with_timestamps(current_tokens)
-
-            try:
-                replacement_char_index = decoded.index(replacement_char)
-                replacement_char_index += unicode_offset
-            except ValueError:
-                replacement_char_index = None
-
-            if replacement_char_index is None or (
-                replacement_char_index < len(decoded_full)
-                and decoded_full[replacement_char_index] == replacement_char
+            if token >= timestamp_begin:
+                if pending and replacement_char_index is None:
+                    # decoding stops at a timestamp, an unfinished sequence is replaced
+                    replacement_char_index = num_chars
+                pending = 0
+                num_chars += len(f"<|{(token - timestamp_begin) * 0.02:.2f}|>")
+            else:
+                data = token_bytes[token] if token < len(token_bytes) else b""
+                for byte in data:
+                    if pending:
+                        if low <= byte <= high:
+                            pending -= 1
+                            low, high = 0x80, 0xBF
+                            code_point = (code_point << 6) | (byte & 0x3F)
+                            if not pending:
+                                # a literal U+FFFD counts like a replaced character
+                                if code_point == 0xFFFD and replacement_char_index is None:
+                                    replacement_char_index = num_chars
+                                num_chars += 1
+                            continue
+                        # the sequence is broken, the byte starts the next one
+                        if replacement_char_index is None:
+                            replacement_char_index = num_chars
+                        pending = 0
+                    pending, low, high = _UTF8_LEADS[byte]
+                    if pending < 0:
+                        if replacement_char_index is None:
+                            replacement_char_index = num_chars
+                        pending = 0
+                    elif pending:
+                        code_point = byte & (0x3F >> pending)
+                    else:
+                        num_chars += 1
+
+            first_replacement = replacement_char_index
+            if first_replacement is None and pending:
+                first_replacement = num_chars
+            if first_replacement is None or (
+                unicode_offset + first_replacement < len(decoded_full)
+                and decoded_full[unicode_offset + first_replacement] == replacement_char
             ):
+                decoded = self._decode_bytes_with_timestamps(current_tokens)
                 words.append(decoded)
                 word_tokens.append(current_tokens)
                 current_tokens = []
                 unicode_offset += len(decoded)
+                num_chars = 0
+                replacement_char_index = None
+                pending = 0
 
         return words, word_tokens
 
@@ -217,64 +301,130 @@ class Tokenizer:
         words = []
         word_tokens = []
 
-        for subword, subword_tokens in zip(subwords, subword_tokens_list):
-            lang_cnt= {key: 0 for key in list(self.unicode_lang) + ['other']}
-            pre_lang = None
+        # the majority script of every subword, in one pass over the whole text
+        subword_langs = get_subword_langs(subwords)
+        for subword, subword_tokens, lang in zip(subwords, subword_tokens_list, subword_langs):
             special = subword_tokens[0] >= self.eot
             with_space = subword.startswith(" ")
             punctuation = subword.strip() in string.punctuation
-            for char in subword:
-                lang_cnt[self.get_char_lang(ord(char))] += 1
-            lang, _ = max(lang_cnt.items(), key=lambda x: x[1])
-            if pre_lang:
-                pre_lang = lang
             if special or with_space or punctuation or len(words) == 0 or lang in self.unicode_lang:
                 words.append(subword)
                 word_tokens.append(subword_tokens)
-            elif lang not in self.unicode_lang and pre_lang in self.unicode_lang:
-                words.append(subword)
-                word_tokens.append(subword_tokens)
             else:
                 words[-1] = words[-1] + subword
                 word_tokens[-1].extend(subword_tokens)
 
         return words, word_tokens
 
-    @lru_cache(maxsize=12288)
-    def get_char_lang(self, code):
-        # CJK统一汉字
-        if 0x4E00 <= code <= 0x9FFF:
-            return 'zh'
-        # CJK扩展区
-        if 0x3400 <= code <= 0x4DBF:  # 扩展A
-            return 'zh'
-        if 0x20000 <= code <= 0x2A6DF:  # 扩展B
-            return 'zh'
-        if 0x2A700 <= code <= 0x2B73F:  # 扩展C
-            return 'zh'
-        if 0x2B740 <= code <= 0x2B81F:  # 扩展D
-            return 'zh'
-        # 日语
-        if 0x3040 <= code <= 0x309F:  # 平假名
-            return 'ja'
-        if 0x30A0 <= code <= 0x30FF:  # 片假名
-            return 'ja'
-        if 0xFF66 <= code <= 0xFF9F:
-            return 'ja'
-        # 韩语
-        if 0xAC00 <= code <= 0xD7AF:  # 谚文音节
-            return 'ko'
-        if 0x1100 <= code <= 0x11FF:  # 谚文字母
-            return 'ko'
-        # 泰语
-        if 0x0E00 <= code <= 0x0E7F:
-            return 'th'
-        if 0x0E80 <= code <= 0x0EFF:
-            return 'lo'
-        if 0x1000 <= code <= 0x109F:
-            return 'my'
-        
-        return 'other'
+
+@lru_cache(maxsize=128)
+def get_tokenizer(
+    tokenizer: tokenizers.Tokenizer,
+    multilingual: bool,
+    task: Optional[str] = None,
+    language: Optional[str] = None,
+    info_language: Optional[str] = None,
+) -> Tokenizer:
+    """Returns the Tokenizer of these arguments shared by all transcriptions.
+
+    Its special token ids, non-speech tokens and prompt encodings are computed once,
+    so the returned tokenizer must not be modified.
+    """
+    return Tokenizer(tokenizer, multilingual, task=task, language=language, info_language=info_language)
+
+
+def get_char_lang(code: int) -> str:
+    """Returns the script of the code point `code`, 'other' for scripts written with spaces."""
+    i = bisect.bisect_right(_SCRIPT_STARTS, code) - 1
+    if i >= 0 and code <= _SCRIPT_ENDS[i]:
+        return _SCRIPTS[_SCRIPT_CODES[i]]
+    return "other"
+
+
+def get_char_scripts(text: str) -> np.ndarray:
+    """Returns the index in `_SCRIPTS` of the script of every character of `text`."""
+    code_points = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    i = np.searchsorted(_SCRIPT_STARTS, code_points, side="right") - 1
+    inside = (i >= 0) & (code_points <= _SCRIPT_ENDS[i])
+    return np.where(inside, _SCRIPT_CODES[i], _SCRIPTS.index("other"))
+
+
+def get_subword_langs(subwords: List[str]) -> List[str]:
+    """Returns the script most characters of every subword are written in.
+
+    A tie goes to the first script in `_SCRIPTS`, so a subword with as many characters
+    of a script as of others counts as that script.
+    """
+    if not subwords:
+        return []
+    scripts = get_char_scripts("".join(subwords))
+    # characters of each script up to every subword boundary
+    counts = np.zeros((len(scripts) + 1, len(_SCRIPTS)), dtype=np.int32)
+    counts[np.arange(1, len(scripts) + 1), scripts] = 1
+    counts = np.cumsum(counts, axis=0)
+    lengths = np.array([len(subword) for subword in subwords])
+    ends = np.cumsum(lengths)
+    subword_counts = counts[ends] - counts[ends - lengths]
+    return [_SCRIPTS[i] for i in subword_counts.argmax(axis=1)]
+
+
+def _utf8_lead(byte: int) -> Tuple[int, int, int]:
+    """Continuation bytes after a UTF-8 lead byte and the range of the first one, -1 if invalid."""
+    if byte < 0x80:
+        return 0, 0x80, 0xBF
+    if 0xC2 <= byte <= 0xDF:
+        return 1, 0x80, 0xBF
+    if 0xE0 <= byte <= 0xEF:
+        # no overlong forms and no surrogates
+        return 2, 0xA0 if byte == 0xE0 else 0x80, 0x9F if byte == 0xED else 0xBF
+    if 0xF0 <= byte <= 0xF4:
+        # nothing above U+10FFFF
+        return 3, 0x90 if byte == 0xF0 else 0x80, 0x8F if byte == 0xF4 else 0xBF
+    return -1, 0x80, 0xBF
+
+
+_UTF8_LEADS = tuple(_utf8_lead(byte) for byte in range(256))
+
+
+@lru_cache(maxsize=None)
+def _byte_decoder() -> Dict[str, int]:
+    """Inverse of the GPT-2 byte-to-unicode mapping of the byte-level BPE vocabulary."""
+    byte_values = (
+        list(range(ord("!"), ord("~") + 1))
+        + list(range(ord("¡"), ord("¬") + 1))
+        + list(range(ord("®"), ord("ÿ") + 1))
+    )
+    chars = byte_values[:]
+    n = 0
+    for b in range(256):
+        if b not in byte_values:
+            byte_values.append(b)
+            chars.append(256 + n)
+            n += 1
+    return {chr(c): b for b, c in zip(byte_values, chars)}
+
+
+@lru_cache(maxsize=8)
+def token_bytes_table(tokenizer: tokenizers.Tokenizer) -> Tuple[bytes, ...]:
+    """Returns the UTF-8 bytes every token id of `tokenizer` decodes to.
+
+    A text token maps to the raw bytes of its byte-level BPE string, which may be an
+    incomplete UTF-8 sequence. Tokens the decoder handles otherwise, like the skipped
+    special tokens, map to the encoding of what they decode to on their own.
+    """
+    byte_decoder = _byte_decoder()
+    size = tokenizer.get_vocab_size()
+    decoded = tokenizer.decode_batch([[token] for token in range(size)])
+    table = []
+    for token, text in enumerate(decoded):
+        piece = tokenizer.id_to_token(token)
+        raw = None
+        if piece is not None and all(char in byte_decoder for char in piece):
+            raw = bytes(byte_decoder[char] for char in piece)
+        if raw is None or raw.decode("utf-8", errors="replace") != text:
+            raw = text.encode("utf-8")
+        table.append(raw)
+    return tuple(table)
 
 
 _TASKS = (
@@ -304,6 +454,30 @@ _UNICODE_RANGE = {
     "lo": [(0x0E80, 0x0EFF)],  # 老挝文
     "my": [(0x1000, 0x109F)],  # 缅甸文
 }
+_UNICODE_LANGS = frozenset(_UNICODE_RANGE)
+_SCRIPTS = tuple(_UNICODE_RANGE) + ("other",)
+
+# sorted, non-overlapping code point ranges of the scripts written without spaces
+_SCRIPT_RANGES = sorted(
+    [
+        (0x4E00, 0x9FFF, "zh"),  # CJK统一汉字
+        (0x3400, 0x4DBF, "zh"),  # CJK扩展A
+        (0x20000, 0x2A6DF, "zh"),  # CJK扩展B
+        (0x2A700, 0x2B73F, "zh"),  # CJK扩展C
+        (0x2B740, 0x2B81F, "zh"),  # CJK扩展D
+        (0x3040, 0x309F, "ja"),  # 平假名
+        (0x30A0, 0x30FF, "ja"),  # 片假名
+        (0xFF66, 0xFF9F, "ja"),  # 半角片假名
+        (0xAC00, 0xD7AF, "ko"),  # 谚文音节
+        (0x1100, 0x11FF, "ko"),  # 谚文字母
+        (0x0E00, 0x0E7F, "th"),  # 泰文
+        (0x0E80, 0x0EFF, "lo"),  # 老挝文
+        (0x1000, 0x109F, "my"),  # 缅甸文
+    ]
+)
+_SCRIPT_STARTS = np.array([start for start, _, _ in _SCRIPT_RANGES], dtype=np.int64)
+_SCRIPT_ENDS = np.array([end for _, end, _ in _SCRIPT_RANGES], dtype=np.int64)
+_SCRIPT_CODES = np.array([_SCRIPTS.index(lang) for _, _, lang in _SCRIPT_RANGES])
 
 _LANGUAGE_CODES = (
     "multi",
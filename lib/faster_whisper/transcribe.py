@@ -1,15 +1,21 @@
+import copy
 import itertools
 import json
 import logging
 import os
 import random
+import threading
+import time
 import zlib
 
-from collections import Counter, defaultdict
-from dataclasses import asdict, dataclass
+from collections import Counter, OrderedDict, defaultdict
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field, replace
+from functools import lru_cache
 from inspect import signature
 from math import ceil
-from typing import BinaryIO, Iterable, List, Optional, Tuple, Union
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple, Union
 from warnings import warn
 
 import ctranslate2
@@ -20,8 +26,9 @@ import torch
 from tqdm import tqdm
 
 from lib.faster_whisper.audio import decode_audio, pad_or_trim
+from lib.faster_whisper.batching import AlignBatcher, DecodeBatcher, EncoderBatcher, split_storage_view
 from lib.faster_whisper.feature_extractor import FeatureExtractor
-from lib.faster_whisper.tokenizer import _LANGUAGE_CODES, Tokenizer
+from lib.faster_whisper.tokenizer import _LANGUAGE_CODES, Tokenizer, get_tokenizer
 from lib.faster_whisper.utils import download_model, format_timestamp, get_end, get_logger
 from lib.faster_whisper.vad import (
     SpeechTimestampsMap,
@@ -48,6 +55,49 @@ class Word:
         return asdict(self)
 
 
+class LazyWords(Sequence):
+    """The words of a segment, computed by `resolve` when they are first read.
+
+    Checking whether a segment has words, iterating or indexing them runs the word
+    alignment; `map` adds a transformation of every word without running it.
+    """
+
+    def __init__(self, resolve: Callable[[], List[Word]]):
+        self._resolve = resolve
+        self._words = None
+        self._lock = threading.Lock()
+
+    @property
+    def resolved(self) -> bool:
+        return self._words is not None
+
+    def _get(self) -> List[Word]:
+        if self._words is None:
+            with self._lock:
+                if self._words is None:
+                    self._words = self._resolve()
+                    self._resolve = None
+        return self._words
+
+    def map(self, function: Callable[[Word], Word]) -> "LazyWords":
+        return LazyWords(lambda: [function(word) for word in self._get()])
+
+    def __getitem__(self, index):
+        return self._get()[index]
+
+    def __len__(self) -> int:
+        return len(self._get())
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other) if isinstance(other, (list, LazyWords)) else NotImplemented
+
+    def __deepcopy__(self, memo) -> List[Word]:
+        return copy.deepcopy(self._get(), memo)
+
+    def __repr__(self) -> str:
+        return repr(self._words) if self._words is not None else "LazyWords(<not aligned>)"
+
+
 @dataclass
 class Segment:
     id: int
@@ -59,7 +109,8 @@ class Segment:
     avg_logprob: float
     compression_ratio: float
     no_speech_prob: float
-    words: Optional[List[Word]]
+    # a LazyWords with lazy_word_timestamps
+    words: Optional[Sequence]
     temperature: Optional[float] = 1.0
 
     def _asdict(self):
@@ -102,6 +153,26 @@ class TranscriptionOptions:
     clip_timestamps: Union[str, List[float]]
     hallucination_silence_threshold: Optional[float]
     hotwords: Optional[str]
+    fallback_strategy: str = "sequential"
+    max_fallback_seconds: Optional[float] = None
+    chunk_length: Optional[int] = None
+    lazy_word_timestamps: bool = False
+
+
+@dataclass
+class TranscriptionStats:
+    """Counters of a transcription, filled while its segments are generated."""
+
+    windows: int = 0
+    # decoding attempts made at each temperature
+    temperature_attempts: Dict[float, int] = field(default_factory=dict)
+    # temperature of the result kept for each window
+    temperature_results: Dict[float, int] = field(default_factory=dict)
+    fallback_seconds: float = 0.0
+    # windows whose fallback stopped at max_fallback_seconds
+    fallback_timeouts: int = 0
+    # encoder calls, a batched call of the language detection probes counts once
+    encode_calls: int = 0
 
 
 @dataclass
@@ -114,6 +185,86 @@ class TranscriptionInfo:
     transcription_options: TranscriptionOptions
     vad_options: VadOptions
     word_timestamps: bool
+    stats: Optional[TranscriptionStats] = None
+
+
+class EncoderOutputCache:
+    """Encoder outputs of the 30 s windows of one transcription.
+
+    Outputs are keyed by (features, seek, length), so a window probed for the language
+    detection is not encoded again when it is transcribed. Only the `max_entries` most
+    recently used outputs are kept since the windows are transcribed in order.
+    """
+
+    def __init__(self, model: "WhisperModel", stats: Optional[TranscriptionStats] = None, max_entries: int = 4):
+        self.model = model
+        self.stats = stats
+        self.max_entries = max_entries
+        self._outputs = OrderedDict()
+        # keeps the features of the keys alive so their ids are not reused
+        self._features = {}
+        # lazy word timestamps read the cache from the thread consuming the segments
+        self._lock = threading.Lock()
+
+    def get(self, features: torch.Tensor, seek: int, length: int) -> ctranslate2.StorageView:
+        segment = features[:, seek : seek + length]
+        key = (id(features), seek, segment.shape[-1])
+        with self._lock:
+            encoder_output = self._outputs.get(key)
+            if encoder_output is not None:
+                self._outputs.move_to_end(key)
+                return encoder_output
+
+        encoder_output = self.model.encode(pad_or_trim(segment))
+        with self._lock:
+            if self.stats is not None:
+                self.stats.encode_calls += 1
+            self._add(features, key, encoder_output)
+        return encoder_output
+
+    def get_batch(self, features: torch.Tensor, seeks: List[int], length: int) -> ctranslate2.StorageView:
+        """Encodes the windows at `seeks` in one batch and caches the output of each window.
+
+        Returns the batched encoder output, in the order of `seeks`.
+        """
+        segments = [features[:, seek : seek + length] for seek in seeks]
+        encoder_output = self.model.encode(torch.stack([pad_or_trim(segment) for segment in segments]))
+        with self._lock:
+            if self.stats is not None:
+                self.stats.encode_calls += 1
+            for seek, segment, window_output in zip(
+                seeks, segments, split_storage_view(encoder_output, len(seeks))
+            ):
+                self._add(features, (id(features), seek, segment.shape[-1]), window_output)
+        return encoder_output
+
+    def _add(self, features: torch.Tensor, key: tuple, encoder_output: ctranslate2.StorageView):
+        self._features[id(features)] = features
+        self._outputs[key] = encoder_output
+        self._outputs.move_to_end(key)
+        while len(self._outputs) > self.max_entries:
+            (features_id, _, _), _ = self._outputs.popitem(last=False)
+            # the features are released with the last output encoded from them
+            if all(key[0] != features_id for key in self._outputs):
+                del self._features[features_id]
+
+
+class _FallbackAttempts:
+    """Iterates over the (temperature, result) decoding attempts of one window.
+
+    timed_out is set when the attempts stopped at max_fallback_seconds.
+    """
+
+    def __init__(self, attempts):
+        self.timed_out = False
+        self._attempts = attempts(self)
+
+    def __iter__(self):
+        return self._attempts
+
+    def close(self):
+        """Stops the attempts that are not needed anymore."""
+        self._attempts.close()
 
 
 # The code below is originally from HF pipeline and is used in whisper-x
@@ -439,21 +590,21 @@ class BatchedInferencePipeline:
 
         audio_chunks, chunks_metadata = collect_chunks(audio, clip_timestamps)
         to_cpu = self.model.model.device == "cuda" and len(self.model.model.device_index) > 1
-        features = (
-            torch.stack(
-                [
-                    pad_or_trim(
-                        self.model.feature_extractor(chunk, to_cpu=to_cpu)[
-                            ...,
-                            : chunk.shape[0] // self.model.feature_extractor.hop_length,
-                        ]
-                    )
-                    for chunk in audio_chunks
-                ]
-            )
-            if duration_after_vad
-            else []
-        )
+        if duration_after_vad:
+            # the chunks of every batch go through one batched STFT, each keeps only the
+            # frames of its own audio
+            hop_length = self.model.feature_extractor.hop_length
+            features = []
+            for i in range(0, len(audio_chunks), batch_size):
+                batch_chunks = audio_chunks[i : i + batch_size]
+                batch_features = self.model.feature_extractor(batch_chunks, to_cpu=to_cpu)
+                features.extend(
+                    pad_or_trim(chunk_features[:, : chunk.shape[0] // hop_length])
+                    for chunk_features, chunk in zip(batch_features, batch_chunks)
+                )
+            features = torch.stack(features)
+        else:
+            features = []
 
         segments = self._batched_segments_generator(
             features,
@@ -590,6 +741,69 @@ class WhisperModel:
         self.tokens_per_second = self.feature_extractor.sampling_rate // self.num_samples_per_token
         self.time_precision = 0.02
         self.max_length = 448
+        self.encoder_batcher = None
+        self.decode_batcher = None
+        self.align_batcher = None
+        # runs the fallback attempts of the parallel fallback strategy, one per model worker
+        self.fallback_executor = ThreadPoolExecutor(num_workers, thread_name_prefix="fallback")
+
+    def enable_encoder_batching(
+        self, max_batch_size: int = 8, max_wait_ms: float = 10, num_threads: Optional[int] = None
+    ):
+        """Encodes the 30 s windows of concurrent transcribe() calls in batches.
+
+        Useful when transcribe() is called from multiple Python threads: the windows they
+        encode one at a time are collected for up to max_wait_ms and run as one batched
+        encoder call of at most max_batch_size windows.
+
+        Args:
+          max_batch_size: Maximum number of windows per encoder call.
+          max_wait_ms: Maximum time a window waits for other windows to join its batch.
+          num_threads: Maximum number of batches running at the same time, one per model
+            worker (num_workers) by default.
+        """
+        self.encoder_batcher = EncoderBatcher(
+            self._encode, max_batch_size, max_wait_ms, num_threads or self.model.num_workers
+        )
+
+    def enable_decode_batching(
+        self, max_batch_size: int = 8, max_wait_ms: float = 10, num_threads: Optional[int] = None
+    ):
+        """Decodes the windows of concurrent transcribe() calls in batches.
+
+        Generate calls with the same decoding options (beam size, temperature, ...) and
+        prompt length are collected for up to max_wait_ms and run as one batched call of at
+        most max_batch_size prompts. Every temperature fallback is a new request.
+
+        Args:
+          max_batch_size: Maximum number of prompts per generate call.
+          max_wait_ms: Maximum time a window waits for other windows to join its batch.
+          num_threads: Maximum number of batches running at the same time, one per model
+            worker (num_workers) by default.
+        """
+        self.decode_batcher = DecodeBatcher(
+            self.model.generate, max_batch_size, max_wait_ms, num_threads or self.model.num_workers
+        )
+
+    def enable_align_batching(
+        self, max_batch_size: int = 8, max_wait_ms: float = 10, num_threads: Optional[int] = None
+    ):
+        """Aligns the words of concurrent transcribe() calls in batches.
+
+        Every window is aligned before the next one is decoded, because the next seek
+        position depends on its last word, so the batches are formed across concurrent
+        transcriptions: their align calls are collected for up to max_wait_ms and run as
+        one batched call of at most max_batch_size calls.
+
+        Args:
+          max_batch_size: Maximum number of align calls per batch.
+          max_wait_ms: Maximum time a window waits for other windows to join its batch.
+          num_threads: Maximum number of batches running at the same time, one per model
+            worker (num_workers) by default.
+        """
+        self.align_batcher = AlignBatcher(
+            self.model.align, max_batch_size, max_wait_ms, num_threads or self.model.num_workers
+        )
 
     @property
     def supported_languages(self) -> List[str]:
@@ -659,14 +873,18 @@ class WhisperModel:
         hotwords: Optional[str] = None,
         language_detection_threshold: Optional[float] = None,
         language_detection_segments: int = 1,
+        speech_chunks: Optional[List[dict]] = None,
+        fallback_strategy: str = "sequential",
+        max_fallback_seconds: Optional[float] = None,
+        lazy_word_timestamps: bool = False,
     ) -> Tuple[Iterable[Segment], TranscriptionInfo]:
         """Transcribes an input file.
 
         Arguments:
           audio: Path to the input file (or a file-like object), or the audio waveform.
           language: The language spoken in the audio. It should be a language code such
-            as "en" or "fr". If not set, the language will be detected in the first 30 seconds
-            of audio.
+            as "en" or "fr", or "multi" for code-switched audio. If not set, the language will
+            be detected in the first 30 seconds of audio.
           task: Task to execute (transcribe or translate).
           beam_size: Beam size to use for decoding.
           best_of: Number of candidates when sampling with non-zero temperature.
@@ -735,6 +953,18 @@ class WhisperModel:
           language_detection_threshold: If the maximum probability of the language tokens is higher
            than this value, the language is detected.
           language_detection_segments: Number of segments to consider for the language detection.
+          speech_chunks: Precomputed speech chunks of the audio in samples, as returned by
+            get_speech_timestamps. Used instead of running the VAD when vad_filter is enabled.
+          fallback_strategy: "sequential" decodes with the next temperature only after the
+            previous one failed. "parallel" starts all the sampled candidates at once when the
+            first temperature fails, and keeps the lowest temperature that passes.
+          max_fallback_seconds: Maximum time spent on temperature fallbacks per window. When it
+            is reached, the best result decoded so far is kept.
+          lazy_word_timestamps: With word timestamps, align the words of a window only when
+            the words of one of its segments are read. The segments are decoded and timed
+            like without word timestamps: their start and end and the next window are not
+            refined from the words, and segments without words are kept. Ignored when
+            hallucination_silence_threshold is set, which needs the words while decoding.
         Returns:
           A tuple with:
 
@@ -743,6 +973,11 @@ class WhisperModel:
         """
 
         info_language = None
+        if language == "multi" and self.model.is_multilingual:
+            # decided by the caller: code-switched audio is transcribed like when the
+            # language detection finds it, without the VAD
+            info_language, language = "multi", "en"
+            vad_filter = False
 
         sampling_rate = self.feature_extractor.sampling_rate
 
@@ -762,7 +997,8 @@ class WhisperModel:
                 vad_parameters = VadOptions()
             elif isinstance(vad_parameters, dict):
                 vad_parameters = VadOptions(**vad_parameters)
-            speech_chunks = get_speech_timestamps(audio, vad_parameters)
+            if speech_chunks is None:
+                speech_chunks = get_speech_timestamps(audio, vad_parameters)
             audio_chunks, chunks_metadata = collect_chunks(audio, speech_chunks)
             audio = torch.cat(audio_chunks, dim=0)
             duration_after_vad = audio.shape[0] / sampling_rate
@@ -789,9 +1025,11 @@ class WhisperModel:
             speech_chunks = None
 
         to_cpu = self.model.device == "cuda" and len(self.model.device_index) > 1
-        features = self.feature_extractor(audio, chunk_length=chunk_length, to_cpu=to_cpu)
+        # computed once the language detection decided between the VAD output and the original audio
+        features = None
 
-        encoder_output = None
+        stats = TranscriptionStats()
+        encoder_cache = EncoderOutputCache(self, stats)
         all_language_probs = None
 
         # setting output_language for multilingual videos
@@ -809,23 +1047,16 @@ class WhisperModel:
                 info_language = language
             else:
                 if duration_after_vad > 90:
-                    segment_duration = self.feature_extractor.nb_max_frames
-                    total_frames = features.shape[1]
-                    segment_length = min(segment_duration, total_frames)
-
-                    # 截取开始部分（前30秒）
-                    start_segment = features[:, 0:segment_length]
-
-                    # 截取中间部分（中间30秒）
-                    mid_start = (total_frames - segment_length) // 2
-                    middle_segment = features[:, mid_start : mid_start + segment_length]
-
-                    # 截取结束部分（最后30秒）
-                    end_segment = features[:, -segment_length:]
+                    # probe the last, the middle and the first window with one batched encoder pass,
+                    # the output of the first window is reused by the transcription
+                    features = self.feature_extractor(audio, chunk_length=chunk_length, to_cpu=to_cpu)
+                    _, nb_max_frames = self.feature_extractor.chunk_size(chunk_length)
+                    last_seek = features.shape[-1] - 2 * nb_max_frames
+                    probe_results = self.model.detect_language(
+                        encoder_cache.get_batch(features, [last_seek, last_seek // 2, 0], nb_max_frames)
+                    )
                     languages = []
-                    for seg in [end_segment, middle_segment, start_segment]:
-                        encoder_output = self.encode(pad_or_trim(seg))
-                        results = self.model.detect_language(encoder_output)[0]
+                    for results in probe_results:
                         all_language_probs = [(token[2:-2], prob) for (token, prob) in results]
                         language, language_probability = all_language_probs[0]
                         languages.append((language, language_probability))
@@ -838,29 +1069,34 @@ class WhisperModel:
                         info_language = 'multi'
                         language, language_probability = 'en', 1
                         audio = audio_ori
-                        features = self.feature_extractor(audio, chunk_length=chunk_length, to_cpu=to_cpu)
-                        encoder_output = None
                         speech_chunks = None
+                        features = None
                 else:
+                    features = self.feature_extractor(audio, chunk_length=chunk_length, to_cpu=to_cpu)
                     if language_detection_segments is None or language_detection_segments < 1:
                         language_detection_segments = 1
                     start_timestamp = (
                         float(clip_timestamps.split(",")[0]) if isinstance(clip_timestamps, str) else clip_timestamps[0]
                     )
-                    content_frames = features.shape[-1] - self.feature_extractor.nb_max_frames
+                    _, nb_max_frames = self.feature_extractor.chunk_size(chunk_length)
+                    content_frames = features.shape[-1] - nb_max_frames
                     seek = (
                         int(start_timestamp * self.frames_per_second)
                         if start_timestamp * self.frames_per_second < content_frames
                         else 0
                     )
                     end_frames = min(
-                        seek + self.feature_extractor.nb_max_frames * language_detection_segments,
+                        seek + nb_max_frames * language_detection_segments,
                         content_frames,
                     )
                     detected_language_info = {}
                     while seek <= end_frames:
-                        segment = features[:, seek : seek + self.feature_extractor.nb_max_frames]
-                        encoder_output = self.encode(pad_or_trim(segment))
+                        # the window as generate_segments cuts it, so that its output is reused
+                        segment_size = (
+                            min(nb_max_frames, content_frames - seek) if seek < content_frames else nb_max_frames
+                        )
+                        segment = features[:, seek : seek + nb_max_frames]
+                        encoder_output = encoder_cache.get(features, seek, segment_size)
                         # results is a list of tuple[str, float] with language names and
                         # probabilities.
                         results = self.model.detect_language(encoder_output)[0]
@@ -899,6 +1135,9 @@ class WhisperModel:
 
             language_probability = 1
 
+        if features is None:
+            features = self.feature_extractor(audio, chunk_length=chunk_length, to_cpu=to_cpu)
+
         specific_init_prompt = None
         word_timestamps = True
         if word_timestamps_dict:
@@ -906,7 +1145,7 @@ class WhisperModel:
             word_timestamps = word_timestamps_dict.get(language, default_value)
         if initial_prompt:
             specific_init_prompt = initial_prompt.get(language, None)
-        tokenizer = Tokenizer(
+        tokenizer = get_tokenizer(
             self.hf_tokenizer,
             self.model.is_multilingual,
             task=task,
@@ -943,11 +1182,15 @@ class WhisperModel:
             clip_timestamps=clip_timestamps,
             hallucination_silence_threshold=hallucination_silence_threshold,
             hotwords=hotwords,
+            fallback_strategy=fallback_strategy,
+            max_fallback_seconds=max_fallback_seconds,
+            chunk_length=chunk_length,
+            lazy_word_timestamps=lazy_word_timestamps,
         )
         # debug
         duration_debug = audio.shape[0] / sampling_rate
         self.logger.info(f"Real audio duration_debug: {format_timestamp(duration_debug)}")
-        segments = self.generate_segments(features, tokenizer, options, encoder_output)
+        segments = self.generate_segments(features, tokenizer, options, encoder_cache, stats)
 
         if speech_chunks:
             segments = restore_speech_timestamps(segments, speech_chunks, sampling_rate)
@@ -961,6 +1204,7 @@ class WhisperModel:
             vad_options=vad_parameters,
             all_language_probs=all_language_probs,
             word_timestamps=word_timestamps,
+            stats=stats,
         )
         return segments, info
 
@@ -1038,9 +1282,13 @@ class WhisperModel:
         features: torch.Tensor,
         tokenizer: Tokenizer,
         options: TranscriptionOptions,
-        encoder_output: Optional[ctranslate2.StorageView] = None,
+        encoder_cache: Optional[EncoderOutputCache] = None,
+        stats: Optional[TranscriptionStats] = None,
     ) -> Iterable[Segment]:
-        content_frames = features.shape[-1] - self.feature_extractor.nb_max_frames
+        if encoder_cache is None:
+            encoder_cache = EncoderOutputCache(self, stats)
+        _, nb_max_frames = self.feature_extractor.chunk_size(options.chunk_length)
+        content_frames = features.shape[-1] - nb_max_frames
         content_duration = float(content_frames * self.feature_extractor.time_per_frame)
 
         if isinstance(options.clip_timestamps, str):
@@ -1056,6 +1304,12 @@ class WhisperModel:
         seek_clips: List[Tuple[int, int]] = list(zip(seek_points[::2], seek_points[1::2]))
 
         punctuation = "\"'“¿([{-\"'.。,，!！?？:：”)]}、"
+        # the hallucination checks need the words while decoding
+        lazy_words = (
+            options.word_timestamps
+            and options.lazy_word_timestamps
+            and options.hallucination_silence_threshold is None
+        )
 
         idx = 0
         clip_idx = 0
@@ -1066,7 +1320,7 @@ class WhisperModel:
         if options.initial_prompt is not None:
             if isinstance(options.initial_prompt, str):
                 initial_prompt = " " + options.initial_prompt.strip()
-                initial_prompt_tokens = tokenizer.encode(initial_prompt)
+                initial_prompt_tokens = tokenizer.encode_prompt(initial_prompt)
                 all_tokens.extend(initial_prompt_tokens)
             else:
                 all_tokens.extend(options.initial_prompt)
@@ -1088,25 +1342,20 @@ class WhisperModel:
                     seek = seek_clips[clip_idx][0]
                 continue
             time_offset = seek * self.feature_extractor.time_per_frame
-            window_end_time = float(
-                (seek + self.feature_extractor.nb_max_frames) * self.feature_extractor.time_per_frame
-            )
+            window_end_time = float((seek + nb_max_frames) * self.feature_extractor.time_per_frame)
             segment_size = min(
-                self.feature_extractor.nb_max_frames,
+                nb_max_frames,
                 content_frames - seek,
                 seek_clip_end - seek,
             )
-            segment = features[:, seek : seek + segment_size]
             segment_duration = segment_size * self.feature_extractor.time_per_frame
-            segment = pad_or_trim(segment)
 
             if self.logger.isEnabledFor(logging.DEBUG):
                 self.logger.debug("Processing segment at %s", format_timestamp(time_offset))
 
             previous_tokens = all_tokens[prompt_reset_since:]
 
-            if encoder_output is None:
-                encoder_output = self.encode(segment)
+            encoder_output = encoder_cache.get(features, seek, segment_size)
 
             # Perform language detection at every segment to update task based on output language,
             # if the language is english, task is transcribe,
@@ -1121,10 +1370,14 @@ class WhisperModel:
                 else:
                     task = "transcribe"
 
-                # Update tokenizer based on task and language
-                tokenizer.task = tokenizer.tokenizer.token_to_id(f"<|{task}|>")
-                tokenizer.language = tokenizer.tokenizer.token_to_id(language_token)
-                tokenizer.language_code = language
+                # Update tokenizer based on task and language, the shared tokenizers are not modified
+                tokenizer = get_tokenizer(
+                    tokenizer.tokenizer,
+                    self.model.is_multilingual,
+                    task=task,
+                    language=language,
+                    info_language=tokenizer.info_language,
+                )
             # Update prompt based on task and language
             prompt = self.get_prompt(
                 tokenizer,
@@ -1134,15 +1387,12 @@ class WhisperModel:
                 hotwords=options.hotwords,
             )
 
-            if seek > 0 or encoder_output is None:
-                encoder_output = self.encode(segment)
-
             (
                 result,
                 avg_logprob,
                 temperature,
                 compression_ratio,
-            ) = self.generate_with_fallback(encoder_output, prompt, tokenizer, options)
+            ) = self.generate_with_fallback(encoder_output, prompt, tokenizer, options, stats)
 
             if options.no_speech_threshold is not None:
                 # no voice activity check
@@ -1216,7 +1466,20 @@ class WhisperModel:
                 seek=seek,
             )
 
-            if options.word_timestamps:
+            if lazy_words:
+                window_words = self._lazy_window_words(
+                    current_segments,
+                    tokenizer,
+                    encoder_cache,
+                    features,
+                    previous_seek,
+                    segment_size,
+                    options,
+                    last_speech_timestamp,
+                )
+                if current_segments:
+                    last_speech_timestamp = current_segments[-1]["end"]
+            elif options.word_timestamps:
                 self.add_word_timestamps(
                     [current_segments],
                     tokenizer,
@@ -1280,7 +1543,7 @@ class WhisperModel:
                 last_word_end = get_end(current_segments)
                 if last_word_end is not None:
                     last_speech_timestamp = last_word_end
-            for segment in current_segments:
+            for segment_index, segment in enumerate(current_segments):
                 tokens = segment["tokens"]
                 text = tokenizer.decode(tokens)
 
@@ -1301,7 +1564,13 @@ class WhisperModel:
                     avg_logprob=avg_logprob,
                     compression_ratio=compression_ratio,
                     no_speech_prob=result.no_speech_prob,
-                    words=([Word(**word) for word in segment["words"]] if options.word_timestamps else None),
+                    words=(
+                        window_words[segment_index]
+                        if lazy_words
+                        else [Word(**word) for word in segment["words"]]
+                        if options.word_timestamps
+                        else None
+                    ),
                 )
 
             if not options.condition_on_previous_text or temperature > options.prompt_reset_on_temperature:
@@ -1325,6 +1594,11 @@ class WhisperModel:
         return new_segments
 
     def encode(self, features: torch.Tensor) -> ctranslate2.StorageView:
+        if self.encoder_batcher is not None and features.ndim == 2:
+            return self.encoder_batcher.encode(features)
+        return self._encode(features)
+
+    def _encode(self, features: torch.Tensor) -> ctranslate2.StorageView:
         # When the model is running on multiple GPUs, the encoder output should be moved
         # to the CPU since we don't know which GPU will handle the next job.
         to_cpu = self.model.device == "cuda" and len(self.model.device_index) > 1
@@ -1341,6 +1615,7 @@ class WhisperModel:
         prompt: List[int],
         tokenizer: Tokenizer,
         options: TranscriptionOptions,
+        stats: Optional[TranscriptionStats] = None,
     ) -> Tuple[ctranslate2.models.WhisperGenerationResult, float, float, float]:
         decode_result = None
         all_results = []
@@ -1363,34 +1638,28 @@ class WhisperModel:
                 f"so that their combined length is less that {self.max_length}."
             )
 
-        for temperature in options.temperatures:
-            if temperature > 0:
-                kwargs = {
-                    "beam_size": 1,
-                    "num_hypotheses": options.best_of,
-                    "sampling_topk": 0,
-                    "sampling_temperature": temperature,
-                }
-            else:
-                kwargs = {
-                    "beam_size": options.beam_size,
-                    "patience": options.patience,
-                }
+        generate_kwargs = dict(
+            length_penalty=options.length_penalty,
+            repetition_penalty=options.repetition_penalty,
+            no_repeat_ngram_size=options.no_repeat_ngram_size,
+            max_length=max_length,
+            return_scores=True,
+            return_no_speech_prob=True,
+            suppress_blank=options.suppress_blank,
+            suppress_tokens=options.suppress_tokens,
+            max_initial_timestamp_index=max_initial_timestamp_index,
+        )
+        if options.fallback_strategy == "parallel":
+            attempts = self._parallel_attempts(encoder_output, prompt, options, generate_kwargs)
+        else:
+            attempts = self._sequential_attempts(encoder_output, prompt, options, generate_kwargs)
 
-            result = self.model.generate(
-                encoder_output,
-                [prompt],
-                length_penalty=options.length_penalty,
-                repetition_penalty=options.repetition_penalty,
-                no_repeat_ngram_size=options.no_repeat_ngram_size,
-                max_length=max_length,
-                return_scores=True,
-                return_no_speech_prob=True,
-                suppress_blank=options.suppress_blank,
-                suppress_tokens=options.suppress_tokens,
-                max_initial_timestamp_index=max_initial_timestamp_index,
-                **kwargs,
-            )[0]
+        fallback_start = None
+        for temperature, result in attempts:
+            if stats is not None:
+                stats.temperature_attempts[temperature] = stats.temperature_attempts.get(temperature, 0) + 1
+            if fallback_start is None:
+                fallback_start = time.monotonic()
 
             tokens = result.sequences_ids[0]
 
@@ -1455,9 +1724,94 @@ class WhisperModel:
                 temperature,
                 decode_result[3],
             )
+            if stats is not None and attempts.timed_out:
+                stats.fallback_timeouts += 1
+        attempts.close()
+
+        if stats is not None:
+            stats.windows += 1
+            stats.temperature_results[decode_result[2]] = stats.temperature_results.get(decode_result[2], 0) + 1
+            if len(all_results) > 1 or attempts.timed_out:
+                stats.fallback_seconds += time.monotonic() - fallback_start
 
         return decode_result
 
+    def _attempt_kwargs(self, temperature: float, options: TranscriptionOptions) -> dict:
+        if temperature > 0:
+            return {
+                "beam_size": 1,
+                "num_hypotheses": options.best_of,
+                "sampling_topk": 0,
+                "sampling_temperature": temperature,
+            }
+        return {
+            "beam_size": options.beam_size,
+            "patience": options.patience,
+        }
+
+    def _sequential_attempts(self, encoder_output, prompt, options, generate_kwargs) -> "_FallbackAttempts":
+        def attempts(state):
+            deadline = None
+            for i, temperature in enumerate(options.temperatures):
+                if deadline is not None and time.monotonic() > deadline:
+                    state.timed_out = True
+                    return
+                result = self._generate(
+                    encoder_output, prompt, **generate_kwargs, **self._attempt_kwargs(temperature, options)
+                )
+                if i == 0 and options.max_fallback_seconds is not None:
+                    deadline = time.monotonic() + options.max_fallback_seconds
+                yield temperature, result
+
+        return _FallbackAttempts(attempts)
+
+    def _parallel_attempts(self, encoder_output, prompt, options, generate_kwargs) -> "_FallbackAttempts":
+        def attempts(state):
+            first_temperature, *fallback_temperatures = options.temperatures
+            yield first_temperature, self._generate(
+                encoder_output, prompt, **generate_kwargs, **self._attempt_kwargs(first_temperature, options)
+            )
+            if not fallback_temperatures:
+                return
+
+            # the first attempt failed: queue every fallback at once, the model workers run them
+            # in parallel (through the decode batcher when it is enabled), and go through them in
+            # temperature order
+            pending = [
+                self.fallback_executor.submit(
+                    self._generate,
+                    encoder_output,
+                    prompt,
+                    **generate_kwargs,
+                    **self._attempt_kwargs(temperature, options),
+                )
+                for temperature in fallback_temperatures
+            ]
+            deadline = None
+            if options.max_fallback_seconds is not None:
+                deadline = time.monotonic() + options.max_fallback_seconds
+            try:
+                for temperature, future in zip(fallback_temperatures, pending):
+                    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                    if not wait([future], timeout=timeout).done:
+                        state.timed_out = True
+                        return
+                    yield temperature, future.result()
+            finally:
+                # once a result is kept or the time is up, the fallbacks still queued are dropped,
+                # the ones already running finish on their model worker and are ignored
+                for future in pending:
+                    future.cancel()
+
+        return _FallbackAttempts(attempts)
+
+    def _generate(
+        self, encoder_output: ctranslate2.StorageView, prompt: List[int], **kwargs
+    ) -> ctranslate2.models.WhisperGenerationResult:
+        if self.decode_batcher is not None:
+            return self.decode_batcher.generate(encoder_output, prompt, **kwargs)
+        return self.model.generate(encoder_output, [prompt], **kwargs)[0]
+
     def get_prompt(
         self,
         tokenizer: Tokenizer,
@@ -1471,7 +1825,7 @@ class WhisperModel:
         if previous_tokens or (hotwords and not prefix):
             prompt.append(tokenizer.sot_prev)
             if hotwords and not prefix:
-                hotwords_tokens = tokenizer.encode(" " + hotwords.strip())
+                hotwords_tokens = tokenizer.encode_prompt(" " + hotwords.strip())
                 if len(hotwords_tokens) >= self.max_length // 2:
                     hotwords_tokens = hotwords_tokens[: self.max_length // 2 - 1]
                 prompt.extend(hotwords_tokens)
@@ -1484,7 +1838,7 @@ class WhisperModel:
             prompt.append(tokenizer.no_timestamps)
 
         if prefix:
-            prefix_tokens = tokenizer.encode(" " + prefix.strip())
+            prefix_tokens = tokenizer.encode_prompt(" " + prefix.strip())
             if len(prefix_tokens) >= self.max_length // 2:
                 prefix_tokens = prefix_tokens[: self.max_length // 2 - 1]
             if not without_timestamps:
@@ -1493,6 +1847,46 @@ class WhisperModel:
 
         return prompt
 
+    def _lazy_window_words(
+        self,
+        window_segments: List[dict],
+        tokenizer: Tokenizer,
+        encoder_cache: "EncoderOutputCache",
+        features: torch.Tensor,
+        seek: int,
+        segment_size: int,
+        options: TranscriptionOptions,
+        last_speech_timestamp: float,
+    ) -> List[LazyWords]:
+        """Returns the lazy words of every segment of a window, all aligned together on first read.
+
+        The encoder output is taken from the bounded encoder cache of the transcription and
+        encoded again when it was evicted.
+        """
+        window_segments = [dict(segment) for segment in window_segments]
+        aligned = []
+        lock = threading.Lock()
+
+        def align_window() -> List[List[Word]]:
+            with lock:
+                if not aligned:
+                    self.add_word_timestamps(
+                        [window_segments],
+                        tokenizer,
+                        encoder_cache.get(features, seek, segment_size),
+                        segment_size,
+                        options.prepend_punctuations,
+                        options.append_punctuations,
+                        last_speech_timestamp=last_speech_timestamp,
+                    )
+                    # a segment without an alignment has a single placeholder without times
+                    aligned.extend(
+                        [Word(**word) for word in segment["words"] if "start" in word] for segment in window_segments
+                    )
+                return aligned
+
+        return [LazyWords(lambda index=index: align_window()[index]) for index in range(len(window_segments))]
+
     def add_word_timestamps(
         self,
         segments: List[dict],
@@ -1618,7 +2012,8 @@ class WhisperModel:
         if len(text_tokens) == 0:
             return []
 
-        results = self.model.align(
+        align = self.align_batcher.align if self.align_batcher is not None else self.model.align
+        results = align(
             encoder_output,
             tokenizer.sot_sequence,
             text_tokens,
@@ -1634,23 +2029,23 @@ class WhisperModel:
 
             words, word_tokens = tokenizer.split_to_word_tokens(text_token + [tokenizer.eot])
             if len(word_tokens) <= 1:
-                # return on eot only
+                # no words on eot only
                 # >>> np.pad([], (1, 0))
                 # array([0.])
                 # This results in crashes when we lookup jump_times with float, like
                 # IndexError: arrays used as indices must be of integer (or boolean) type
-                return []
+                # the other items of the batch keep their own words
+                return_list.append([])
+                continue
             word_boundaries = np.pad(np.cumsum([len(t) for t in word_tokens[:-1]]), (1, 0))
-            if len(word_boundaries) <= 1:
-                return []
 
             jumps = np.pad(np.diff(text_indices), (1, 0), constant_values=1).astype(bool)
             jump_times = time_indices[jumps] / self.tokens_per_second
             start_times = jump_times[word_boundaries[:-1]]
             end_times = jump_times[word_boundaries[1:]]
-            word_probabilities = [
-                np.mean(text_token_probs[i:j]) for i, j in zip(word_boundaries[:-1], word_boundaries[1:])
-            ]
+            # the mean probability of the tokens of every word
+            token_probs = np.asarray(text_token_probs, dtype=np.float64)[: word_boundaries[-1]]
+            word_probabilities = np.add.reduceat(token_probs, word_boundaries[:-1]) / np.diff(word_boundaries)
 
             return_list.append(
                 [
@@ -1719,6 +2114,40 @@ class WhisperModel:
 
         return encoder_output, output
 
+    def detect_language_probes(
+        self, probes: List[torch.Tensor], chunk_length: Optional[int] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """Detects the language of every probe waveform of up to 30 seconds.
+
+        All probes go through the encoder and the language detection as one batch.
+
+        Args:
+          probes: The probe waveforms, longer ones are trimmed to the chunk length.
+          chunk_length: The length of the probes in seconds, 30 by default.
+
+        Returns:
+          The (language, probability) pairs of every probe, most probable first.
+        """
+        probe_samples, _ = self.feature_extractor.chunk_size(chunk_length)
+        to_cpu = self.model.device == "cuda" and len(self.model.device_index) > 1
+        probe_features = torch.stack(
+            [
+                pad_or_trim(
+                    self.feature_extractor(
+                        probe[:probe_samples],
+                        padding=False,
+                        chunk_length=chunk_length,
+                        to_cpu=to_cpu,
+                    )
+                )
+                for probe in probes
+            ]
+        )
+        return [
+            [(token[2:-2], prob) for (token, prob) in results]
+            for results in self.model.detect_language(self.encode(probe_features))
+        ]
+
     def detect_language(self, audio: torch.Tensor):
         to_cpu = self.model.device == "cuda" and len(self.model.device_index) > 1
         segment = self.feature_extractor(audio, padding=True, to_cpu=to_cpu)[:, : self.feature_extractor.nb_max_frames]
@@ -1926,7 +2355,21 @@ def restore_speech_timestamps(
     ts_map = SpeechTimestampsMap(speech_chunks, sampling_rate)
 
     for segment in segments:
-        if segment.words:
+        if isinstance(segment.words, LazyWords):
+            # the words are restored when they are aligned, the segment keeps its own times
+            def restore_word(word: Word) -> Word:
+                chunk_index = ts_map.get_chunk_index(word.end)
+                return replace(
+                    word,
+                    start=ts_map.get_original_time(word.start, chunk_index),
+                    end=ts_map.get_original_time(word.end, chunk_index),
+                )
+
+            segment.start = ts_map.get_original_time(segment.start)
+            segment.end = ts_map.get_original_time(segment.end, start_or_end="end")
+            segment.words = segment.words.map(restore_word)
+
+        elif segment.words:
             words = []
             for word in segment.words:
                 # Ensure the word start and end times are resolved to the same chunk.
@@ -1965,13 +2408,19 @@ def get_suppressed_tokens(
     tokenizer: Tokenizer,
     suppress_tokens: Tuple[int],
 ) -> Optional[List[int]]:
+    if suppress_tokens and -1 not in suppress_tokens:
+        assert isinstance(suppress_tokens, list), "suppress_tokens must be a list"
+    return _get_suppressed_tokens(tokenizer, tuple(suppress_tokens) if suppress_tokens else ())
+
+
+@lru_cache(maxsize=256)
+def _get_suppressed_tokens(tokenizer: Tokenizer, suppress_tokens: Tuple[int]) -> Tuple[int]:
+    # the token ids used here do not depend on the task or language of the tokenizer
     if -1 in suppress_tokens:
         suppress_tokens = [t for t in suppress_tokens if t >= 0]
         suppress_tokens.extend(tokenizer.non_speech_tokens)
-    elif suppress_tokens is None or len(suppress_tokens) == 0:
-        suppress_tokens = []  # interpret empty string as an empty list
     else:
-        assert isinstance(suppress_tokens, list), "suppress_tokens must be a list"
+        suppress_tokens = list(suppress_tokens)
 
     suppress_tokens.extend(
         [
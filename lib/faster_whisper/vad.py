@@ -2,6 +2,8 @@ import bisect
 import functools
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+
 from dataclasses import dataclass
 from typing import Dict, List, Optional, Tuple
 
@@ -33,6 +35,15 @@ class VadOptions:
       min_silence_duration_ms: In the end of each speech chunk wait for min_silence_duration_ms
         before separating it
       speech_pad_ms: Final speech chunks are padded by speech_pad_ms each side
+      chunk_duration_s: Run the model over independent chunks of this duration in a single
+        batch, so each decoder step processes one window of every chunk. None runs a single
+        pass over the whole audio.
+      chunk_overlap_s: Audio before each chunk that is run through the model only to warm up
+        its state; the probabilities of this overlap are discarded. The longer the overlap,
+        the closer the result is to a single pass.
+      num_threads: When chunk_duration_s is set, split the chunks into this many batches
+        which run concurrently, onnxruntime releases the GIL while running the model. Each
+        batch then runs the model with its share of the CPU cores.
     """
 
     onset: float = 0.5
@@ -41,6 +52,9 @@ class VadOptions:
     max_speech_duration_s: float = float("inf")
     min_silence_duration_ms: int = 2000
     speech_pad_ms: int = 400
+    chunk_duration_s: Optional[float] = None
+    chunk_overlap_s: float = 4.0
+    num_threads: int = 1
 
 
 def get_speech_timestamps(
@@ -63,11 +77,170 @@ def get_speech_timestamps(
     if vad_options is None:
         vad_options = VadOptions(**kwargs)
 
+    window_size_samples = 512
+    audio_length_samples = len(audio)
+
+    if vad_options.chunk_duration_s is not None and vad_options.num_threads > 1:
+        # Every concurrent batch running with all cores would oversubscribe the CPU.
+        model = get_vad_model(max(1, (os.cpu_count() or 1) // vad_options.num_threads))
+    else:
+        model = get_vad_model()
+
+    if vad_options.chunk_duration_s is not None:
+        speech_probs = get_chunked_speech_probs(
+            model,
+            audio.numpy(),
+            int(vad_options.chunk_duration_s * sampling_rate) // window_size_samples,
+            int(vad_options.chunk_overlap_s * sampling_rate) // window_size_samples,
+            num_threads=vad_options.num_threads,
+        )
+    else:
+        padded_audio = np.pad(audio.numpy(), (0, window_size_samples - audio.shape[0] % window_size_samples))
+        speech_probs = model(padded_audio.reshape(1, -1)).squeeze(0)
+
+    return speech_probs_to_timestamps(speech_probs, audio_length_samples, vad_options, sampling_rate)
+
+
+def get_speech_timestamps_batch(
+    audios: List[torch.Tensor],
+    vad_options: Optional[VadOptions] = None,
+    sampling_rate: int = 16000,
+) -> List[List[dict]]:
+    """Runs get_speech_timestamps for many clips with a single batched model call.
+
+    Args:
+      audios: One dimensional float arrays.
+      vad_options: Options for VAD processing, chunk_duration_s is ignored.
+      sampling rate: Sampling rate of the audio.
+
+    Returns:
+      The speech chunks of each clip, as get_speech_timestamps would return them.
+    """
+    if vad_options is None:
+        vad_options = VadOptions()
+    if not audios:
+        return []
+
+    batch_speech_probs = get_batched_speech_probs(get_vad_model(), [audio.numpy() for audio in audios])
+    return [
+        speech_probs_to_timestamps(speech_probs, len(audio), vad_options, sampling_rate)
+        for audio, speech_probs in zip(audios, batch_speech_probs)
+    ]
+
+
+def get_batched_speech_probs(
+    model: "SileroVADModel",
+    audios: List[np.ndarray],
+    window_size_samples: int = 512,
+    context_size_samples: int = 64,
+) -> List[np.ndarray]:
+    """Speech probabilities of independent clips, computed as one batch.
+
+    The clips are padded to the same number of windows. The result of each clip is the
+    same as a single pass over that clip alone.
+    """
+    num_windows = [audio.shape[0] // window_size_samples + 1 for audio in audios]
+    batch = np.zeros((len(audios), max(num_windows) * window_size_samples), dtype=np.float32)
+    for row, (audio, row_windows) in enumerate(zip(audios, num_windows)):
+        batch[row, : audio.shape[0]] = audio
+        # a single pass zeroes the tail of its last window, see SileroVADModel.__call__
+        row_end = row_windows * window_size_samples
+        batch[row, row_end - context_size_samples : row_end] = 0
+
+    speech_probs = model(batch, window_size_samples, context_size_samples)
+    return [speech_probs[row, :row_windows] for row, row_windows in enumerate(num_windows)]
+
+
+def get_chunked_speech_probs(
+    model: "SileroVADModel",
+    audio: np.ndarray,
+    chunk_windows: int,
+    warmup_windows: int,
+    num_threads: int = 1,
+    window_size_samples: int = 512,
+    context_size_samples: int = 64,
+) -> np.ndarray:
+    """Speech probabilities of one long audio, computed as batches of independent chunks.
+
+    Every chunk is preceded by `warmup_windows` windows of the audio before it, whose
+    probabilities are discarded, so that the model state has caught up by the time the
+    chunk itself starts. The first chunk is the same as a single pass. The probabilities
+    of the chunks are stitched back together, so the post-processing still sees one
+    continuous sequence and no speech chunk has to be merged across chunk boundaries.
+
+    With `num_threads` > 1 the chunks are split into that many batches which run
+    concurrently in a thread pool.
+    """
+    chunk_windows = max(1, chunk_windows)
+    num_windows = audio.shape[0] // window_size_samples + 1
+
+    rows = []
+    for chunk_start in range(0, num_windows, chunk_windows):
+        row_start = max(0, chunk_start - warmup_windows)
+        chunk_end = min(num_windows, chunk_start + chunk_windows)
+        rows.append((row_start, chunk_start, chunk_end))
+
+    # One extra window per row: the model zeroes the tail of the last window of every row.
+    row_windows = max(chunk_end - row_start for row_start, _, chunk_end in rows) + 1
+
+    def run_rows(batch_rows: List[Tuple[int, int, int]]) -> List[np.ndarray]:
+        batch = np.zeros((len(batch_rows), row_windows * window_size_samples), dtype=np.float32)
+        for row, (row_start, _, chunk_end) in enumerate(batch_rows):
+            samples = audio[row_start * window_size_samples : chunk_end * window_size_samples]
+            batch[row, : samples.shape[0]] = samples
+            if chunk_end == num_windows:
+                # a single pass zeroes the tail of the last window of the audio
+                row_end = (chunk_end - row_start) * window_size_samples
+                batch[row, row_end - context_size_samples : row_end] = 0
+
+        speech_probs = model(batch, window_size_samples, context_size_samples)
+        return [
+            speech_probs[row, chunk_start - row_start : chunk_end - row_start]
+            for row, (row_start, chunk_start, chunk_end) in enumerate(batch_rows)
+        ]
+
+    num_batches = max(1, min(num_threads, len(rows)))
+    batch_size = -(-len(rows) // num_batches)
+    batches = [rows[i : i + batch_size] for i in range(0, len(rows), batch_size)]
+
+    if len(batches) == 1:
+        results = [run_rows(batches[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+            results = list(executor.map(run_rows, batches))
+
+    return np.concatenate([speech_probs for result in results for speech_probs in result])
+
+
+def speech_probs_to_timestamps(
+    speech_probs: np.ndarray,
+    audio_length_samples: int,
+    vad_options: VadOptions,
+    sampling_rate: int = 16000,
+    window_size_samples: int = 512,
+) -> List[dict]:
+    """Turns the Silero speech probabilities of consecutive windows into speech chunks.
+
+    This is the onset/offset hysteresis with the min silence, min speech and max speech
+    duration rules of the reference Silero loop. The windows are run-length encoded by
+    their speech/silence class first, and the state machine only visits the windows
+    where its state can change instead of every window.
+
+    Args:
+      speech_probs: One dimensional array with the speech probability of each window.
+      audio_length_samples: Number of samples of the audio (without the padding).
+      vad_options: Options for VAD processing.
+      sampling_rate: Sampling rate of the audio.
+      window_size_samples: Number of samples of each window.
+
+    Returns:
+      List of dicts containing begin and end samples of each speech chunk.
+    """
     onset = vad_options.onset
+    offset = vad_options.offset
     min_speech_duration_ms = vad_options.min_speech_duration_ms
     max_speech_duration_s = vad_options.max_speech_duration_s
     min_silence_duration_ms = vad_options.min_silence_duration_ms
-    window_size_samples = 512
     speech_pad_ms = vad_options.speech_pad_ms
     min_speech_samples = sampling_rate * min_speech_duration_ms / 1000
     speech_pad_samples = sampling_rate * speech_pad_ms / 1000
@@ -75,76 +248,120 @@ def get_speech_timestamps(
     min_silence_samples = sampling_rate * min_silence_duration_ms / 1000
     min_silence_samples_at_max_speech = sampling_rate * 98 / 1000
 
-    audio_length_samples = len(audio)
-
-    model = get_vad_model()
+    # the model gives one (1,)-shaped probability per window
+    speech_probs = np.asarray(speech_probs).reshape(-1)
+    num_windows = speech_probs.shape[0]
+    if num_windows == 0:
+        return []
 
-    padded_audio = np.pad(audio.numpy(), (0, window_size_samples - audio.shape[0] % window_size_samples))
-    speech_probs = model(padded_audio.reshape(1, -1)).squeeze(0)
+    # Run-length encode the windows by (prob >= onset, prob < offset).
+    window_classes = (speech_probs >= onset).astype(np.int8) | ((speech_probs < offset).astype(np.int8) << 1)
+    run_starts = np.concatenate([[0], np.flatnonzero(np.diff(window_classes)) + 1])
+    run_ends = np.append(run_starts[1:], num_windows)
+    run_classes = window_classes[run_starts]
+
+    def first_window_above(sample: float, threshold: float) -> int:
+        # smallest window index i with `window_size_samples * i - sample > threshold`
+        if threshold == float("inf"):
+            return num_windows
+        i = int((sample + threshold) // window_size_samples)
+        while i > 0 and window_size_samples * (i - 1) - sample > threshold:
+            i -= 1
+        while not window_size_samples * i - sample > threshold:
+            i += 1
+        return i
+
+    def first_window_from(sample: float, threshold: float) -> int:
+        # smallest window index i with `window_size_samples * i - sample >= threshold`
+        if threshold == float("inf"):
+            return num_windows
+        i = int((sample + threshold) // window_size_samples)
+        while i > 0 and window_size_samples * (i - 1) - sample >= threshold:
+            i -= 1
+        while not window_size_samples * i - sample >= threshold:
+            i += 1
+        return i
 
     triggered = False
     speeches = []
-    current_speech = {}
-    offset = vad_options.offset
+    # start of the current speech chunk, only meaningful while triggered
+    speech_start = 0
 
     # to save potential segment end (and tolerate some silence)
     temp_end = 0
     # to save potential segment limits in case of maximum segment size reached
     prev_end = next_start = 0
 
-    for i, speech_prob in enumerate(speech_probs):
-        if (speech_prob >= onset) and temp_end:
-            temp_end = 0
-            if next_start < prev_end:
-                next_start = window_size_samples * i
-
-        if (speech_prob >= onset) and not triggered:
-            triggered = True
-            current_speech["start"] = window_size_samples * i
-            continue
-
-        if triggered and (window_size_samples * i) - current_speech["start"] > max_speech_samples:
-            if prev_end:
-                current_speech["end"] = prev_end
-                speeches.append(current_speech)
-                current_speech = {}
-                # previously reached silence (< neg_thres) and is still not speech (< thres)
+    for run_start, run_end, run_class in zip(run_starts.tolist(), run_ends.tolist(), run_classes.tolist()):
+        is_speech = bool(run_class & 1)
+        is_silence = bool(run_class & 2)
+        i = run_start
+
+        while i < run_end:
+            position = window_size_samples * i
+
+            if is_speech and temp_end:
+                temp_end = 0
                 if next_start < prev_end:
-                    triggered = False
-                else:
-                    current_speech["start"] = next_start
-                prev_end = next_start = temp_end = 0
-            else:
-                current_speech["end"] = window_size_samples * i
-                speeches.append(current_speech)
-                current_speech = {}
-                prev_end = next_start = temp_end = 0
-                triggered = False
-                continue
-
-        if (speech_prob < offset) and triggered:
-            if not temp_end:
-                temp_end = window_size_samples * i
-            # condition to avoid cutting in very short silence
-            if (window_size_samples * i) - temp_end > min_silence_samples_at_max_speech:
-                prev_end = temp_end
-            if (window_size_samples * i) - temp_end < min_silence_samples:
-                continue
+                    next_start = position
+
+            if is_speech and not triggered:
+                triggered = True
+                speech_start = position
             else:
-                current_speech["end"] = temp_end
-                if (current_speech["end"] - current_speech["start"]) > min_speech_samples:
-                    speeches.append(current_speech)
-                current_speech = {}
-                prev_end = next_start = temp_end = 0
-                triggered = False
-                continue
-
-    if current_speech:
+                ended = False
+                if triggered and position - speech_start > max_speech_samples:
+                    if prev_end:
+                        speeches.append({"start": speech_start, "end": prev_end})
+                        # previously reached silence (< neg_thres) and is still not speech (< thres)
+                        if next_start < prev_end:
+                            triggered = False
+                        else:
+                            speech_start = next_start
+                        prev_end = next_start = temp_end = 0
+                    else:
+                        speeches.append({"start": speech_start, "end": position})
+                        prev_end = next_start = temp_end = 0
+                        triggered = False
+                        ended = True
+
+                if not ended and is_silence and triggered:
+                    if not temp_end:
+                        temp_end = position
+                    # condition to avoid cutting in very short silence
+                    if position - temp_end > min_silence_samples_at_max_speech:
+                        prev_end = temp_end
+                    if position - temp_end >= min_silence_samples:
+                        if temp_end - speech_start > min_speech_samples:
+                            speeches.append({"start": speech_start, "end": temp_end})
+                        prev_end = next_start = temp_end = 0
+                        triggered = False
+
+            # Jump to the next window of this run where the state can change.
+            next_window = run_end
+            if triggered:
+                if is_speech and temp_end:
+                    next_window = i + 1
+                next_window = min(next_window, first_window_above(speech_start, max_speech_samples))
+                if is_silence:
+                    if not temp_end:
+                        next_window = i + 1
+                    else:
+                        if prev_end != temp_end:
+                            next_window = min(
+                                next_window,
+                                first_window_above(temp_end, min_silence_samples_at_max_speech),
+                            )
+                        next_window = min(next_window, first_window_from(temp_end, min_silence_samples))
+            elif is_speech:
+                next_window = i + 1
+            i = max(i + 1, next_window)
+
+    if triggered:
         if not temp_end:
             temp_end = audio_length_samples
-        if temp_end - current_speech['start'] > min_speech_samples:
-            current_speech["end"] = temp_end
-            speeches.append(current_speech)
+        if temp_end - speech_start > min_speech_samples:
+            speeches.append({"start": speech_start, "end": temp_end})
 
     for i, speech in enumerate(speeches):
         if i == 0:
@@ -228,15 +445,19 @@ class SpeechTimestampsMap:
 
 
 @functools.lru_cache
-def get_vad_model():
-    """Returns the VAD model instance."""
+def get_vad_model(intra_op_num_threads: int = 0):
+    """Returns the VAD model instance.
+
+    Args:
+      intra_op_num_threads: Threads of each model call, 0 lets onnxruntime use all cores.
+    """
     encoder_path = os.path.join(get_assets_path(), "silero_encoder_v5.onnx")
     decoder_path = os.path.join(get_assets_path(), "silero_decoder_v5.onnx")
-    return SileroVADModel(encoder_path, decoder_path)
+    return SileroVADModel(encoder_path, decoder_path, intra_op_num_threads)
 
 
 class SileroVADModel:
-    def __init__(self, encoder_path, decoder_path):
+    def __init__(self, encoder_path, decoder_path, intra_op_num_threads: int = 0):
         try:
             import onnxruntime
         except ImportError as e:
@@ -244,7 +465,7 @@ class SileroVADModel:
 
         opts = onnxruntime.SessionOptions()
         opts.inter_op_num_threads = 0
-        opts.intra_op_num_threads = 0
+        opts.intra_op_num_threads = intra_op_num_threads
         opts.log_severity_level = 4
 
         self.encoder_session = onnxruntime.InferenceSession(
@@ -0,0 +1,171 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+from artifact_cache import get_artifact_cache
+from lib.faster_whisper.vad import VadOptions
+from split_audio_files import AudioSegment, SAMPLING_RATE
+from transcriber import Transcriber, TranscribeOption
+
+
+class ExecutionBackend:
+    # worker threads sharing one model with inter_threads=num_workers
+    THREAD = 'thread'
+    # worker processes, each with its own model pinned to its own cores
+    PROCESS = 'process'
+
+
+@dataclass
+class SharedAudio:
+    """Samples [start, end) of the float32 PCM in the shared memory block `name`."""
+    name: str
+    start: int
+    end: int
+
+
+# (start, end, text) of a transcribed segment, shifted by the audio segment offset
+CompactSegment = Tuple[float, float, str]
+
+
+@contextmanager
+def share_audio_segments(audio_segments: List[AudioSegment]) -> Iterator[List[Union[str, SharedAudio]]]:
+    """Copies the in-memory audio segments into one shared memory block for the worker processes.
+
+    Yields one reference per audio segment: a SharedAudio, or the path of a segment file
+    which the workers decode themselves. The block is unlinked on exit.
+    """
+    tensors = [segment.audio for segment in audio_segments if isinstance(segment.audio, torch.Tensor)]
+    total_samples = sum(tensor.shape[0] for tensor in tensors)
+    if total_samples == 0:
+        yield [segment.audio for segment in audio_segments]
+        return
+
+    shm = SharedMemory(create=True, size=total_samples * 4)
+    try:
+        pcm = np.ndarray((total_samples,), dtype=np.float32, buffer=shm.buf)
+        refs = []
+        start = 0
+        for segment in audio_segments:
+            if not isinstance(segment.audio, torch.Tensor):
+                refs.append(segment.audio)
+                continue
+            end = start + segment.audio.shape[0]
+            pcm[start:end] = segment.audio.numpy()
+            refs.append(SharedAudio(shm.name, start, end))
+            start = end
+        del pcm
+        yield refs
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+_worker_transcriber: Optional[Transcriber] = None
+
+
+def _init_worker(model_size: str, cpu_threads: int, core_groups: multiprocessing.Queue):
+    global _worker_transcriber
+    try:
+        cores = core_groups.get(timeout=5)
+    except queue.Empty:
+        # a worker replacing a dead one finds the groups taken
+        cores = []
+    if cores:
+        os.sched_setaffinity(0, cores)
+    threads = cpu_threads or len(cores)
+    start_time = time.time()
+    _worker_transcriber = Transcriber(model_size, num_workers=1, device='cpu', cpu_threads=threads)
+    _worker_transcriber.warmup()
+    logging.info(f"[process_backend] worker {os.getpid()} loaded {model_size} in {time.time() - start_time:.2f}s, "
+                 f"cores: {cores or 'all'}, cpu_threads: {threads}")
+
+
+def _transcribe(audio_file: str, audio: Union[str, SharedAudio], offset: float, options: TranscribeOption,
+                speech_chunks: Optional[List[dict]] = None, start_sample: Optional[int] = None) -> List[CompactSegment]:
+    if isinstance(audio, SharedAudio):
+        # spawned workers share the resource tracker of the parent, which unlinks the block
+        shm = SharedMemory(name=audio.name)
+        try:
+            pcm = np.ndarray((audio.end,), dtype=np.float32, buffer=shm.buf)
+            segment_audio = torch.from_numpy(pcm[audio.start:].copy())
+            del pcm
+        finally:
+            shm.close()
+    else:
+        segment_audio = audio
+
+    if speech_chunks is None and options.vad_filter and isinstance(segment_audio, torch.Tensor):
+        if start_sample is None:
+            start_sample = int(offset * SAMPLING_RATE)
+        speech_chunks = get_artifact_cache().load_speech_chunks(audio_file, segment_audio, VadOptions(**options.vad_parameters),
+                                                                SAMPLING_RATE, start_sample)
+    return [(segment.start, segment.end, segment.text)
+            for segment in _worker_transcriber.iter_segments(segment_audio, offset, options, speech_chunks)]
+
+
+def split_cores(processes: int) -> List[List[int]]:
+    """Splits the cores this process may run on into `processes` contiguous groups.
+
+    Neighbouring core ids usually share a socket, so a contiguous group keeps a model
+    replica on one NUMA node.
+    """
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+    if len(cores) < processes:
+        return [[] for _ in range(processes)]
+    group_size = len(cores) // processes
+    return [cores[i * group_size:(i + 1) * group_size] for i in range(processes)]
+
+
+class TranscriberProcessPool:
+    """Worker processes that each load their own CPU model once and transcribe one audio segment at a time.
+
+    Feature extraction, tokenization and the segment assembly of every worker run under its
+    own GIL. When `pin_cores` is set, every worker is pinned to its own group of cores and
+    runs the model with as many threads as it has cores, unless `cpu_threads` is given.
+    """
+
+    def __init__(self, model_size: str, processes: int, cpu_threads: int = 0, pin_cores: bool = True):
+        self.model_size = model_size
+        self.processes = processes
+        # spawn: forking a parent that already runs onnxruntime and ctranslate2 threads is unsafe
+        context = multiprocessing.get_context('spawn')
+        core_groups = context.Queue()
+        for cores in (split_cores(processes) if pin_cores else [[] for _ in range(processes)]):
+            core_groups.put(cores)
+        self.executor = ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker,
+                                            initargs=(model_size, cpu_threads, core_groups))
+
+    def submit(self, audio_file: str, audio: Union[str, SharedAudio], offset: float, options: TranscribeOption,
+               speech_chunks: Optional[List[dict]] = None, start_sample: Optional[int] = None) -> Future:
+        return self.executor.submit(_transcribe, audio_file, audio, offset, options, speech_chunks, start_sample)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+_process_pools: Dict[Tuple[str, int, int, bool], TranscriberProcessPool] = {}
+_process_pools_lock = threading.Lock()
+
+
+def get_process_pool(model_size: str = 'large-v3-turbo', processes: int = 2, cpu_threads: int = 0,
+                     pin_cores: bool = True) -> TranscriberProcessPool:
+    """Returns the process-wide worker pool of (model_size, processes, cpu_threads, pin_cores)."""
+    key = (model_size, processes, cpu_threads, pin_cores)
+    with _process_pools_lock:
+        pool = _process_pools.get(key)
+        if pool is None:
+            pool = TranscriberProcessPool(model_size, processes, cpu_threads, pin_cores)
+            _process_pools[key] = pool
+        return pool
@@ -0,0 +1,151 @@
+import bisect
+import math
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+
+@dataclass
+class PlannedSegment:
+    start_sample: int
+    end_sample: int
+    # speech chunks of the whole-file VAD inside the segment, relative to start_sample
+    speech_chunks: List[dict]
+
+    @property
+    def speech_samples(self) -> int:
+        return speech_samples(self.speech_chunks)
+
+
+def speech_samples(speech_chunks: List[dict]) -> int:
+    return sum(chunk['end'] - chunk['start'] for chunk in speech_chunks)
+
+
+def nearest_gap_cuts(speech_chunks: List[dict], targets: List[int]) -> List[int]:
+    """Moves every target sample into the nearest silence between two speech chunks.
+
+    A target already in a silence is kept, otherwise the cut goes to the middle of the
+    closest silence so no speech is clipped at either side. Without any silence between
+    the speech chunks the targets themselves are the cuts. Targets that end up in the
+    same place are merged, the returned cuts are strictly increasing.
+    """
+    gaps = speech_gaps(speech_chunks)
+    cuts = []
+    for target in targets:
+        cut = nearest_gap_cut(gaps, target) if gaps else target
+        if not cuts or cut > cuts[-1]:
+            cuts.append(cut)
+    return cuts
+
+
+def speech_gaps(speech_chunks: List[dict]) -> List[Tuple[int, int]]:
+    """The non-empty silences between consecutive speech chunks, as (start, end) samples."""
+    gaps = [(speech_chunks[i]['end'], speech_chunks[i + 1]['start']) for i in range(len(speech_chunks) - 1)]
+    return [(start, end) for start, end in gaps if end > start]
+
+
+def nearest_gap_cut(gaps: List[Tuple[int, int]], target: int, max_shift: Optional[int] = None) -> Optional[int]:
+    """The cut in the silence of `gaps` nearest to `target`, see `nearest_gap_cuts`. None without any gaps.
+
+    With `max_shift`, the cut stays within `max_shift` samples of the target, and None is
+    returned when no silence reaches that far.
+    """
+    i = bisect.bisect_right(gaps, (target, math.inf)) - 1
+    if i >= 0 and target <= gaps[i][1]:
+        return target
+
+    # between gaps[i] and gaps[i + 1], take the one with the closer edge
+    candidates = [j for j in (i, i + 1) if 0 <= j < len(gaps)]
+    if not candidates:
+        return None
+    j = min(candidates, key=lambda j: min(abs(target - gaps[j][0]), abs(target - gaps[j][1])))
+    cut = (gaps[j][0] + gaps[j][1]) // 2
+    if max_shift is not None:
+        if min(abs(target - gaps[j][0]), abs(target - gaps[j][1])) > max_shift:
+            return None
+        cut = min(max(cut, target - max_shift), target + max_shift)
+    return cut
+
+
+def split_at_cuts(speech_chunks: List[dict], cuts: List[int], total_samples: int) -> List[PlannedSegment]:
+    """Splits [0, total_samples) at `cuts`.
+
+    The cuts usually lie in silences between speech chunks. A speech chunk that a cut falls
+    into is split between the two segments.
+    """
+    bounds = [0] + [cut for cut in cuts if 0 < cut < total_samples] + [total_samples]
+    segments = []
+    i = 0
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        chunks = []
+        while i < len(speech_chunks) and speech_chunks[i]['start'] < end:
+            chunk = speech_chunks[i]
+            chunks.append({'start': max(chunk['start'], start) - start, 'end': min(chunk['end'], end) - start})
+            if chunk['end'] > end:
+                break
+            i += 1
+        segments.append(PlannedSegment(start, end, chunks))
+    return segments
+
+
+def plan_balanced_segments(speech_chunks: List[dict], total_samples: int, num_workers: int, sampling_rate: int,
+                           segments_per_worker: int = 2, min_segment_speech_s: float = 60) -> List[PlannedSegment]:
+    """Splits the audio into segments of about equal speech for `num_workers` workers.
+
+    The number of segments follows from the total speech after VAD: `segments_per_worker`
+    per worker, so dispatching the longest first evens out what the cuts at silences could
+    not, but never less than `min_segment_speech_s` of speech per segment.
+
+    Every cut is placed in the silence nearest to where the cumulative speech reaches the
+    next multiple of total_speech / segments. When the VAD found no silence between its
+    speech chunks, the cuts are made right there instead.
+    """
+    total_speech = speech_samples(speech_chunks)
+    count = min(num_workers * segments_per_worker, math.floor(total_speech / (min_segment_speech_s * sampling_rate)))
+    if count <= 1:
+        return split_at_cuts(speech_chunks, [], total_samples)
+
+    # cumulative speech at the end of every chunk
+    speech_ends = []
+    speech = 0
+    for chunk in speech_chunks:
+        speech += chunk['end'] - chunk['start']
+        speech_ends.append(speech)
+
+    targets = []
+    for k in range(1, count):
+        target_speech = total_speech * k / count
+        i = bisect.bisect_left(speech_ends, target_speech)
+        chunk = speech_chunks[i]
+        targets.append(int(chunk['end'] - (speech_ends[i] - target_speech)))
+    return split_at_cuts(speech_chunks, nearest_gap_cuts(speech_chunks, targets), total_samples)
+
+
+def plan_segments_at_silences(speech_chunks: List[dict], total_samples: int, segment_samples: int,
+                              min_last_segment_samples: int = 0,
+                              max_segment_samples: Optional[int] = None) -> List[PlannedSegment]:
+    """Splits the audio into segments of about `segment_samples`, each cut in the silence nearest to its target.
+
+    The target of every cut is `segment_samples` after the previous cut, and the silence may
+    move it by at most `max_segment_samples - segment_samples` (default a quarter of
+    `segment_samples`). Without any silence in that range, the segment is cut hard at
+    `max_segment_samples`. The last cut is dropped when it would leave a segment shorter
+    than `min_last_segment_samples`, the segment before it takes the tail.
+    """
+    if max_segment_samples is None:
+        max_segment_samples = segment_samples + segment_samples // 4
+    max_shift = max_segment_samples - segment_samples
+    gaps = speech_gaps(speech_chunks)
+
+    cuts = []
+    start = 0
+    while start + segment_samples < total_samples:
+        cut = nearest_gap_cut(gaps, start + segment_samples, max_shift)
+        if cut is None:
+            cut = start + max_segment_samples
+        if cut >= total_samples:
+            break
+        cuts.append(cut)
+        start = cut
+    if cuts and total_samples - cuts[-1] < min_last_segment_samples:
+        cuts.pop()
+    return split_at_cuts(speech_chunks, cuts, total_samples)
@@ -1,32 +1,85 @@
+import argparse
 from dataclasses import dataclass
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import datetime
+import json
 import logging
+import threading
+
+from job_queue import AsrJobQueue
 
 app = Flask(__name__)
+job_queue: AsrJobQueue = None
+# concurrent first requests must not each create a queue
+job_queue_lock = threading.Lock()
 
 @dataclass
 class CreateAsrRequest:
     audio_url: str
+    segment_duration: int = 600
     @classmethod
     def from_json(cls, data: dict):
-        return cls(audio_url=data['audio_url'])
+        return cls(audio_url=data['audio_url'], segment_duration=int(data.get('segment_duration', 600)))
+
+def get_job_queue() -> AsrJobQueue:
+    global job_queue
+    with job_queue_lock:
+        if job_queue is None:
+            job_queue = AsrJobQueue()
+    job_queue.start()
+    return job_queue
 
 @app.route('/api/asr/create', methods=['POST'])
 def create_asr():
     try:
         data = CreateAsrRequest.from_json(request.get_json())
+        job = get_job_queue().submit(data.audio_url, data.segment_duration)
         response = {
             'message': '数据接收成功',
+            'job_id': job.id,
+            'status': job.status,
             'received_data': data,
             'processed_at': datetime.datetime.now().isoformat()
         }
-        return jsonify(response)
+        return jsonify(response), 202
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/asr/<job_id>', methods=['GET'])
+def get_asr(job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': f'job {job_id} not found'}), 404
+    return jsonify(job.to_json())
+
+@app.route('/api/asr/<job_id>/stream', methods=['GET'])
+def stream_asr(job_id: str):
+    jobs = get_job_queue()
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'job {job_id} not found'}), 404
+
+    def events():
+        for line in jobs.iter_lines(job):
+            yield f"data: {json.dumps({'line': line}, ensure_ascii=False)}\n\n"
+        yield f"event: done\ndata: {json.dumps({'status': job.status, 'error': job.error})}\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 
 if __name__ == '__main__':
-    app.run(host='localhost', port=8080, debug=True)
-    logging.info('asr service running at localhost:8080')
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="asr server arguments")
+    parser.add_argument("--pool_size", type=int, default=2, help="count of preloaded transcribers working through the job queue")
+    parser.add_argument("--num_workers", type=int, default=6, help="parallel worker count of each job")
+    parser.add_argument("--model_size", type=str, default='large-v3-turbo', help="model")
+    parser.add_argument("--batching", action=argparse.BooleanOptionalAction, default=None,
+                        help="batch the encoder, decoder and alignment calls of the concurrent segments, ASR_BATCHING=1 by default")
+    args = parser.parse_args()
+
+    job_queue = AsrJobQueue(pool_size=args.pool_size, num_workers=args.num_workers, model_size=args.model_size,
+                            batching=args.batching)
+    job_queue.start()
+    logging.info('asr service running at localhost:8080')
+    # the reloader would start a second process and load every model of the pool twice
+    app.run(host='localhost', port=8080, debug=True, use_reloader=False)
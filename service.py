@@ -3,73 +3,86 @@ import datetime
 import hashlib
 import logging
 import os
+import queue
 import subprocess
+import threading
+from concurrent.futures import as_completed
 from concurrent.futures.thread import ThreadPoolExecutor
+from dataclasses import dataclass
 from math import floor
+from typing import Callable, Iterator, List, Optional
 
-from split_audio_files import run as split_audio, RequestData
-from transcriber import Transcriber, TranscribeOption
+import torch
+
+from artifact_cache import ArtifactCache, get_artifact_cache
+from language_context import LanguageContext, detect_job_language
+from lib.faster_whisper.transcribe import Segment
+from lib.faster_whisper.vad import VadOptions
+from process_backend import ExecutionBackend, get_process_pool, share_audio_segments
+from scheduler import speech_samples
+from split_audio_files import run as split_audio, RequestData, AudioSegment, SplitMode, SAMPLING_RATE
+from transcriber import Transcriber, TranscribeOption, get_transcriber, format_line
 from util import timing
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-@timing
-def handle_asr_task(audio_url: str, num_workers: int, segment_duration: int):
-    def download_audio():
-        logging.info(f"[download_audio] audio_url: {audio_url}")
-        md5 = hashlib.md5(audio_url.encode()).hexdigest()
-        audio_file = f'tmp/{md5}/input.mp3'
-        if os.path.exists(audio_file):
-            logging.info(f"[download_audio] audio url {audio_url} already exists, skip download")
-            return audio_file
-        os.makedirs(os.path.dirname(audio_file), exist_ok=True)
-        subprocess.run(['ffmpeg', '-i', audio_url, audio_file], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        logging.info(f"[download_audio] audio_file: {audio_file}")
-        return audio_file
 
-    def submit_all_transcription_tasks():
-        def sort_and_concat():
-            result = []
-            keys = []
-            for item_dict in tasks_results:
-                def extract_number(filename):
-                    import re
-                    match = re.search(r'(\d+)', filename)
-                    return int(match.group(1)) if match else 0
 
-                keys.append(extract_number(item_dict['segment']))
+@dataclass
+class SegmentResult:
+    index: int
+    # seconds from the start of the input audio
+    offset: float
+    lines: List[str]
 
-            keys = sorted(keys)
 
-            for key in keys:
-                filtered_dict = list(filter(lambda x: x['segment'] == f'{key}.mp3', tasks_results))[0]
-                result.append(filtered_dict['transcription_result'])
+@dataclass
+class AsrTask:
+    audio_file: str
+    audio_segments: List[AudioSegment]
+    # None with the process backend, every worker process loads its own
+    transcriber: Optional[Transcriber]
+    transcribe_option: TranscribeOption
+    artifact_cache: ArtifactCache
+    # None when the segments detect their language themselves
+    language_context: Optional[LanguageContext] = None
+    # let the segments of a 'multi' job whose own probes disagree detect their language
+    language_recheck: bool = True
 
-            return result
+    def language_for(self, segment: AudioSegment) -> Optional[str]:
+        if self.language_context is None:
+            return None
+        return self.language_context.language_for(segment.index, self.language_recheck)
+
+    def load_speech_chunks(self, segment: AudioSegment) -> Optional[List[dict]]:
+        if not self.transcribe_option.vad_filter or not isinstance(segment.audio, torch.Tensor):
+            return None
+        if segment.speech_chunks is not None:
+            return segment.speech_chunks
+        start_sample = segment.start_sample if segment.start_sample is not None else int(segment.offset * SAMPLING_RATE)
+        return self.artifact_cache.load_speech_chunks(self.audio_file, segment.audio,
+                                                      VadOptions(**self.transcribe_option.vad_parameters),
+                                                      SAMPLING_RATE, start_sample)
 
-        with ThreadPoolExecutor(max_workers=num_workers) as executor:
-            logging.info(f"[submit_all_transcription_tasks] executing tasks count: {len(tasks)}")
-            futures = [executor.submit(task) for task in tasks]
-            tasks_results = [future.result() for future in futures]
-
-        return sort_and_concat()
-    def do_transcription(segment_file: str):
-        index = int(os.path.basename(segment_file).split('.')[0])
-        return {
-            'segment': os.path.basename(segment_file),
-            'transcription_result': transcriber.transcribe_segment(segment_file, segment_duration * index, transcribe_option)
-        }
-
-    audio_file = download_audio()
-    request_data = RequestData()
-    request_data.parse_from_request_json({
-        'audio_file_path': audio_file,
-        'segment_duration_seconds': segment_duration,
-        'overlap_seconds': 0
-    })
 
-    audio_segments = split_audio(request_data)
-    transcriber = Transcriber(num_workers=num_workers)
+def download_audio(audio_url: str) -> str:
+    logging.info(f"[download_audio] audio_url: {audio_url}")
+    md5 = hashlib.md5(audio_url.encode()).hexdigest()
+    audio_file = f'tmp/{md5}/input.mp3'
+    if os.path.exists(audio_file):
+        logging.info(f"[download_audio] audio url {audio_url} already exists, skip download")
+        return audio_file
+    os.makedirs(os.path.dirname(audio_file), exist_ok=True)
+    subprocess.run(['ffmpeg', '-i', audio_url, audio_file], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    logging.info(f"[download_audio] audio_file: {audio_file}")
+    return audio_file
+
+
+def prepare_asr_task(audio_url: str, num_workers: int, segment_duration: int, transcriber: Optional[Transcriber] = None,
+                     model_size: str = 'large-v3-turbo', split_mode: str = SplitMode.BALANCED,
+                     backend: str = ExecutionBackend.THREAD, language_recheck: bool = True,
+                     batching: Optional[bool] = None) -> AsrTask:
+    audio_file = download_audio(audio_url)
     transcribe_option = TranscribeOption(5, "", True, {
         'onset': 0.6,
         'offset': 0.4,
@@ -77,23 +90,185 @@ def handle_asr_task(audio_url: str, num_workers: int, segment_duration: int):
         'speech_pad_ms': 0,
         'min_speech_duration_ms': 160,
     }, {'zh': True, 'default': False})
+    request_data = RequestData()
+    request_data.parse_from_request_json({
+        'audio_file_path': audio_file,
+        'segment_duration_seconds': segment_duration,
+        'overlap_seconds': 0,
+        'split_mode': split_mode,
+        'num_workers': num_workers,
+        'vad_parameters': transcribe_option.vad_parameters,
+    })
+
+    artifact_cache = get_artifact_cache()
+    audio_segments = split_audio(request_data, artifact_cache)
+    if transcribe_option.vad_filter:
+        load_segment_speech_chunks(audio_file, audio_segments, transcribe_option, artifact_cache)
+    if transcriber is None and backend == ExecutionBackend.THREAD:
+        transcriber = get_transcriber(model_size, num_workers, batching=batching)
+    # one batched detection for the job instead of one per segment
+    language_context = detect_job_language(transcriber.model, audio_segments) if transcriber is not None else None
+    return AsrTask(audio_file, audio_segments, transcriber, transcribe_option, artifact_cache, language_context,
+                   language_recheck)
+
+
+def load_segment_speech_chunks(audio_file: str, audio_segments: List[AudioSegment], transcribe_option: TranscribeOption,
+                               artifact_cache: ArtifactCache):
+    """Runs the VAD of all in-memory segments without speech chunks as one batch, instead of one pass per worker."""
+    segments = [segment for segment in audio_segments
+                if segment.speech_chunks is None and isinstance(segment.audio, torch.Tensor)]
+    if not segments:
+        return
+    start_samples = [segment.start_sample if segment.start_sample is not None else int(segment.offset * SAMPLING_RATE)
+                     for segment in segments]
+    batch = artifact_cache.load_speech_chunks_batch(audio_file, [segment.audio for segment in segments], start_samples,
+                                                    VadOptions(**transcribe_option.vad_parameters), SAMPLING_RATE)
+    for segment, speech_chunks in zip(segments, batch):
+        segment.speech_chunks = speech_chunks
+
 
-    tasks = [lambda segment=segment: do_transcription(segment) for segment in audio_segments]
+@timing
+def handle_asr_task(audio_url: str, num_workers: int, segment_duration: int, transcriber: Optional[Transcriber] = None,
+                    model_size: str = 'large-v3-turbo', split_mode: str = SplitMode.BALANCED,
+                    on_result: Optional[Callable[[SegmentResult], None]] = None,
+                    backend: str = ExecutionBackend.THREAD, cpu_threads: int = 0,
+                    language_recheck: bool = True, batching: Optional[bool] = None) -> List[SegmentResult]:
+    """Transcribes the audio at `audio_url` segment by segment.
+
+    `on_result` is called from the calling thread with every segment result as soon as it
+    completes, in completion order. The returned results are in timeline order.
+
+    With the process backend the segments run in `num_workers` worker processes, each with
+    its own model using `cpu_threads` threads (0: one per pinned core), and the decoded
+    audio is handed over through shared memory.
+
+    With the thread backend the language is detected once for the whole job; in a job
+    found to be 'multi', `language_recheck` lets the segments whose own probes disagree
+    detect their language again instead of being transcribed as 'multi'.
+    """
+    def submit_all_transcription_tasks():
+        # segment indexes are 0..n-1, every result goes straight into its slot
+        results: List[Optional[SegmentResult]] = [None] * len(task.audio_segments)
+        logging.info(f"[submit_all_transcription_tasks] executing tasks count: {len(task.audio_segments)} on {backend} backend")
+        if backend == ExecutionBackend.PROCESS:
+            pool = get_process_pool(model_size, num_workers, cpu_threads)
+            with share_audio_segments(task.audio_segments) as audio_refs:
+                futures = {pool.submit(task.audio_file, audio_refs[segment.index], segment.offset, task.transcribe_option,
+                                       segment.speech_chunks, segment.start_sample): segment
+                           for segment in dispatch_order(task.audio_segments)}
+                for future in as_completed(futures):
+                    segment = futures[future]
+                    lines = [format_line(start, end, text) for start, end, text in future.result()]
+                    collect(results, SegmentResult(segment.index, segment.offset, lines))
+            return results
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(do_transcription, segment) for segment in dispatch_order(task.audio_segments)]
+            for future in as_completed(futures):
+                collect(results, future.result())
+
+        return results
+
+    def collect(results: List[Optional[SegmentResult]], result: SegmentResult):
+        results[result.index] = result
+        if on_result is not None:
+            on_result(result)
+
+    def do_transcription(segment: AudioSegment) -> SegmentResult:
+        lines = task.transcriber.transcribe_segment(segment.audio, segment.offset, task.transcribe_option,
+                                                    task.load_speech_chunks(segment), task.language_for(segment))
+        return SegmentResult(segment.index, segment.offset, lines)
+
+    task = prepare_asr_task(audio_url, num_workers, segment_duration, transcriber, model_size, split_mode, backend,
+                            language_recheck, batching)
     return submit_all_transcription_tasks()
 
+
+def dispatch_order(audio_segments: List[AudioSegment]) -> List[AudioSegment]:
+    """Longest segments first, so no worker picks up a long segment when the others are nearly done."""
+    def work(segment: AudioSegment):
+        if segment.speech_chunks is not None:
+            return speech_samples(segment.speech_chunks)
+        return segment.audio.shape[0] if isinstance(segment.audio, torch.Tensor) else 0
+
+    return sorted(audio_segments, key=work, reverse=True)
+
+
+# put by a stream_asr_task worker once its audio segment is fully transcribed
+_SEGMENT_DONE = object()
+
+
+def stream_asr_task(audio_url: str, num_workers: int, segment_duration: int, transcriber: Optional[Transcriber] = None,
+                    model_size: str = 'large-v3-turbo', split_mode: str = SplitMode.BALANCED,
+                    batching: Optional[bool] = None) -> Iterator[Segment]:
+    """Yields the transcribed segments of the audio at `audio_url` in timeline order.
+
+    All audio segments are transcribed concurrently like in `handle_asr_task`, and every
+    segment is yielded as soon as everything before it on the timeline is done, so the
+    first lines show up after the first decoded window instead of after the whole job.
+    Closing the generator stops the audio segments that are still running.
+    """
+    task = prepare_asr_task(audio_url, num_workers, segment_duration, transcriber, model_size, split_mode,
+                            batching=batching)
+    # one queue per audio segment, the consumer drains them in timeline order
+    queues = [queue.Queue() for _ in task.audio_segments]
+    stopped = threading.Event()
+
+    def do_transcription(segment: AudioSegment):
+        segment_queue = queues[segment.index]
+        try:
+            for result in task.transcriber.iter_segments(segment.audio, segment.offset, task.transcribe_option,
+                                                         task.load_speech_chunks(segment), task.language_for(segment)):
+                if stopped.is_set():
+                    break
+                segment_queue.put(result)
+            segment_queue.put(_SEGMENT_DONE)
+        except Exception as e:
+            segment_queue.put(e)
+
+    executor = ThreadPoolExecutor(max_workers=num_workers)
+    try:
+        logging.info(f"[stream_asr_task] executing tasks count: {len(task.audio_segments)}")
+        for segment in task.audio_segments:
+            executor.submit(do_transcription, segment)
+        for segment_queue in queues:
+            while True:
+                result = segment_queue.get()
+                if result is _SEGMENT_DONE:
+                    break
+                if isinstance(result, Exception):
+                    raise result
+                yield result
+    finally:
+        stopped.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="asr service arguments")
     parser.add_argument("--num_workers", type=int, default=6, help="parallel worker count")
     parser.add_argument("--segment_duration", type=int, default=600, help="duration in seconds of each segment")
     parser.add_argument("--model_size", type=str, default='large-v3-turbo', help="model")
     parser.add_argument("--audio_url", type=str, help="Audio url")
+    parser.add_argument("--split_mode", type=str, default=SplitMode.BALANCED, choices=[SplitMode.BALANCED, SplitMode.SILENCE, SplitMode.MEMORY, SplitMode.FFMPEG],
+                        help="slice the decoded waveform at silences into equal work per worker (segment_duration is ignored), "
+                             "slice it at the silence nearest to every segment_duration seconds, "
+                             "slice it every segment_duration seconds in memory or cut segment files with ffmpeg")
+    parser.add_argument("--backend", type=str, default=ExecutionBackend.THREAD, choices=[ExecutionBackend.THREAD, ExecutionBackend.PROCESS],
+                        help="run the segments in worker threads sharing one model or in worker processes with one model each")
+    parser.add_argument("--cpu_threads", type=int, default=0, help="model threads of each worker process, 0 for one per pinned core")
+    parser.add_argument("--batching", action=argparse.BooleanOptionalAction, default=None,
+                        help="batch the encoder, decoder and alignment calls of the concurrent segments of the thread backend, "
+                             "ASR_BATCHING=1 by default")
     args = parser.parse_args()
 
-    result = handle_asr_task(args.audio_url, args.num_workers, args.segment_duration)
+    result = handle_asr_task(args.audio_url, args.num_workers, args.segment_duration, model_size=args.model_size,
+                             split_mode=args.split_mode, backend=args.backend, cpu_threads=args.cpu_threads,
+                             batching=args.batching)
     os.makedirs("test_data", exist_ok=True)
     output_file = f"test_data/{floor(datetime.datetime.now().timestamp())}_{args.num_workers}_{args.segment_duration}.txt"
     with open(output_file, 'w') as f:
-        for item in result:
-            for i in item:
-                f.write(f"{i}\n")
+        for segment_result in result:
+            for line in segment_result.lines:
+                f.write(f"{line}\n")
         logging.info(f"write asr result: {output_file}")
\ No newline at end of file
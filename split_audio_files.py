@@ -1,22 +1,69 @@
 import os
 import subprocess
 import logging
+from dataclasses import dataclass
+from typing import List, Optional, Union
+
+import torch
+
+from artifact_cache import ArtifactCache
+from lib.faster_whisper import decode_audio
+from lib.faster_whisper.vad import VadOptions, get_speech_timestamps
+from scheduler import PlannedSegment, plan_balanced_segments, plan_segments_at_silences
+
+SAMPLING_RATE = 16000
+# the whole-file VAD runs over independent chunks of this duration, in one batch per core
+WHOLE_FILE_VAD_CHUNK_SECONDS = 60
+
+
+class SplitMode:
+    # one ffmpeg process per segment, every segment is re-encoded to a file
+    FFMPEG = 'ffmpeg'
+    # decode the input once and slice the waveform in memory
+    MEMORY = 'memory'
+    # like memory, but the count and cut points of the segments follow from a whole-file VAD
+    # and the worker count, every cut is in a silence
+    BALANCED = 'balanced'
+    # like memory, but every cut is moved into the silence of a whole-file VAD nearest to it
+    SILENCE = 'silence'
 
 
 class RequestData:
     overlap_seconds = None
     segment_duration_seconds = None
     audio_file_path = None
+    split_mode = None
+    num_workers = None
+    vad_parameters = None
 
     def __init__(self):
         self.overlap_seconds = None
         self.segment_duration_seconds = None
         self.audio_file_path = None
+        self.split_mode = SplitMode.FFMPEG
+        self.num_workers = 1
+        self.vad_parameters = {}
 
     def parse_from_request_json(self, request_json):
         self.audio_file_path = request_json['audio_file_path']
         self.segment_duration_seconds = request_json['segment_duration_seconds']
         self.overlap_seconds = request_json['overlap_seconds']
+        self.split_mode = request_json.get('split_mode', SplitMode.FFMPEG)
+        self.num_workers = request_json.get('num_workers', 1)
+        self.vad_parameters = request_json.get('vad_parameters', {})
+
+
+@dataclass
+class AudioSegment:
+    index: int
+    # seconds from the start of the input audio
+    offset: float
+    # path of the segment file, or a view into the decoded waveform
+    audio: Union[str, torch.Tensor]
+    # speech chunks in samples relative to the segment start, when the whole file went through the VAD
+    speech_chunks: Optional[List[dict]] = None
+    # exact position in the decoded input, for segments sliced in memory
+    start_sample: Optional[int] = None
 
 
 def create_clip(raw_audio: str, slice_audio: str, clipFromSecond: int, clipDuration: int):
@@ -44,14 +91,17 @@ def get_audio_file_length(file_path: str):
         raise e
 
 
-def split_audio_file_into_segments(audio_file, duration, segment_duration_seconds, overlap_seconds):
+def split_audio_file_into_segments(audio_file, duration, segment_duration_seconds, overlap_seconds) -> List[AudioSegment]:
     logging.info(
         f"Splitting audio file {audio_file} into segments of {segment_duration_seconds} seconds each (total: {duration} seconds)")
     segments = []
     index = 0
     audio_dir = os.path.dirname(audio_file)
     if os.path.exists(f'{audio_dir}/segments'):
-        return [f'{audio_dir}/segments/{x}' for x in os.listdir(f'{audio_dir}/segments')]
+        for x in os.listdir(f'{audio_dir}/segments'):
+            segment_index = int(x.split('.')[0])
+            segments.append(AudioSegment(segment_index, segment_index * segment_duration_seconds, f'{audio_dir}/segments/{x}'))
+        return segments
     os.makedirs(f"{audio_dir}/segments", exist_ok=True)
     audio_suffix = os.path.splitext(audio_file)[1] # already contains .(dot)
     merge_last_two_segments = False
@@ -64,18 +114,90 @@ def split_audio_file_into_segments(audio_file, duration, segment_duration_second
             logging.info(f"Merging last two segments because the last segment is too short")
             segment_file = f"{audio_dir}/segments/{index}{audio_suffix}"
             create_clip(audio_file, segment_file, i, segment_duration_seconds + 100)
-            segments.append(segment_file)
+            segments.append(AudioSegment(index, i, segment_file))
             break
 
         logging.info(f"Creating segment {i} to {i + segment_duration_seconds} seconds")
         segment_file = f"{audio_dir}/segments/{index}{audio_suffix}"
         create_clip(audio_file, segment_file, i, segment_duration_seconds + overlap_seconds)
-        segments.append(segment_file)
+        segments.append(AudioSegment(index, i, segment_file))
+        index += 1
+    return segments
+
+
+def split_audio_array_into_segments(audio: torch.Tensor, sampling_rate, segment_duration_seconds, overlap_seconds) -> List[AudioSegment]:
+    """Same cut points as split_audio_file_into_segments, but every segment is a view into `audio`."""
+    total_samples = audio.shape[0]
+    duration = total_samples // sampling_rate
+    logging.info(
+        f"Slicing audio into segments of {segment_duration_seconds} seconds each (total: {duration} seconds)")
+    segments = []
+    index = 0
+    merge_last_two_segments = False
+    if duration % segment_duration_seconds < 100:
+        merge_last_two_segments = True
+
+    for i in range(0, duration, segment_duration_seconds):
+        start_sample = i * sampling_rate
+        if merge_last_two_segments and i + 2 * segment_duration_seconds > duration > i + segment_duration_seconds:
+            logging.info(f"Merging last two segments because the last segment is too short")
+            end_sample = min(total_samples, (i + segment_duration_seconds + 100) * sampling_rate)
+            segments.append(AudioSegment(index, i, audio[start_sample:end_sample], start_sample=start_sample))
+            break
+
+        end_sample = min(total_samples, (i + segment_duration_seconds + overlap_seconds) * sampling_rate)
+        segments.append(AudioSegment(index, i, audio[start_sample:end_sample], start_sample=start_sample))
         index += 1
     return segments
 
 
-def run(args: RequestData):
+def split_audio_array_balanced(audio: torch.Tensor, speech_chunks: List[dict], sampling_rate, num_workers) -> List[AudioSegment]:
+    """Slices `audio` at silences into segments of about equal speech for `num_workers` workers."""
+    planned_segments = plan_balanced_segments(speech_chunks, audio.shape[0], num_workers, sampling_rate)
+    logging.info(f"Slicing audio into {len(planned_segments)} segments for {num_workers} workers, speech seconds: "
+                 f"{[round(segment.speech_samples / sampling_rate) for segment in planned_segments]}")
+    return slice_planned_segments(audio, planned_segments, sampling_rate)
+
+
+def split_audio_array_at_silences(audio: torch.Tensor, speech_chunks: List[dict], sampling_rate, segment_duration_seconds) -> List[AudioSegment]:
+    """Slices `audio` about every `segment_duration_seconds`, in the silence nearest to each cut.
+
+    A segment without any silence within a quarter of the duration of its target is cut hard
+    at 1.25 times the duration. Like split_audio_array_into_segments, a last segment shorter
+    than 100 seconds is merged into the one before it.
+    """
+    planned_segments = plan_segments_at_silences(speech_chunks, audio.shape[0], segment_duration_seconds * sampling_rate,
+                                                 100 * sampling_rate)
+    logging.info(f"Slicing audio at silences into {len(planned_segments)} segments, offsets: "
+                 f"{[round(segment.start_sample / sampling_rate, 2) for segment in planned_segments]}")
+    return slice_planned_segments(audio, planned_segments, sampling_rate)
+
+
+def slice_planned_segments(audio: torch.Tensor, planned_segments: List[PlannedSegment], sampling_rate) -> List[AudioSegment]:
+    return [
+        AudioSegment(index, segment.start_sample / sampling_rate, audio[segment.start_sample:segment.end_sample],
+                     segment.speech_chunks, segment.start_sample)
+        for index, segment in enumerate(planned_segments)
+    ]
+
+
+def run(args: RequestData, artifact_cache: Optional[ArtifactCache] = None) -> List[AudioSegment]:
     audio_file_path = args.audio_file_path
+    if args.split_mode in (SplitMode.MEMORY, SplitMode.BALANCED, SplitMode.SILENCE):
+        if artifact_cache is not None:
+            audio = artifact_cache.load_audio(audio_file_path, SAMPLING_RATE)
+        else:
+            audio = decode_audio(audio_file_path, sampling_rate=SAMPLING_RATE)
+        if args.split_mode in (SplitMode.BALANCED, SplitMode.SILENCE):
+            vad_options = VadOptions(**{'chunk_duration_s': WHOLE_FILE_VAD_CHUNK_SECONDS, 'num_threads': os.cpu_count() or 1,
+                                        **args.vad_parameters})
+            if artifact_cache is not None:
+                speech_chunks = artifact_cache.load_speech_chunks(audio_file_path, audio, vad_options, SAMPLING_RATE)
+            else:
+                speech_chunks = get_speech_timestamps(audio, vad_options, sampling_rate=SAMPLING_RATE)
+            if args.split_mode == SplitMode.SILENCE:
+                return split_audio_array_at_silences(audio, speech_chunks, SAMPLING_RATE, args.segment_duration_seconds)
+            return split_audio_array_balanced(audio, speech_chunks, SAMPLING_RATE, args.num_workers)
+        return split_audio_array_into_segments(audio, SAMPLING_RATE, args.segment_duration_seconds, args.overlap_seconds)
     duration = get_audio_file_length(audio_file_path)
     return split_audio_file_into_segments(audio_file_path, duration, args.segment_duration_seconds, args.overlap_seconds)
@@ -0,0 +1,84 @@
+import os
+
+import torch
+
+import artifact_cache
+from artifact_cache import ArtifactCache
+from lib.faster_whisper.vad import VadOptions
+
+
+def write_input(root, name, content):
+    audio_file = os.path.join(root, name, 'input.mp3')
+    os.makedirs(os.path.dirname(audio_file))
+    with open(audio_file, 'wb') as f:
+        f.write(content)
+    return audio_file
+
+
+def test_speech_chunks_are_keyed_by_content_and_options(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_get_speech_timestamps(audio, vad_options, sampling_rate=16000):
+        calls.append(vad_options)
+        return [{'start': 0, 'end': audio.shape[0]}]
+
+    monkeypatch.setattr(artifact_cache, 'get_speech_timestamps', fake_get_speech_timestamps)
+    cache = ArtifactCache(str(tmp_path))
+    audio_file = write_input(str(tmp_path), 'a', b'episode')
+    audio = torch.zeros(16000)
+
+    expected = [{'start': 0, 'end': 16000}]
+    assert cache.load_speech_chunks(audio_file, audio, VadOptions(), 16000) == expected
+    assert cache.load_speech_chunks(audio_file, audio, VadOptions(), 16000) == expected
+    assert len(calls) == 1
+
+    cache.load_speech_chunks(audio_file, audio, VadOptions(onset=0.6), 16000)
+    cache.load_speech_chunks(audio_file, audio, VadOptions(), 16000, start_sample=16000)
+    assert len(calls) == 3
+
+    # same url dir, new content
+    with open(audio_file, 'wb') as f:
+        f.write(b'another episode')
+    cache.load_speech_chunks(audio_file, audio, VadOptions(), 16000)
+    assert len(calls) == 4
+
+
+def test_speech_chunks_batch_runs_the_misses_together(tmp_path, monkeypatch):
+    batches = []
+
+    def fake_get_speech_timestamps_batch(audios, vad_options, sampling_rate=16000):
+        batches.append(len(audios))
+        return [[{'start': 0, 'end': audio.shape[0]}] for audio in audios]
+
+    monkeypatch.setattr(artifact_cache, 'get_speech_timestamps_batch', fake_get_speech_timestamps_batch)
+    cache = ArtifactCache(str(tmp_path))
+    audio_file = write_input(str(tmp_path), 'a', b'episode')
+    audios = [torch.zeros(16000), torch.zeros(8000), torch.zeros(4000)]
+
+    # the first slice is already cached by a single load
+    monkeypatch.setattr(artifact_cache, 'get_speech_timestamps',
+                        lambda audio, vad_options, sampling_rate=16000: [{'start': 0, 'end': audio.shape[0]}])
+    cache.load_speech_chunks(audio_file, audios[0], VadOptions(), 16000)
+
+    expected = [[{'start': 0, 'end': 16000}], [{'start': 0, 'end': 8000}], [{'start': 0, 'end': 4000}]]
+    assert cache.load_speech_chunks_batch(audio_file, audios, [0, 16000, 24000], VadOptions(), 16000) == expected
+    assert cache.load_speech_chunks_batch(audio_file, audios, [0, 16000, 24000], VadOptions(), 16000) == expected
+    assert batches == [2]
+    assert cache.load_speech_chunks(audio_file, audios[2], VadOptions(), 16000, start_sample=24000) == expected[2]
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=250)
+    paths = []
+    for i, name in enumerate(['a', 'b', 'c']):
+        audio_file = write_input(str(tmp_path), name, name.encode())
+        path = os.path.join(os.path.dirname(audio_file), 'artifacts', 'pcm.npy')
+        cache._store(path, lambda f: f.write(b'x' * 100), evict=False)
+        os.utime(path, (1000 + i, 1000 + i))
+        paths.append(path)
+
+    # reading `a` makes `b` the least recently used
+    assert cache._hit(paths[0])
+    cache.evict()
+
+    assert [os.path.exists(path) for path in paths] == [True, False, True]
@@ -0,0 +1,46 @@
+import wave
+
+import numpy as np
+import torch
+
+from lib.faster_whisper import audio
+from lib.faster_whisper.audio import decode_audio, stream_audio
+
+
+def write_wav(path, seconds, sampling_rate=22050, channels=2):
+    rng = np.random.default_rng(0)
+    samples = rng.integers(-20000, 20000, size=int(seconds * sampling_rate) * channels, dtype=np.int16)
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sampling_rate)
+        f.writeframes(samples.tobytes())
+    return str(path)
+
+
+def test_stream_audio_matches_decode_audio(tmp_path):
+    input_file = write_wav(tmp_path / 'input.wav', 7.3)
+    expected = decode_audio(input_file)
+    assert expected.dtype == torch.float32 and abs(expected.shape[0] - 7.3 * 16000) < 1600
+
+    for block_seconds in (1, 2.5, 30):
+        blocks = list(stream_audio(input_file, block_seconds=block_seconds))
+        assert all(block.shape[0] == int(block_seconds * 16000) for block in blocks[:-1])
+        torch.testing.assert_close(torch.cat(blocks), expected, rtol=0, atol=0)
+
+    left, right = decode_audio(input_file, split_stereo=True)
+    blocks = list(stream_audio(input_file, block_seconds=2, split_stereo=True))
+    torch.testing.assert_close(torch.cat([block[0] for block in blocks]), left, rtol=0, atol=0)
+    torch.testing.assert_close(torch.cat([block[1] for block in blocks]), right, rtol=0, atol=0)
+
+
+def test_decode_audio_grows_past_the_estimate(tmp_path, monkeypatch):
+    input_file = write_wav(tmp_path / 'input.wav', 12.1)
+    expected = decode_audio(input_file)
+
+    # a container estimate that is far too small makes the buffer grow several times
+    monkeypatch.setattr(audio, '_estimate_num_samples', lambda container, sampling_rate: 1000)
+    torch.testing.assert_close(decode_audio(input_file), expected, rtol=0, atol=0)
+    # without any estimate the buffer starts at 30 s and is trimmed to the decoded length
+    monkeypatch.setattr(audio, '_estimate_num_samples', lambda container, sampling_rate: None)
+    torch.testing.assert_close(decode_audio(input_file), expected, rtol=0, atol=0)
@@ -0,0 +1,231 @@
+import threading
+
+import ctranslate2
+import numpy as np
+import torch
+
+from lib.faster_whisper.batching import AlignBatcher, DecodeBatcher, EncoderBatcher, split_storage_view
+
+
+def fake_encode_batch(batch_sizes):
+    def encode_batch(features):
+        batch_sizes.append(features.shape[0])
+        return ctranslate2.StorageView.from_array(np.ascontiguousarray(features.numpy()[:, :2, :5] * 2))
+
+    return encode_batch
+
+
+def test_split_storage_view():
+    array = np.arange(24, dtype=np.float32).reshape(3, 2, 4)
+    views = split_storage_view(ctranslate2.StorageView.from_array(array), 3)
+    for i, view in enumerate(views):
+        np.testing.assert_array_equal(np.asarray(view), array[i : i + 1])
+
+
+def test_encoder_batcher_returns_every_caller_its_own_output():
+    batch_sizes = []
+    batcher = EncoderBatcher(fake_encode_batch(batch_sizes), max_batch_size=4, max_wait_ms=200)
+    windows = [torch.full((80, 3000), float(i)) for i in range(8)]
+    outputs = [None] * len(windows)
+
+    def encode(i):
+        outputs[i] = np.asarray(batcher.encode(windows[i]))
+
+    threads = [threading.Thread(target=encode, args=(i,)) for i in range(len(windows))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for i, output in enumerate(outputs):
+        np.testing.assert_array_equal(output, np.full((1, 2, 5), 2.0 * i, dtype=np.float32))
+    assert sum(batch_sizes) == 8 and max(batch_sizes) <= 4 and len(batch_sizes) < 8
+    assert batcher.num_windows == 8 and batcher.num_batches == len(batch_sizes)
+
+
+def test_encoder_batches_run_concurrently():
+    # each batch waits for the other one, which only finishes when both run at the same time
+    running = threading.Barrier(2, timeout=5)
+    batch_sizes = []
+
+    def encode_batch(features):
+        running.wait()
+        return fake_encode_batch(batch_sizes)(features)
+
+    batcher = EncoderBatcher(encode_batch, max_batch_size=1, max_wait_ms=0, num_threads=2)
+    outputs = [None] * 2
+
+    def encode(i):
+        outputs[i] = np.asarray(batcher.encode(torch.full((80, 3000), float(i))))
+
+    threads = [threading.Thread(target=encode, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for i, output in enumerate(outputs):
+        np.testing.assert_array_equal(output, np.full((1, 2, 5), 2.0 * i, dtype=np.float32))
+    assert batch_sizes == [1, 1] and batcher.num_batches == 2
+
+
+def test_encoder_batcher_propagates_errors():
+    def encode_batch(features):
+        raise RuntimeError("out of memory")
+
+    batcher = EncoderBatcher(encode_batch, max_wait_ms=0)
+    try:
+        batcher.encode(torch.zeros(80, 3000))
+    except RuntimeError as e:
+        assert str(e) == "out of memory"
+    else:
+        raise AssertionError("expected the encoder error")
+
+
+def test_decode_batcher_groups_by_options():
+    calls = []
+
+    def generate(encoder_output, prompts, **kwargs):
+        calls.append((np.asarray(encoder_output)[:, 0, 0].tolist(), prompts, kwargs))
+        return [(prompt, kwargs["sampling_temperature"]) for prompt in prompts]
+
+    batcher = DecodeBatcher(generate, max_batch_size=8, max_wait_ms=200)
+    results = [None] * 6
+
+    def decode(i):
+        encoder_output = ctranslate2.StorageView.from_array(np.full((1, 3, 4), float(i), dtype=np.float32))
+        temperature = 0.0 if i % 2 == 0 else 0.2
+        results[i] = batcher.generate(encoder_output, [i], sampling_temperature=temperature, suppress_tokens=[-1])
+
+    threads = [threading.Thread(target=decode, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [([i], 0.0 if i % 2 == 0 else 0.2) for i in range(6)]
+    assert len(calls) == 2
+    for outputs, prompts, kwargs in calls:
+        # every prompt is decoded against its own encoder output, with list arguments restored
+        assert outputs == [prompt[0] for prompt in prompts]
+        assert kwargs["suppress_tokens"] == [-1]
+        assert {prompt[0] % 2 for prompt in prompts} == {int(kwargs["sampling_temperature"] > 0)}
+
+
+def fake_generate(calls):
+    # a result that depends on every option, so a prompt decoded with the options of
+    # another prompt gets a different result than on its own
+    def generate(encoder_output, prompts, beam_size=5, sampling_temperature=0.0, suppress_tokens=(-1,), **kwargs):
+        assert len({len(prompt) for prompt in prompts}) == 1, "prompts of different lengths in one batch"
+        calls.append(len(prompts))
+        outputs = np.asarray(encoder_output)[:, 0, 0].tolist()
+        return [
+            (output, tuple(prompt), beam_size, sampling_temperature, tuple(suppress_tokens))
+            for output, prompt in zip(outputs, prompts)
+        ]
+
+    return generate
+
+
+def test_decode_batcher_matches_unbatched_generate():
+    calls = []
+    generate = fake_generate(calls)
+    batcher = DecodeBatcher(generate, max_batch_size=8, max_wait_ms=200, num_threads=2)
+    requests = []
+    for i in range(16):
+        prompt = [50258] + [i] * (i % 3)
+        options = {
+            "beam_size": 5 if i % 4 else 1,
+            "sampling_temperature": 0.0 if i % 5 else 0.4,
+            "suppress_tokens": [-1] if i % 7 else [-1, 220],
+        }
+        requests.append((np.full((1, 3, 4), float(i), dtype=np.float32), prompt, options))
+
+    expected = [
+        generate(ctranslate2.StorageView.from_array(output), [prompt], **options)[0]
+        for output, prompt, options in requests
+    ]
+    calls.clear()
+    results = [None] * len(requests)
+
+    def decode(i):
+        output, prompt, options = requests[i]
+        results[i] = batcher.generate(ctranslate2.StorageView.from_array(output), prompt, **options)
+
+    threads = [threading.Thread(target=decode, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == expected
+    assert sum(calls) == len(requests) and max(calls) > 1
+
+
+def test_align_batcher_returns_every_caller_its_own_items():
+    calls = []
+
+    def align(encoder_output, start_sequence, text_tokens, num_frames, median_filter_width=7):
+        outputs = np.asarray(encoder_output)[:, 0, 0].tolist()
+        calls.append((start_sequence, len(text_tokens)))
+        return [(output, tokens, frames) for output, tokens, frames in zip(outputs, text_tokens, num_frames)]
+
+    batcher = AlignBatcher(align, max_batch_size=8, max_wait_ms=200)
+    results = [None] * 5
+
+    def align_window(i):
+        # caller 4 aligns two items of one batched encoder output
+        size = 2 if i == 4 else 1
+        encoder_output = ctranslate2.StorageView.from_array(np.full((size, 3, 4), float(i), dtype=np.float32))
+        start_sequence = [1, 2] if i < 3 else [1, 3]
+        results[i] = batcher.align(encoder_output, start_sequence, [[i]] * size, 100 + i)
+
+    threads = [threading.Thread(target=align_window, args=(i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for i, result in enumerate(results):
+        assert result == [(float(i), [i], 100 + i)] * (2 if i == 4 else 1)
+    assert sorted(calls) == [([1, 2], 3), ([1, 3], 3)]
+
+
+def test_align_batcher_matches_unbatched_align():
+    def align(encoder_output, start_sequence, text_tokens, num_frames, median_filter_width=7):
+        outputs = np.asarray(encoder_output)[:, 0, 0].tolist()
+        results = []
+        for output, tokens, frames in zip(outputs, text_tokens, num_frames):
+            # one (token, frame) pair per token, spread over the frames of the item
+            alignments = [(k, int(output) + k * frames // len(tokens)) for k in range(len(tokens))]
+            results.append((alignments, [round(0.1 * token, 1) for token in tokens], median_filter_width))
+        return results
+
+    batcher = AlignBatcher(align, max_batch_size=4, max_wait_ms=200, num_threads=2)
+    requests = []
+    for i in range(10):
+        size = 1 + i % 3
+        output = np.stack([np.full((3, 4), float(10 * i + k), dtype=np.float32) for k in range(size)])
+        text_tokens = [[50365 + k] * (1 + (i + k) % 5) for k in range(size)]
+        num_frames = [100 + 37 * i + k for k in range(size)]
+        requests.append((output, text_tokens, num_frames))
+
+    expected = [
+        [align(ctranslate2.StorageView.from_array(output[k : k + 1]), [50258], [tokens], [frames])[0]
+         for k, (tokens, frames) in enumerate(zip(text_tokens, num_frames))]
+        for output, text_tokens, num_frames in requests
+    ]
+    results = [None] * len(requests)
+
+    def align_window(i):
+        output, text_tokens, num_frames = requests[i]
+        results[i] = batcher.align(ctranslate2.StorageView.from_array(output), [50258], text_tokens, num_frames)
+
+    threads = [threading.Thread(target=align_window, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == expected
+    assert batcher.num_requests == len(requests) and batcher.num_batches < len(requests)
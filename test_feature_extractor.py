@@ -0,0 +1,47 @@
+import threading
+
+import torch
+
+from lib.faster_whisper.feature_extractor import FeatureExtractor
+
+
+def test_batched_features_match_single_features():
+    feature_extractor = FeatureExtractor(device='cpu')
+    generator = torch.Generator().manual_seed(0)
+    waveforms = [torch.randn(length, generator=generator) * scale
+                 for length, scale in ((16000 * 30, 0.1), (16000 * 7, 1.0), (16000 * 18 + 123, 0.01))]
+
+    batched = feature_extractor(waveforms)
+    for i, waveform in enumerate(waveforms):
+        single = feature_extractor(waveform)
+        frames = waveform.shape[0] // feature_extractor.hop_length
+        torch.testing.assert_close(batched[i, :, :frames], single[:, :frames], rtol=1e-4, atol=1e-4)
+
+
+def test_chunk_length_does_not_change_the_extractor():
+    feature_extractor = FeatureExtractor(device='cpu')
+    waveform = torch.zeros(16000 * 5)
+    assert feature_extractor(waveform, chunk_length=10).shape[-1] == (16000 * 15) // 160
+    assert (feature_extractor.n_samples, feature_extractor.nb_max_frames) == (480000, 3000)
+    assert feature_extractor.chunk_size(10) == (160000, 1000)
+
+
+def test_concurrent_calls():
+    feature_extractor = FeatureExtractor(device='cpu')
+    waveform = torch.randn(16000 * 3, generator=torch.Generator().manual_seed(1))
+    expected = feature_extractor(waveform, chunk_length=5)
+    results = []
+
+    def extract(chunk_length):
+        results.append((chunk_length, feature_extractor(waveform, chunk_length=chunk_length)))
+
+    threads = [threading.Thread(target=extract, args=(5 if i % 2 else 20,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for chunk_length, features in results:
+        assert features.shape[-1] == (16000 * (3 + chunk_length)) // 160
+        if chunk_length == 5:
+            torch.testing.assert_close(features, expected)
@@ -0,0 +1,89 @@
+import threading
+
+import job_queue
+from job_queue import AsrJob, AsrJobQueue, JobStatus
+
+
+def fake_stream(lines, error=None, release=None):
+    def stream_asr_task(audio_url, num_workers, segment_duration, transcriber):
+        for line in lines:
+            if release is not None:
+                release.wait()
+            yield line
+        if error is not None:
+            raise error
+
+    return stream_asr_task
+
+
+def start_queue(monkeypatch, stream, **kwargs) -> AsrJobQueue:
+    monkeypatch.setattr(job_queue, 'get_transcriber', lambda model_size, num_workers, batching=None: object())
+    monkeypatch.setattr(job_queue, 'stream_asr_task', stream)
+    monkeypatch.setattr(job_queue, 'format_segment', str)
+    jobs = AsrJobQueue(pool_size=1, **kwargs)
+    jobs.start()
+    return jobs
+
+
+def wait_finished(jobs: AsrJobQueue, job: AsrJob) -> list:
+    lines = list(jobs.iter_lines(job))
+    jobs.queue.join()
+    return lines
+
+
+def test_job_lines_and_status(monkeypatch):
+    jobs = start_queue(monkeypatch, fake_stream(['a', 'b']))
+    job = jobs.submit('http://audio', 600)
+
+    assert wait_finished(jobs, job) == ['a', 'b']
+    job = jobs.get(job.id)
+    assert (job.status, job.result, job.error) == (JobStatus.SUCCEEDED, ['a', 'b'], None)
+    assert job.started_at is not None and job.finished_at is not None
+
+
+def test_failed_job_keeps_its_lines(monkeypatch):
+    jobs = start_queue(monkeypatch, fake_stream(['a'], error=RuntimeError('bad audio')))
+    job = jobs.submit('http://audio', 600)
+
+    assert wait_finished(jobs, job) == ['a']
+    job = jobs.get(job.id)
+    assert (job.status, job.error) == (JobStatus.FAILED, 'bad audio')
+
+
+def test_iter_lines_follows_a_running_job(monkeypatch):
+    release = threading.Event()
+    jobs = start_queue(monkeypatch, fake_stream(['a', 'b'], release=release))
+    job = jobs.submit('http://audio', 600)
+
+    lines = jobs.iter_lines(job)
+    release.set()
+    assert list(lines) == ['a', 'b']
+
+
+def test_finished_jobs_are_evicted_by_count(monkeypatch):
+    jobs = start_queue(monkeypatch, fake_stream(['a']), max_finished_jobs=2)
+    job_ids = []
+    for _ in range(3):
+        job = jobs.submit('http://audio', 600)
+        job_ids.append(job.id)
+        wait_finished(jobs, job)
+
+    assert jobs.get(job_ids[0]) is None
+    assert [jobs.get(job_id).status for job_id in job_ids[1:]] == [JobStatus.SUCCEEDED] * 2
+
+
+def test_finished_jobs_are_evicted_by_ttl(monkeypatch):
+    jobs = start_queue(monkeypatch, fake_stream(['a']), finished_job_ttl=0)
+    job = jobs.submit('http://audio', 600)
+    # the lines of a job are followed after it was evicted
+    assert wait_finished(jobs, job) == ['a']
+
+    assert jobs.get(job.id) is None and jobs.finished == {}
+
+
+def test_the_queue_passes_batching_to_its_transcriber(monkeypatch):
+    calls = []
+    monkeypatch.setattr(job_queue, 'get_transcriber',
+                        lambda model_size, num_workers, batching=None: calls.append(batching) or object())
+    AsrJobQueue(pool_size=1, batching=True).start()
+    assert calls == [True]
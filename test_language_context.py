@@ -0,0 +1,23 @@
+import torch
+
+from language_context import LanguageContext, probe_starts
+from split_audio_files import AudioSegment
+
+
+def test_probe_starts_follow_the_speech():
+    # 100 s of audio with speech only in [40 s, 60 s) and [80 s, 100 s)
+    segment = AudioSegment(0, 0, torch.zeros(16000 * 100),
+                           speech_chunks=[{'start': 16000 * 40, 'end': 16000 * 60}, {'start': 16000 * 80, 'end': 16000 * 100}])
+    # probes centered on the speech at 50 s and 90 s, the second one moved back inside the audio
+    assert probe_starts(segment, 2, 16000 * 30) == [16000 * 35, 16000 * 70]
+    assert probe_starts(AudioSegment(0, 0, torch.zeros(16000 * 10)), 1, 16000 * 30) == [0]
+
+
+def test_language_for():
+    context = LanguageContext('zh', 0.9, [['zh'], ['zh', 'zh']])
+    assert context.language_for(1) == 'zh'
+
+    context = LanguageContext('multi', 1, [['zh', 'zh'], ['zh', 'en'], []])
+    assert context.language_for(0) == 'zh'
+    assert context.language_for(1) is None and context.language_for(1, recheck=False) == 'multi'
+    assert context.language_for(2) is None
@@ -0,0 +1,95 @@
+from multiprocessing.shared_memory import SharedMemory
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+import process_backend
+from process_backend import SharedAudio, _transcribe, share_audio_segments, split_cores
+from split_audio_files import AudioSegment
+
+
+class FakeTranscriber:
+    def __init__(self):
+        self.calls = []
+
+    def iter_segments(self, audio, offset, options, speech_chunks=None):
+        self.calls.append((audio, offset, speech_chunks))
+        yield SimpleNamespace(start=offset, end=offset + 1.5, text='你好')
+
+
+def audio_segments():
+    audio = torch.from_numpy(np.arange(10, dtype=np.float32))
+    return [
+        AudioSegment(0, 0, audio[0:4], start_sample=0),
+        AudioSegment(1, 4 / 16000, 'tmp/x/segments/1.mp3'),
+        AudioSegment(2, 4 / 16000, audio[4:10], start_sample=4),
+    ]
+
+
+def test_share_audio_segments():
+    segments = audio_segments()
+    with share_audio_segments(segments) as refs:
+        assert refs[1] == 'tmp/x/segments/1.mp3'
+        assert (refs[0].start, refs[0].end, refs[2].start, refs[2].end) == (0, 4, 4, 10)
+        assert refs[0].name == refs[2].name
+        shm = SharedMemory(name=refs[0].name)
+        np.testing.assert_array_equal(np.ndarray((10,), dtype=np.float32, buffer=shm.buf), np.arange(10))
+        shm.close()
+
+    # the block is gone once the job is done
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=refs[0].name)
+
+
+def test_share_audio_segments_without_tensors():
+    with share_audio_segments([AudioSegment(0, 0, 'a.mp3'), AudioSegment(1, 600, 'b.mp3')]) as refs:
+        assert refs == ['a.mp3', 'b.mp3']
+
+
+def test_transcribe_reads_the_shared_audio(monkeypatch):
+    transcriber = FakeTranscriber()
+    monkeypatch.setattr(process_backend, '_worker_transcriber', transcriber)
+    options = SimpleNamespace(vad_filter=False, vad_parameters={})
+    segments = audio_segments()
+
+    with share_audio_segments(segments) as refs:
+        result = _transcribe('tmp/x/input.mp3', refs[2], 10.0, options, [{'start': 0, 'end': 6}], 4)
+
+    assert result == [(10.0, 11.5, '你好')]
+    audio, offset, speech_chunks = transcriber.calls[0]
+    # a copy that outlives the shared memory block
+    np.testing.assert_array_equal(audio.numpy(), np.arange(4, 10, dtype=np.float32))
+    assert (offset, speech_chunks) == (10.0, [{'start': 0, 'end': 6}])
+
+
+def test_transcribe_runs_the_vad_of_segments_without_speech_chunks(monkeypatch):
+    transcriber = FakeTranscriber()
+    loads = []
+
+    class FakeArtifactCache:
+        def load_speech_chunks(self, audio_file, audio, vad_options, sampling_rate, start_sample=0):
+            loads.append((audio_file, audio.shape[0], vad_options.onset, start_sample))
+            return [{'start': 1, 'end': 3}]
+
+    monkeypatch.setattr(process_backend, '_worker_transcriber', transcriber)
+    monkeypatch.setattr(process_backend, 'get_artifact_cache', FakeArtifactCache)
+    options = SimpleNamespace(vad_filter=True, vad_parameters={'onset': 0.6})
+
+    with share_audio_segments(audio_segments()) as refs:
+        _transcribe('tmp/x/input.mp3', refs[0], 0.0, options)
+        _transcribe('tmp/x/input.mp3', refs[2], 1.0, options, start_sample=4)
+    _transcribe('tmp/x/input.mp3', 'tmp/x/segments/1.mp3', 2.0, options)
+
+    assert loads == [('tmp/x/input.mp3', 4, 0.6, 0), ('tmp/x/input.mp3', 6, 0.6, 4)]
+    # segment files are left to the transcriber's own VAD
+    assert [speech_chunks for _, _, speech_chunks in transcriber.calls] == [[{'start': 1, 'end': 3}]] * 2 + [None]
+
+
+def test_split_cores(monkeypatch):
+    monkeypatch.setattr(process_backend.os, 'sched_getaffinity', lambda pid: {0, 1, 2, 3, 4, 5, 6, 7, 9}, raising=False)
+    assert split_cores(2) == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert split_cores(3) == [[0, 1, 2], [3, 4, 5], [6, 7, 9]]
+    # too few cores to pin every process to its own
+    assert split_cores(10) == [[]] * 10
@@ -0,0 +1,122 @@
+import numpy as np
+
+from scheduler import nearest_gap_cuts, plan_balanced_segments, plan_segments_at_silences, speech_samples, split_at_cuts
+
+
+def random_speech_chunks(rng, total_samples):
+    chunks = []
+    position = int(rng.integers(0, 16000 * 5))
+    while True:
+        start = position
+        end = start + int(rng.exponential(16000 * 8)) + 1600
+        if end >= total_samples:
+            break
+        chunks.append({'start': start, 'end': end})
+        position = end + int(rng.exponential(16000 * 1.5)) + 8000
+    return chunks
+
+
+def in_silence(speech_chunks, sample):
+    return all(not (chunk['start'] < sample < chunk['end']) for chunk in speech_chunks)
+
+
+def test_nearest_gap_cuts():
+    speech_chunks = [{'start': 0, 'end': 100}, {'start': 200, 'end': 300}, {'start': 500, 'end': 600}]
+    # in a gap, closer to the first gap, closer to the second gap, past the end
+    assert nearest_gap_cuts(speech_chunks, [150, 220, 290, 900]) == [150, 400]
+    assert nearest_gap_cuts(speech_chunks, [120, 420]) == [120, 420]
+    assert nearest_gap_cuts(speech_chunks, [50, 550]) == [150, 400]
+    # without a silence between the speech chunks, cut at the targets
+    assert nearest_gap_cuts(speech_chunks[:1], [50, 80]) == [50, 80]
+    assert nearest_gap_cuts([{'start': 0, 'end': 100}, {'start': 100, 'end': 200}], [150, 150]) == [150]
+
+
+def test_split_at_cuts_shifts_speech_chunks():
+    speech_chunks = [{'start': 0, 'end': 100}, {'start': 200, 'end': 300}, {'start': 500, 'end': 600}]
+    segments = split_at_cuts(speech_chunks, [150, 400], 700)
+
+    assert [(segment.start_sample, segment.end_sample) for segment in segments] == [(0, 150), (150, 400), (400, 700)]
+    assert [segment.speech_chunks for segment in segments] == [
+        [{'start': 0, 'end': 100}],
+        [{'start': 50, 'end': 150}],
+        [{'start': 100, 'end': 200}],
+    ]
+
+
+def test_plan_balanced_segments():
+    rng = np.random.default_rng(0)
+    for num_workers in (1, 3, 7):
+        total_samples = 16000 * 75 * 60
+        speech_chunks = random_speech_chunks(rng, total_samples)
+        segments = plan_balanced_segments(speech_chunks, total_samples, num_workers, 16000)
+
+        assert len(segments) == 2 * num_workers
+        assert segments[0].start_sample == 0 and segments[-1].end_sample == total_samples
+        assert all(a.end_sample == b.start_sample for a, b in zip(segments[:-1], segments[1:]))
+        assert all(in_silence(speech_chunks, segment.start_sample) for segment in segments)
+        assert sum(segment.speech_samples for segment in segments) == speech_samples(speech_chunks)
+
+        # every segment is within one speech chunk of an equal share
+        share = speech_samples(speech_chunks) / len(segments)
+        longest_chunk = max(chunk['end'] - chunk['start'] for chunk in speech_chunks)
+        assert all(abs(segment.speech_samples - share) <= longest_chunk for segment in segments)
+
+
+def test_plan_balanced_segments_without_silences():
+    # 40 minutes of speech that the VAD did not split anywhere
+    total_samples = 16000 * 41 * 60
+    speech_chunks = [{'start': 16000 * 30, 'end': 16000 * 40 * 60}]
+    segments = plan_balanced_segments(speech_chunks, total_samples, 3, 16000)
+
+    assert len(segments) == 6
+    assert segments[0].start_sample == 0 and segments[-1].end_sample == total_samples
+    assert sum(segment.speech_samples for segment in segments) == speech_samples(speech_chunks)
+    share = speech_samples(speech_chunks) / len(segments)
+    assert all(abs(segment.speech_samples - share) <= 1 for segment in segments)
+    assert segments[1].speech_chunks == [{'start': 0, 'end': segments[1].end_sample - segments[1].start_sample}]
+
+
+def test_plan_balanced_segments_keeps_short_audio_whole():
+    speech_chunks = [{'start': 16000, 'end': 16000 * 50}, {'start': 16000 * 52, 'end': 16000 * 90}]
+    segments = plan_balanced_segments(speech_chunks, 16000 * 100, 7, 16000)
+    assert [(segment.start_sample, segment.end_sample) for segment in segments] == [(0, 16000 * 100)]
+    assert plan_balanced_segments([], 16000 * 100, 7, 16000)[0].speech_chunks == []
+
+
+def test_plan_segments_at_silences():
+    rng = np.random.default_rng(1)
+    total_samples = 16000 * 75 * 60
+    speech_chunks = random_speech_chunks(rng, total_samples)
+    segment_samples = 16000 * 600
+    segments = plan_segments_at_silences(speech_chunks, total_samples, segment_samples, 16000 * 100)
+
+    # 75 minutes: cuts near 10, 20, ..., 70 minutes, the 5 minute tail is long enough to keep
+    assert len(segments) == 8
+    for k, segment in enumerate(segments[1:], start=1):
+        assert in_silence(speech_chunks, segment.start_sample)
+        assert abs(segment.start_sample - k * segment_samples) < 16000 * 30
+
+    # 61 minutes: the 1 minute tail is merged into the segment before it
+    total_samples = 16000 * 61 * 60
+    segments = plan_segments_at_silences(speech_chunks, total_samples, segment_samples, 16000 * 100)
+    assert len(segments) == 6 and segments[-1].end_sample == total_samples
+
+
+def test_plan_segments_at_silences_cuts_hard_at_the_maximum_length():
+    segment_samples = 16000 * 600
+    max_segment_samples = 16000 * 750
+    # speech without any pause for 35 minutes, then a pause at 36 minutes
+    speech_chunks = [{'start': 0, 'end': 16000 * 35 * 60}, {'start': 16000 * 36 * 60, 'end': 16000 * 45 * 60}]
+    total_samples = 16000 * 45 * 60
+    segments = plan_segments_at_silences(speech_chunks, total_samples, segment_samples, 16000 * 100)
+
+    # cut hard at 12.5 and 25 minutes, then at the silence 10 minutes after that
+    assert [segment.start_sample for segment in segments] == [0, max_segment_samples, 2 * max_segment_samples,
+                                                              16000 * 35 * 60]
+    assert all(segment.end_sample - segment.start_sample <= max_segment_samples for segment in segments[:-1])
+    assert sum(segment.speech_samples for segment in segments) == speech_samples(speech_chunks)
+
+    # a shorter maximum cuts before the silence comes in reach
+    segments = plan_segments_at_silences(speech_chunks, total_samples, segment_samples, 0, 16000 * 660)
+    assert [segment.start_sample for segment in segments][:4] == [0, 16000 * 660, 16000 * 1320, 16000 * 1980]
+
@@ -0,0 +1,66 @@
+import json
+import threading
+
+import job_queue
+import server
+from job_queue import AsrJobQueue, JobStatus
+
+
+def client_with_lines(monkeypatch, lines):
+    def stream_asr_task(audio_url, num_workers, segment_duration, transcriber):
+        yield from lines
+
+    monkeypatch.setattr(job_queue, 'get_transcriber', lambda model_size, num_workers, batching=None: object())
+    monkeypatch.setattr(job_queue, 'stream_asr_task', stream_asr_task)
+    monkeypatch.setattr(job_queue, 'format_segment', str)
+    monkeypatch.setattr(server, 'job_queue', AsrJobQueue(pool_size=1))
+    return server.app.test_client()
+
+
+def test_create_and_get(monkeypatch):
+    client = client_with_lines(monkeypatch, ['[0.00s -> 1.00s] 你好'])
+
+    response = client.post('/api/asr/create', json={'audio_url': 'http://audio', 'segment_duration': 300})
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    server.job_queue.queue.join()
+
+    job = client.get(f'/api/asr/{job_id}').get_json()
+    assert (job['status'], job['result'], job['segment_duration']) == (JobStatus.SUCCEEDED, ['[0.00s -> 1.00s] 你好'], 300)
+    assert client.get('/api/asr/unknown').status_code == 404
+
+
+def test_create_without_audio_url(monkeypatch):
+    client = client_with_lines(monkeypatch, [])
+    response = client.post('/api/asr/create', json={'segment_duration': 300})
+    assert response.status_code == 500 and 'audio_url' in response.get_json()['error']
+
+
+def test_stream_events(monkeypatch):
+    client = client_with_lines(monkeypatch, ['a', 'b'])
+    job_id = client.post('/api/asr/create', json={'audio_url': 'http://audio'}).get_json()['job_id']
+
+    response = client.get(f'/api/asr/{job_id}/stream')
+    assert response.mimetype == 'text/event-stream'
+    events = response.get_data(as_text=True).split('\n\n')[:-1]
+    assert events[:2] == [f"data: {json.dumps({'line': line})}" for line in ['a', 'b']]
+    assert events[2] == f"event: done\ndata: {json.dumps({'status': JobStatus.SUCCEEDED, 'error': None})}"
+    assert client.get('/api/asr/unknown/stream').status_code == 404
+
+
+def test_concurrent_first_requests_share_one_queue(monkeypatch):
+    monkeypatch.setattr(job_queue, 'get_transcriber', lambda model_size, num_workers, batching=None: object())
+    monkeypatch.setattr(server, 'job_queue', None)
+    barrier = threading.Barrier(8)
+    queues = []
+
+    def first_request():
+        barrier.wait()
+        queues.append(server.get_job_queue())
+
+    threads = [threading.Thread(target=first_request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(queue) for queue in queues}) == 1 and queues[0] is server.job_queue
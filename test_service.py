@@ -1,7 +1,28 @@
-from service import handle_asr_task
+from types import SimpleNamespace
+
+import service
+from service import handle_asr_task, prepare_asr_task
 
 def test_handle_asr_task(monkeypatch):
     # result = handle_asr_task('https://media.xyzcdn.net/68a543be8c590c796c4e01bb/FujLApufGgocpqi2YU6Zuq9dckkL.m4a', 1, 600)
     result = handle_asr_task('https://media.xyzcdn.net/65cef9e3cace72dff8d98de3/lnxOGQodYycgLLwFllTjRH7yzwHM.m4a', 7, 600)
 
     print(result)
+
+
+def test_prepare_asr_task_passes_batching_to_the_transcriber(monkeypatch):
+    calls = []
+
+    def get_transcriber(model_size, num_workers, batching=None):
+        calls.append((model_size, num_workers, batching))
+        return SimpleNamespace(model=None)
+
+    monkeypatch.setattr(service, 'download_audio', lambda audio_url: 'tmp/x/input.mp3')
+    monkeypatch.setattr(service, 'get_artifact_cache', lambda: None)
+    monkeypatch.setattr(service, 'split_audio', lambda request_data, artifact_cache: [])
+    monkeypatch.setattr(service, 'get_transcriber', get_transcriber)
+    monkeypatch.setattr(service, 'detect_job_language', lambda model, audio_segments: None)
+
+    prepare_asr_task('http://audio', 4, 600, batching=True)
+    prepare_asr_task('http://audio', 4, 600)
+    assert calls == [('large-v3-turbo', 4, True), ('large-v3-turbo', 4, None)]
@@ -0,0 +1,132 @@
+import random
+import string
+
+import tokenizers
+
+from lib.faster_whisper.tokenizer import Tokenizer, get_char_lang, get_subword_langs, get_tokenizer, token_bytes_table
+
+
+CORPUS = [
+    "今天我们聊一聊金融市场的历史，还有日常生活里的一些小习惯。",
+    "The follow is a conversation which include finance, history, daily life, sports.",
+    "我觉得 self-improvement 这个话题很有意思，对吧？Yes, it's really interesting!",
+    "東京の天気は晴れです。한국어 문장도 조금 있습니다. ภาษาไทย ♪♪ (laughs) [music]",
+    "😀🎉 \ufffd 替换字符 ÿé",
+]
+
+
+def build_tokenizer() -> tokenizers.Tokenizer:
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.BPE())
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = tokenizers.decoders.ByteLevel()
+    trainer = tokenizers.trainers.BpeTrainer(
+        vocab_size=320, initial_alphabet=tokenizers.pre_tokenizers.ByteLevel.alphabet(), show_progress=False
+    )
+    tokenizer.train_from_iterator(CORPUS * 20, trainer)
+    tokenizer.add_special_tokens(
+        ["<|endoftext|>", "<|startoftranscript|>", "<|notimestamps|>"] + ["<|%.2f|>" % (i * 0.02) for i in range(50)]
+    )
+    return tokenizer
+
+
+def reference_split_tokens_on_unicode(tokenizer, tokens):
+    # the implementation that decoded every prefix of a word with the hf tokenizer
+    decoded_full = tokenizer.decode_with_timestamps(tokens)
+    replacement_char = "�"
+
+    words = []
+    word_tokens = []
+    current_tokens = []
+    unicode_offset = 0
+
+    for token in tokens:
+        current_tokens.append(token)
+        decoded = tokenizer.decode_with_timestamps(current_tokens)
+
+        try:
+            replacement_char_index = decoded.index(replacement_char)
+            replacement_char_index += unicode_offset
+        except ValueError:
+            replacement_char_index = None
+
+        if replacement_char_index is None or (
+            replacement_char_index < len(decoded_full) and decoded_full[replacement_char_index] == replacement_char
+        ):
+            words.append(decoded)
+            word_tokens.append(current_tokens)
+            current_tokens = []
+            unicode_offset += len(decoded)
+
+    return words, word_tokens
+
+
+def test_token_bytes_table():
+    hf_tokenizer = build_tokenizer()
+    table = token_bytes_table(hf_tokenizer)
+    assert table is token_bytes_table(hf_tokenizer)
+    assert table[hf_tokenizer.token_to_id("<|endoftext|>")] == b""
+    tokens = hf_tokenizer.encode("金融 finance ♪").ids
+    assert b"".join(table[token] for token in tokens).decode("utf-8") == "金融 finance ♪"
+
+
+def test_split_tokens_matches_decoding_every_prefix():
+    hf_tokenizer = build_tokenizer()
+    tokenizer = Tokenizer(hf_tokenizer, multilingual=False)
+    rng = random.Random(0)
+    texts = CORPUS + ["".join(rng.choice(CORPUS[0] + CORPUS[3] + string.ascii_letters + " ,.") for _ in range(80))
+                      for _ in range(20)]
+
+    for text in texts:
+        tokens = hf_tokenizer.encode(text).ids
+        sequences = [
+            tokens + [tokenizer.eot],
+            [tokenizer.timestamp_begin] + tokens[:7] + [tokenizer.timestamp_begin + 3] + tokens[7:],
+            # truncated and shuffled, with incomplete UTF-8 sequences anywhere
+            rng.sample(tokens, len(tokens))[: len(tokens) // 2] + [tokenizer.eot],
+            # any bytes, broken sequences included
+            [rng.randrange(hf_tokenizer.get_vocab_size()) for _ in range(20)] + [tokenizer.timestamp_begin + 5],
+        ]
+        for sequence in sequences:
+            expected = reference_split_tokens_on_unicode(tokenizer, sequence)
+            assert tokenizer.split_tokens_on_unicode(sequence) == expected
+            assert tokenizer._decode_bytes_with_timestamps(sequence) == tokenizer.decode_with_timestamps(sequence)
+
+
+def test_get_tokenizer_is_shared():
+    hf_tokenizer = build_tokenizer()
+    tokenizer = get_tokenizer(hf_tokenizer, False, info_language="multi")
+    assert get_tokenizer(hf_tokenizer, False, info_language="multi") is tokenizer
+    assert get_tokenizer(hf_tokenizer, False) is not tokenizer
+
+    prompt = " 以下内容是一段中文对话"
+    assert tokenizer.encode_prompt(prompt) == tuple(tokenizer.encode(prompt))
+    assert tokenizer.encode_prompt(prompt) is tokenizer.encode_prompt(prompt)
+
+
+def reference_subword_lang(subword):
+    # the per-character range checks split_tokens_on_multi did before the range table
+    def char_lang(code):
+        for start, end, lang in [(0x4E00, 0x9FFF, "zh"), (0x3400, 0x4DBF, "zh"), (0x20000, 0x2A6DF, "zh"),
+                                 (0x2A700, 0x2B73F, "zh"), (0x2B740, 0x2B81F, "zh"), (0x3040, 0x309F, "ja"),
+                                 (0x30A0, 0x30FF, "ja"), (0xFF66, 0xFF9F, "ja"), (0xAC00, 0xD7AF, "ko"),
+                                 (0x1100, 0x11FF, "ko"), (0x0E00, 0x0E7F, "th"), (0x0E80, 0x0EFF, "lo"),
+                                 (0x1000, 0x109F, "my")]:
+            if start <= code <= end:
+                return lang
+        return "other"
+
+    lang_cnt = {key: 0 for key in ["zh", "ja", "ko", "th", "lo", "my", "other"]}
+    for char in subword:
+        lang_cnt[char_lang(ord(char))] += 1
+    return max(lang_cnt.items(), key=lambda x: x[1])[0]
+
+
+def test_subword_langs_match_per_character_checks():
+    rng = random.Random(2)
+    alphabet = "金融市场のカナ한국ภาษาລາວမြန် abc,.!?" + chr(0x20001) + chr(0x9FFF) + chr(0xA000)
+    subwords = ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 4))) for _ in range(500)]
+
+    assert get_subword_langs(subwords) == [reference_subword_lang(subword) for subword in subwords]
+    assert get_subword_langs(["a中", " 中", "ab中"]) == ["zh", "zh", "other"]
+    assert [get_char_lang(ord(char)) for char in "中のa"] == ["zh", "ja", "other"]
+    assert get_subword_langs([]) == []
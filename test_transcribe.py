@@ -0,0 +1,263 @@
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import ctranslate2
+import numpy as np
+import pytest
+import torch
+
+from lib.faster_whisper import transcribe
+from lib.faster_whisper.feature_extractor import FeatureExtractor
+from lib.faster_whisper.transcribe import (
+    EncoderOutputCache,
+    LazyWords,
+    Segment,
+    TranscriptionOptions,
+    TranscriptionStats,
+    WhisperModel,
+    Word,
+    restore_speech_timestamps,
+)
+
+
+def lazy_words(calls):
+    def resolve():
+        calls.append(1)
+        return [Word(1.0, 1.5, "你", 0.9), Word(1.5, 2.0, "好", 0.8)]
+
+    return LazyWords(resolve)
+
+
+def test_lazy_words_align_once_on_first_read():
+    calls = []
+    words = lazy_words(calls)
+    shifted = words.map(lambda word: Word(word.start + 10, word.end + 10, word.word, word.probability))
+    assert calls == [] and not words.resolved
+
+    assert [word.start for word in shifted] == [11.0, 11.5]
+    assert len(words) == 2 and words[1].word == "好"
+    assert calls == [1]
+
+
+def test_restore_speech_timestamps_keeps_words_lazy():
+    calls = []
+    words = lazy_words(calls)
+    segment = Segment(1, 0, 1.0, 2.0, "你好", [1, 2], -0.1, 1.0, 0.0, words)
+    # the first speech chunk starts 10 s into the audio
+    speech_chunks = [{"start": 16000 * 10, "end": 16000 * 20}]
+
+    restored = list(restore_speech_timestamps([segment], speech_chunks, 16000))
+    assert calls == []
+    assert (restored[0].start, restored[0].end) == (11.0, 12.0)
+    assert [(word.start, word.end) for word in restored[0].words] == [(11.0, 11.5), (11.5, 12.0)]
+    assert calls == [1]
+    # the aligned words keep their times in the speech
+    assert [(word.start, word.end) for word in words] == [(1.0, 1.5), (1.5, 2.0)]
+
+
+def transcription_options(**kwargs):
+    options = dict(
+        beam_size=5,
+        best_of=5,
+        patience=1,
+        length_penalty=1,
+        repetition_penalty=1,
+        no_repeat_ngram_size=0,
+        log_prob_threshold=-1.0,
+        log_prob_low_threshold=None,
+        no_speech_threshold=0.6,
+        compression_ratio_threshold=2.4,
+        condition_on_previous_text=True,
+        prompt_reset_on_temperature=0.5,
+        temperatures=[0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
+        initial_prompt=None,
+        prefix=None,
+        suppress_blank=True,
+        suppress_tokens=[-1],
+        without_timestamps=False,
+        max_initial_timestamp=1.0,
+        word_timestamps=False,
+        prepend_punctuations="",
+        append_punctuations="",
+        multilingual=False,
+        output_language=None,
+        max_new_tokens=None,
+        clip_timestamps="0",
+        hallucination_silence_threshold=None,
+        hotwords=None,
+    )
+    options.update(kwargs)
+    return TranscriptionOptions(**options)
+
+
+class FakeGenerateModel:
+    """Decodes with a low log probability below temperature 0.4.
+
+    The fallbacks wait for `release` when it is given.
+    """
+
+    def __init__(self, release=None):
+        self.release = release
+        self.calls = []
+        self.finished = []
+
+    def generate(self, encoder_output, prompts, **kwargs):
+        temperature = kwargs.get("sampling_temperature", 0.0)
+        self.calls.append(temperature)
+        if self.release is not None and temperature > 0:
+            self.release.wait()
+        self.finished.append(temperature)
+        result = SimpleNamespace(
+            sequences_ids=[[1] * 10], scores=[-3.0 if temperature < 0.4 else -0.1], no_speech_prob=0.0
+        )
+        return [result]
+
+
+class FakeDecodeBatcher:
+    def __init__(self, model):
+        self.model = model
+        self.temperatures = []
+
+    def generate(self, encoder_output, prompt, **kwargs):
+        self.temperatures.append(kwargs.get("sampling_temperature", 0.0))
+        return self.model.generate(encoder_output, [prompt], **kwargs)[0]
+
+
+def whisper_model(model, decode_batcher=None, num_workers=2):
+    whisper = WhisperModel.__new__(WhisperModel)
+    whisper.model = model
+    whisper.decode_batcher = decode_batcher
+    whisper.fallback_executor = ThreadPoolExecutor(num_workers)
+    whisper.time_precision = 0.02
+    whisper.max_length = 448
+    whisper.logger = logging.getLogger("test")
+    return whisper
+
+
+def generate_with_fallback(whisper, **kwargs):
+    stats = TranscriptionStats()
+    tokenizer = SimpleNamespace(decode=lambda tokens: "你好")
+    result, avg_logprob, temperature, compression_ratio = whisper.generate_with_fallback(
+        None, [1, 2], tokenizer, transcription_options(**kwargs), stats
+    )
+    return (avg_logprob, temperature, compression_ratio), stats
+
+
+def test_parallel_fallback_keeps_the_sequential_result():
+    sequential, sequential_stats = generate_with_fallback(whisper_model(FakeGenerateModel()))
+    whisper = whisper_model(FakeGenerateModel())
+    parallel, parallel_stats = generate_with_fallback(whisper, fallback_strategy="parallel")
+
+    assert sequential[1] == parallel[1] == 0.4
+    assert sequential == parallel
+    assert sequential_stats.temperature_results == parallel_stats.temperature_results == {0.4: 1}
+    assert parallel_stats.temperature_attempts == {0.0: 1, 0.2: 1, 0.4: 1}
+
+
+def test_parallel_fallback_goes_through_the_decode_batcher():
+    model = FakeGenerateModel()
+    batcher = FakeDecodeBatcher(model)
+    parallel, _ = generate_with_fallback(whisper_model(model, batcher), fallback_strategy="parallel")
+
+    assert parallel[1] == 0.4
+    assert batcher.temperatures[0] == 0.0 and {0.2, 0.4} <= set(batcher.temperatures)
+    assert len(batcher.temperatures) == len(model.calls)
+
+
+def test_fallback_timeout_is_counted_in_the_stats():
+    release = threading.Event()
+    model = FakeGenerateModel(release)
+    whisper = whisper_model(model, num_workers=2)
+    (avg_logprob, temperature, _), stats = generate_with_fallback(
+        whisper, fallback_strategy="parallel", max_fallback_seconds=0.05
+    )
+
+    # only the first attempt finished in time, it is kept
+    assert avg_logprob < -1.0
+    assert stats.temperature_attempts == {0.0: 1}
+    assert (stats.windows, stats.fallback_timeouts) == (1, 1)
+    assert stats.fallback_seconds >= 0.05
+
+    # the fallbacks still queued were dropped, the two running on the workers finish and are ignored
+    release.set()
+    whisper.fallback_executor.shutdown(wait=True)
+    assert model.calls == [0.0, 0.2, 0.4]
+    assert sorted(model.finished) == [0.0, 0.2, 0.4]
+
+
+class FakeEncoder:
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, features):
+        self.calls += 1
+        batch_size = features.shape[0] if features.ndim == 3 else 1
+        return ctranslate2.StorageView.from_array(np.zeros((batch_size, 1, 1), dtype=np.float32))
+
+
+class FakeLanguageModel(FakeGenerateModel):
+    is_multilingual = True
+    device = "cpu"
+    device_index = [0]
+
+    def detect_language(self, encoder_output):
+        return [[("<|zh|>", 0.99), ("<|en|>", 0.01)]] * encoder_output.shape[0]
+
+
+def test_encoder_cache_releases_the_features_of_evicted_outputs():
+    encoder = FakeEncoder()
+    stats = TranscriptionStats()
+    cache = EncoderOutputCache(encoder, stats, max_entries=2)
+    first, second = torch.zeros(80, 6000), torch.zeros(80, 6000)
+
+    output = cache.get(first, 0, 3000)
+    assert cache.get(first, 0, 3000) is output
+    cache.get(second, 0, 3000)
+    assert set(cache._features) == {id(first), id(second)}
+
+    cache.get(second, 3000, 3000)
+    assert set(cache._features) == {id(second)}
+    assert encoder.calls == stats.encode_calls == 3
+
+
+def test_every_window_is_encoded_once():
+    whisper = whisper_model(FakeGenerateModel())
+    encoder = FakeEncoder()
+    whisper.encode = encoder.encode
+    whisper.feature_extractor = SimpleNamespace(chunk_size=lambda chunk_length: (480000, 3000), time_per_frame=0.01)
+    whisper.frames_per_second = 100
+    tokenizer = SimpleNamespace(decode=lambda tokens: "你好", sot_prev=50361, sot_sequence=[50258], timestamp_begin=50364)
+    # three 30 s windows
+    features = torch.zeros(80, 3000 * 4)
+    stats = TranscriptionStats()
+    cache = EncoderOutputCache(whisper, stats)
+
+    # the language detection probes the first window before the transcription
+    cache.get(features, 0, 3000)
+    segments = list(whisper.generate_segments(features, tokenizer, transcription_options(), cache, stats))
+
+    assert [segment.start for segment in segments] == [0.0, 30.0, 60.0]
+    assert stats.windows == stats.encode_calls == encoder.calls == 3
+
+
+@pytest.mark.parametrize("seconds, windows", [(10, 1), (100, 4)])
+def test_the_language_probe_is_reused_by_the_transcription(monkeypatch, seconds, windows):
+    whisper = whisper_model(FakeLanguageModel())
+    encoder = FakeEncoder()
+    whisper.encode = encoder.encode
+    whisper.feature_extractor = FeatureExtractor()
+    whisper.frames_per_second = 100
+    whisper.hf_tokenizer = None
+    tokenizer = SimpleNamespace(decode=lambda tokens: "你好", sot_prev=50361, sot_sequence=[50258], timestamp_begin=50364)
+    monkeypatch.setattr(transcribe, "get_tokenizer", lambda *args, **kwargs: tokenizer)
+
+    segments, info = whisper.transcribe(
+        np.zeros(16000 * seconds, dtype=np.float32), suppress_tokens=None, word_timestamps_dict={"default": False}
+    )
+    segments = list(segments)
+
+    assert info.language == "zh" and len(segments) == windows
+    assert info.stats.windows == info.stats.encode_calls == encoder.calls == windows
@@ -0,0 +1,41 @@
+import transcriber
+from transcriber import Transcriber, get_transcriber
+
+
+class FakeWhisperModel:
+    def __init__(self, model_size, device, compute_type, num_workers, cpu_threads):
+        self.num_workers = num_workers
+        self.batching = []
+
+    def enable_encoder_batching(self, max_batch_size):
+        self.batching.append(('encoder', max_batch_size))
+
+    def enable_decode_batching(self, max_batch_size):
+        self.batching.append(('decode', max_batch_size))
+
+    def enable_align_batching(self, max_batch_size):
+        self.batching.append(('align', max_batch_size))
+
+
+def fake_models(monkeypatch):
+    monkeypatch.setattr(transcriber, 'WhisperModel', FakeWhisperModel)
+    monkeypatch.setattr(Transcriber, 'warmup', lambda self: None)
+    monkeypatch.setattr(transcriber, '_transcribers', {})
+
+
+def test_batching_is_off_by_default(monkeypatch):
+    fake_models(monkeypatch)
+    monkeypatch.delenv('ASR_BATCHING', raising=False)
+    assert get_transcriber('tiny', 4, device='cpu').model.batching == []
+
+
+def test_batching_from_the_environment(monkeypatch):
+    fake_models(monkeypatch)
+    monkeypatch.setenv('ASR_BATCHING', '1')
+    batched = get_transcriber('tiny', 4, device='cpu')
+    assert batched.model.batching == [('encoder', 4), ('decode', 4), ('align', 4)]
+    # an explicit argument wins over the environment, and gets its own model
+    unbatched = get_transcriber('tiny', 4, device='cpu', batching=False)
+    assert unbatched is not batched and unbatched.model.batching == []
+    # a single worker has nothing to batch with
+    assert get_transcriber('tiny', 1, device='cpu').model.batching == []
@@ -0,0 +1,259 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from lib.faster_whisper import vad
+from lib.faster_whisper.vad import (
+    SileroVADModel,
+    VadOptions,
+    get_batched_speech_probs,
+    get_chunked_speech_probs,
+    get_speech_timestamps,
+    get_speech_timestamps_batch,
+    speech_probs_to_timestamps,
+)
+
+
+def reference_speech_probs_to_timestamps(speech_probs, audio_length_samples, vad_options, sampling_rate=16000):
+    # the per-window loop get_speech_timestamps used before it was vectorized
+    onset = vad_options.onset
+    min_speech_duration_ms = vad_options.min_speech_duration_ms
+    max_speech_duration_s = vad_options.max_speech_duration_s
+    min_silence_duration_ms = vad_options.min_silence_duration_ms
+    window_size_samples = 512
+    speech_pad_ms = vad_options.speech_pad_ms
+    min_speech_samples = sampling_rate * min_speech_duration_ms / 1000
+    speech_pad_samples = sampling_rate * speech_pad_ms / 1000
+    max_speech_samples = sampling_rate * max_speech_duration_s - window_size_samples - 2 * speech_pad_samples
+    min_silence_samples = sampling_rate * min_silence_duration_ms / 1000
+    min_silence_samples_at_max_speech = sampling_rate * 98 / 1000
+
+    triggered = False
+    speeches = []
+    current_speech = {}
+    offset = vad_options.offset
+    temp_end = 0
+    prev_end = next_start = 0
+
+    for i, speech_prob in enumerate(speech_probs):
+        if (speech_prob >= onset) and temp_end:
+            temp_end = 0
+            if next_start < prev_end:
+                next_start = window_size_samples * i
+
+        if (speech_prob >= onset) and not triggered:
+            triggered = True
+            current_speech["start"] = window_size_samples * i
+            continue
+
+        if triggered and (window_size_samples * i) - current_speech["start"] > max_speech_samples:
+            if prev_end:
+                current_speech["end"] = prev_end
+                speeches.append(current_speech)
+                current_speech = {}
+                if next_start < prev_end:
+                    triggered = False
+                else:
+                    current_speech["start"] = next_start
+                prev_end = next_start = temp_end = 0
+            else:
+                current_speech["end"] = window_size_samples * i
+                speeches.append(current_speech)
+                current_speech = {}
+                prev_end = next_start = temp_end = 0
+                triggered = False
+                continue
+
+        if (speech_prob < offset) and triggered:
+            if not temp_end:
+                temp_end = window_size_samples * i
+            if (window_size_samples * i) - temp_end > min_silence_samples_at_max_speech:
+                prev_end = temp_end
+            if (window_size_samples * i) - temp_end < min_silence_samples:
+                continue
+            else:
+                current_speech["end"] = temp_end
+                if (current_speech["end"] - current_speech["start"]) > min_speech_samples:
+                    speeches.append(current_speech)
+                current_speech = {}
+                prev_end = next_start = temp_end = 0
+                triggered = False
+                continue
+
+    if current_speech:
+        if not temp_end:
+            temp_end = audio_length_samples
+        if temp_end - current_speech['start'] > min_speech_samples:
+            current_speech["end"] = temp_end
+            speeches.append(current_speech)
+
+    for i, speech in enumerate(speeches):
+        if i == 0:
+            speech["start"] = int(max(0, speech["start"] - speech_pad_samples))
+        if i != len(speeches) - 1:
+            silence_duration = speeches[i + 1]["start"] - speech["end"]
+            if silence_duration < 2 * speech_pad_samples:
+                speech["end"] += int(silence_duration // 2)
+                speeches[i + 1]["start"] = int(max(0, speeches[i + 1]["start"] - silence_duration // 2))
+            else:
+                speech["end"] = int(min(audio_length_samples, speech["end"] + speech_pad_samples))
+                speeches[i + 1]["start"] = int(max(0, speeches[i + 1]["start"] - speech_pad_samples))
+        else:
+            speech["end"] = int(min(audio_length_samples, speech["end"] + speech_pad_samples))
+
+    return speeches
+
+
+def random_speech_probs(rng, num_windows, smooth):
+    speech_probs = np.empty(num_windows, dtype=np.float32)
+    i = 0
+    is_speech = bool(rng.integers(2))
+    while i < num_windows:
+        length = int(rng.exponential(60 if is_speech else 15)) + 1
+        level = 0.93 if is_speech else 0.03
+        if not smooth:
+            level = rng.random()
+        noise = rng.normal(0, 0.04 if smooth else 0.15, min(length, num_windows - i))
+        speech_probs[i : i + length] = np.clip(level + noise, 0, 1)
+        i += length
+        is_speech = not is_speech
+    return speech_probs
+
+
+VAD_OPTIONS = [
+    VadOptions(),
+    VadOptions(onset=0.6, offset=0.4, min_silence_duration_ms=500, speech_pad_ms=0, min_speech_duration_ms=160),
+    VadOptions(max_speech_duration_s=30, min_silence_duration_ms=160),
+    VadOptions(max_speech_duration_s=1.5, min_silence_duration_ms=100, speech_pad_ms=30),
+    VadOptions(onset=0.5, offset=0.7, min_silence_duration_ms=0, speech_pad_ms=0),
+    VadOptions(onset=0.3, offset=0.1, min_speech_duration_ms=250, max_speech_duration_s=5),
+]
+
+
+@pytest.mark.parametrize("vad_options", VAD_OPTIONS)
+@pytest.mark.parametrize("smooth", [True, False])
+def test_speech_probs_to_timestamps_matches_reference(vad_options, smooth):
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        num_windows = int(rng.integers(1, 5000))
+        speech_probs = random_speech_probs(rng, num_windows, smooth)
+        audio_length_samples = num_windows * 512 - int(rng.integers(1, 512))
+
+        expected = reference_speech_probs_to_timestamps(speech_probs, audio_length_samples, vad_options)
+        assert speech_probs_to_timestamps(speech_probs, audio_length_samples, vad_options) == expected
+
+
+def test_speech_probs_to_timestamps_edges():
+    vad_options = VadOptions(min_silence_duration_ms=0, speech_pad_ms=0)
+    assert speech_probs_to_timestamps(np.zeros(0, dtype=np.float32), 0, vad_options) == []
+    assert speech_probs_to_timestamps(np.zeros(10, dtype=np.float32), 5000, vad_options) == []
+    assert speech_probs_to_timestamps(np.ones(10, dtype=np.float32), 5000, vad_options) == [{"start": 0, "end": 5000}]
+    # one probability per window as the model returns them
+    assert speech_probs_to_timestamps(np.ones((10, 1), dtype=np.float32), 5000, vad_options) == [{"start": 0, "end": 5000}]
+
+
+class FakeEncoderSession:
+    def __init__(self, rng):
+        self.weights = rng.normal(size=(576, 128)).astype(np.float32) / 10
+
+    def run(self, output_names, inputs):
+        return [inputs["input"] @ self.weights]
+
+
+class FakeDecoderSession:
+    # a recurrent state that fades out, like the real model forgets old audio
+    def __init__(self, rng):
+        self.weights = rng.normal(size=128).astype(np.float32)
+
+    def run(self, output_names, inputs):
+        state = 0.5 * inputs["state"] + 0.5 * inputs["input"][None]
+        out = np.tanh(inputs["input"] @ self.weights + state[0] @ self.weights) * 0.5 + 0.5
+        # (batch_size, 1, 1) like the silero v5 decoder
+        return out[:, None, None], state
+
+
+@pytest.fixture
+def fake_vad_model():
+    rng = np.random.default_rng(0)
+    model = SileroVADModel.__new__(SileroVADModel)
+    model.encoder_session = FakeEncoderSession(rng)
+    model.decoder_session = FakeDecoderSession(rng)
+    return model
+
+
+def single_pass_speech_probs(model, audio):
+    padded_audio = np.pad(audio, (0, 512 - audio.shape[0] % 512))
+    return model(padded_audio.reshape(1, -1)).squeeze(0)
+
+
+def test_batched_speech_probs_match_single_pass(fake_vad_model):
+    rng = np.random.default_rng(1)
+    audios = [rng.normal(size=n).astype(np.float32) for n in (3, 1000, 5120, 512 * 40 + 500, 77777)]
+
+    for audio, speech_probs in zip(audios, get_batched_speech_probs(fake_vad_model, audios)):
+        expected = single_pass_speech_probs(fake_vad_model, audio)
+        assert speech_probs.shape == expected.shape
+        np.testing.assert_allclose(speech_probs, expected, atol=1e-4)
+
+
+def test_batched_speech_probs_match_sequential_for_partial_windows(fake_vad_model):
+    rng = np.random.default_rng(3)
+    # none of the lengths but one is a multiple of the 512 samples window
+    lengths = [1, 64, 65, 511, 512 * 7, 512 * 7 - 1, 512 * 7 + 1, 512 * 7 + 448, 512 * 300 + 200]
+    audios = [rng.normal(size=n).astype(np.float32) for n in lengths]
+
+    batched = get_batched_speech_probs(fake_vad_model, audios)
+    for audio, speech_probs in zip(audios, batched):
+        # one clip at a time, as the VAD ran before the clips were batched
+        expected = single_pass_speech_probs(fake_vad_model, audio)
+        assert speech_probs.shape == expected.shape and speech_probs.shape[0] == audio.shape[0] // 512 + 1
+        np.testing.assert_allclose(speech_probs, expected, atol=1e-4)
+        np.testing.assert_allclose(get_batched_speech_probs(fake_vad_model, [audio])[0], expected, atol=1e-4)
+
+
+@pytest.mark.parametrize("num_threads", [1, 3])
+def test_chunked_speech_probs_match_single_pass(fake_vad_model, num_threads):
+    rng = np.random.default_rng(2)
+    audio = rng.normal(size=512 * 1000 + 123).astype(np.float32)
+    expected = single_pass_speech_probs(fake_vad_model, audio)
+
+    speech_probs = get_chunked_speech_probs(fake_vad_model, audio, 100, 30, num_threads=num_threads)
+
+    assert speech_probs.shape == expected.shape
+    np.testing.assert_allclose(speech_probs[:100], expected[:100], atol=1e-4)
+    # the warmup brings the faded state of every other chunk back within tolerance
+    np.testing.assert_allclose(speech_probs, expected, atol=1e-3)
+
+
+@pytest.mark.parametrize("vad_options", VAD_OPTIONS[:3])
+def test_speech_timestamps_batch_matches_single_clips(fake_vad_model, monkeypatch, vad_options):
+    monkeypatch.setattr(vad, "get_vad_model", lambda intra_op_num_threads=0: fake_vad_model)
+    rng = np.random.default_rng(4)
+    # loud and quiet stretches, so the fake model finds speech and silence
+    audios = []
+    for length in (700, 512 * 90, 512 * 400 + 300):
+        audio = rng.normal(size=length).astype(np.float32)
+        audio[length // 3 : length // 2] *= 0.01
+        audios.append(torch.from_numpy(audio))
+
+    expected = [get_speech_timestamps(audio, vad_options) for audio in audios]
+    assert get_speech_timestamps_batch(audios, vad_options) == expected
+    assert get_speech_timestamps_batch([], vad_options) == []
+
+
+def test_concurrent_chunks_share_the_cores(fake_vad_model, monkeypatch):
+    requested = []
+
+    def get_vad_model(intra_op_num_threads=0):
+        requested.append(intra_op_num_threads)
+        return fake_vad_model
+
+    monkeypatch.setattr(vad, "get_vad_model", get_vad_model)
+    audio = torch.from_numpy(np.random.default_rng(5).normal(size=16000 * 20).astype(np.float32))
+
+    get_speech_timestamps(audio, VadOptions())
+    get_speech_timestamps(audio, VadOptions(chunk_duration_s=5, chunk_overlap_s=1))
+    get_speech_timestamps(audio, VadOptions(chunk_duration_s=5, chunk_overlap_s=1, num_threads=3))
+    assert requested == [0, 0, max(1, (os.cpu_count() or 1) // 3)]
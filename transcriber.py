@@ -1,8 +1,14 @@
 import logging
-from dataclasses import dataclass
+import os
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 import torch
 from lib.faster_whisper import WhisperModel
-from util import timing
+from lib.faster_whisper.audio import pad_or_trim
+from lib.faster_whisper.transcribe import LazyWords, Segment
+from util import timing, get_rss_mb
 
 
 @dataclass
@@ -12,23 +18,64 @@ class TranscribeOption:
     vad_filter: bool
     vad_parameters: dict
     word_timestamps_dict: dict
+    # align the words only when a consumer reads segment.words, the segments then keep
+    # their decoded timestamps instead of the ones refined from the words
+    lazy_word_timestamps: bool = False
+
+
+@dataclass
+class ModelLoadStats:
+    load_seconds: float
+    warmup_seconds: float
+    rss_before_mb: float
+    rss_after_mb: float
 
 class Transcriber:
-    def __init__(self, model_size: str = 'large-v3-turbo', num_workers: int = 2):
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        compute_type = 'float16' if torch.cuda.is_available() else 'int8'
-        self.model = WhisperModel(model_size, device=device, compute_type=compute_type, num_workers=num_workers)
+    def __init__(self, model_size: str = 'large-v3-turbo', num_workers: int = 2, device: Optional[str] = None, compute_type: Optional[str] = None,
+                 cpu_threads: int = 0, batching: bool = False):
+        device = device or default_device()
+        compute_type = compute_type or default_compute_type(device)
+        self.model = WhisperModel(model_size, device=device, compute_type=compute_type, num_workers=num_workers,
+                                  cpu_threads=cpu_threads)
+        if batching and num_workers > 1:
+            # the segments of a job run in num_workers threads, encode, decode and align their windows together,
+            # the alignment of the word timestamps of 'zh' jobs included
+            self.model.enable_encoder_batching(max_batch_size=num_workers)
+            self.model.enable_decode_batching(max_batch_size=num_workers)
+            self.model.enable_align_batching(max_batch_size=num_workers)
         self.initial_prompt = {
             'zh': '以下内容是一段中文对话，话题涉及金融、历史、日常生活、体育、自我提升等',
             'en': 'The follow is a conversation which include finance, history, daily life, sports, self-improvement etc.'
         }
         self.log_prob_low_threshold = -0.7
+        self.load_stats: Optional[ModelLoadStats] = None
+
+    def warmup(self):
+        # a dummy encode makes ctranslate2 allocate its buffers before the first real job
+        feature_extractor = self.model.feature_extractor
+        features = feature_extractor(torch.zeros(feature_extractor.n_samples), padding=False)
+        self.model.encode(pad_or_trim(features))
 
     @timing
-    def transcribe_segment(self, segment_file: str, offset: int, options: TranscribeOption):
-        logging.info(f'transcribe_segment: {segment_file} with options: {options}')
+    def transcribe_segment(self, segment_audio: Union[str, torch.Tensor], offset: float, options: TranscribeOption,
+                           speech_chunks: Optional[List[dict]] = None, language: Optional[str] = None):
+        return [format_segment(segment)
+                for segment in self.iter_segments(segment_audio, offset, options, speech_chunks, language)]
+
+    def iter_segments(self, segment_audio: Union[str, torch.Tensor], offset: float, options: TranscribeOption,
+                      speech_chunks: Optional[List[dict]] = None, language: Optional[str] = None) -> Iterator[Segment]:
+        """Yields the segments of `segment_audio` as they are decoded, with times shifted by `offset`.
+
+        `language` is a language code or 'multi' decided for the whole job, None to detect it in the segment.
+        """
+        if isinstance(segment_audio, torch.Tensor):
+            logging.info(f'transcribe_segment: {segment_audio.shape[0]} samples at {offset}s, language: {language}, '
+                         f'with options: {options}')
+        else:
+            logging.info(f'transcribe_segment: {segment_audio}, language: {language}, with options: {options}')
         segments, info = self.model.transcribe(
-            segment_file,
+            segment_audio,
+            language=language,
             beam_size=options.beam_size,
             hotwords=options.hotwords,
             vad_filter=options.vad_filter,
@@ -36,22 +83,76 @@ class Transcriber:
             vad_parameters=options.vad_parameters,
             word_timestamps_dict=options.word_timestamps_dict,
             log_prob_low_threshold=self.log_prob_low_threshold,
+            speech_chunks=speech_chunks,
+            lazy_word_timestamps=options.lazy_word_timestamps,
         )
 
-        results = []
+        def shift(word):
+            return replace(word, start=word.start + offset, end=word.end + offset)
+
         for segment in segments:
-            results.append("[%.2fs -> %.2fs] %s" % (segment.start + offset, segment.end + offset, segment.text))
-            # seg_word = []
-            # for word in segment_file.words:
-            #     seg_word.append({'start': word.start, 'end': word.end, 'word': word.word})
-            # results.append(
-            #     {
-            #         'words': seg_word,
-            #         'lang': info.language,
-            #         'lang_prob': info.language_probability,
-            #         'duration': info.duration,
-            #         'duration_vad': info.duration_after_vad,
-            #     }
-            # )
-
-        return results
+            words = segment.words
+            if isinstance(words, LazyWords):
+                # shifting must not align the words nobody reads
+                words = words.map(shift)
+            elif words:
+                words = [shift(word) for word in words]
+            yield replace(segment, start=segment.start + offset, end=segment.end + offset, words=words)
+        logging.info(f'transcribe_segment: done at {offset}s, stats: {info.stats}')
+
+
+def format_segment(segment: Segment) -> str:
+    return format_line(segment.start, segment.end, segment.text)
+
+
+def format_line(start: float, end: float, text: str) -> str:
+    return "[%.2fs -> %.2fs] %s" % (start, end, text)
+
+
+def default_device() -> str:
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def default_compute_type(device: str) -> str:
+    return 'float16' if device == 'cuda' else 'int8'
+
+
+_transcribers: Dict[Tuple[str, str, str, int, bool], Transcriber] = {}
+_transcribers_lock = threading.Lock()
+
+
+def default_batching() -> bool:
+    """Whether transcribers batch the calls of concurrent segments, set with ASR_BATCHING=1."""
+    return os.environ.get('ASR_BATCHING', '0') == '1'
+
+
+def get_transcriber(model_size: str = 'large-v3-turbo', num_workers: int = 2, device: Optional[str] = None, compute_type: Optional[str] = None,
+                    batching: Optional[bool] = None) -> Transcriber:
+    """Returns the process-wide transcriber of (model_size, device, compute_type, num_workers, batching).
+
+    The model is loaded and warmed up on the first call only, every later call shares that instance.
+    `batching` batches the encode, decode and align calls of the concurrent segments, which is
+    off until it is shown to pay off over the parallel model workers. None takes `default_batching()`.
+    """
+    device = device or default_device()
+    compute_type = compute_type or default_compute_type(device)
+    batching = default_batching() if batching is None else batching
+    key = (model_size, device, compute_type, num_workers, batching)
+    with _transcribers_lock:
+        transcriber = _transcribers.get(key)
+        if transcriber is not None:
+            return transcriber
+
+        rss_before = get_rss_mb()
+        start_time = time.time()
+        transcriber = Transcriber(model_size, num_workers=num_workers, device=device, compute_type=compute_type,
+                                  batching=batching)
+        load_seconds = time.time() - start_time
+        start_time = time.time()
+        transcriber.warmup()
+        warmup_seconds = time.time() - start_time
+        transcriber.load_stats = ModelLoadStats(load_seconds, warmup_seconds, rss_before, get_rss_mb())
+        logging.info(f"[get_transcriber] loaded {key}, load: {load_seconds:.2f}s, warmup: {warmup_seconds:.2f}s, "
+                     f"rss: {transcriber.load_stats.rss_before_mb:.0f}MB -> {transcriber.load_stats.rss_after_mb:.0f}MB")
+        _transcribers[key] = transcriber
+        return transcriber
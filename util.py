@@ -1,4 +1,5 @@
 import logging
+import os
 import time
 import functools
 from typing import Callable, Any
@@ -15,4 +16,14 @@ def timing(func: Callable) -> Callable:
 
         return result
 
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+def get_rss_mb() -> float:
+    """Resident set size of the current process in MB."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        import resource
+        # ru_maxrss is the peak, in KB on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024